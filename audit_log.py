@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Append-only audit stream of games and balance changes
+
+Records are compact NDJSON lines written to gzip segments in AUDIT_LOG_DIR.
+A segment is closed and a new one started once it reaches AUDIT_SEGMENT_BYTES
+of raw data or AUDIT_SEGMENT_SECONDS of age. Segment names are the
+millisecond timestamp of their first record, so they sort chronologically.
+
+Usage:
+    python audit_log.py [--user ID] [--since TIME] [--until TIME] [--dir DIR ...]
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import heapq
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from constants import (AUDIT_LOG_DIR, AUDIT_SEGMENT_BYTES, AUDIT_SEGMENT_SECONDS,
+                       AUDIT_FLUSH_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".ndjson.gz"
+
+# Event types
+GAME = "game"
+BALANCE = "balance"
+# Marks the position of a state snapshot in the stream (see snapshots.py)
+SNAPSHOT = "snapshot"
+
+
+class AuditLog:
+    """
+    Writer of the current audit segment.
+
+    Records are compressed as they are appended; the compressor is flushed
+    to disk every AUDIT_FLUSH_INTERVAL seconds, so after a crash only the
+    last interval is lost and the segment stays readable up to that point.
+    """
+
+    def __init__(self, directory=AUDIT_LOG_DIR, segment_bytes=AUDIT_SEGMENT_BYTES,
+                 segment_seconds=AUDIT_SEGMENT_SECONDS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self._file = None
+        self._segment_started = 0.0
+        self._segment_size = 0
+        self._dirty = False
+
+    def _open_segment(self, now):
+        os.makedirs(self.directory, exist_ok=True)
+        millis = int(now * 1000)
+        path = os.path.join(self.directory, f"{millis:013d}{SEGMENT_SUFFIX}")
+        while os.path.exists(path):
+            millis += 1
+            path = os.path.join(self.directory, f"{millis:013d}{SEGMENT_SUFFIX}")
+        self._file = gzip.open(path, "ab")
+        self._segment_started = now
+        self._segment_size = 0
+
+    def append(self, event, user_id, **fields):
+        """Append one record; never raises into the caller"""
+        now = time.time()
+        record = {"t": round(now, 3), "e": event, "u": user_id, **fields}
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        try:
+            if self._file is not None and (self._segment_size >= self.segment_bytes
+                                           or now - self._segment_started >= self.segment_seconds):
+                self.close()
+            if self._file is None:
+                self._open_segment(now)
+            self._file.write(line)
+            self._segment_size += len(line)
+            self._dirty = True
+        except Exception as e:
+            logger.error(f"Error writing audit record {record}: {e}")
+
+    def flush(self):
+        if self._file is not None and self._dirty:
+            self._file.flush()
+            self._dirty = False
+
+    def close(self):
+        """Finish the current segment"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def run_flush(self, interval=AUDIT_FLUSH_INTERVAL):
+        """Flush buffered records periodically"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing audit log: {e}")
+
+
+audit_log = AuditLog()
+
+
+def log_game(user_id, game_type, bet_amount, payout, bet_choice=None, dice_value=None):
+    """Audit a settled game"""
+    audit_log.append(GAME, user_id, game=game_type, bet=bet_amount, payout=payout,
+                     choice=bet_choice, dice=dice_value)
+
+def log_balance(user_id, delta, balance, reason=None):
+    """Audit a balance change"""
+    audit_log.append(BALANCE, user_id, delta=delta, balance=balance, reason=reason)
+
+
+def _segment_paths(directory, since=None, until=None):
+    """Segments that may hold records in [since, until], oldest first"""
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+    except FileNotFoundError:
+        return []
+    starts = [int(name[:-len(SEGMENT_SUFFIX)]) / 1000 for name in names]
+    paths = []
+    for position, (name, start) in enumerate(zip(names, starts)):
+        next_start = starts[position + 1] if position + 1 < len(starts) else None
+        if since is not None and next_start is not None and next_start < since:
+            continue
+        if until is not None and start > until:
+            break
+        paths.append(os.path.join(directory, name))
+    return paths
+
+def iter_records(directory=AUDIT_LOG_DIR, user_id=None, since=None, until=None):
+    """
+    Stream audit records matching the filters, oldest first
+
+    Segments are decompressed line by line; segments outside the time
+    range are not opened at all.
+    """
+    # Cheap byte check before parsing; the writer emits "u" without spaces
+    needle = f'"u":{user_id},'.encode() if user_id is not None else None
+    for path in _segment_paths(directory, since, until):
+        for line in iter_segment_lines(path):
+            if needle is not None and needle not in line:
+                continue
+            record = json.loads(line)
+            if since is not None and record["t"] < since:
+                continue
+            if until is not None and record["t"] > until:
+                return
+            yield record
+
+def iter_segment_lines(path):
+    """Raw NDJSON lines of one segment, decompressed as they are read"""
+    try:
+        with gzip.open(path, "rb") as segment:
+            yield from segment
+    except (EOFError, gzip.BadGzipFile):
+        # Segment still being written, or left by a killed process
+        logger.info(f"Audit segment {path} ends without a gzip trailer")
+
+def _parse_time(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read the audit log")
+    parser.add_argument("--user", type=int, help="Only records of this user ID")
+    parser.add_argument("--since", type=_parse_time, help="Epoch seconds or ISO date/time")
+    parser.add_argument("--until", type=_parse_time, help="Epoch seconds or ISO date/time")
+    parser.add_argument("--dir", action="append", dest="dirs",
+                        help="Audit directory, repeatable (e.g. one per cluster worker)")
+    args = parser.parse_args(argv)
+
+    streams = [iter_records(directory, args.user, args.since, args.until)
+               for directory in (args.dirs or [AUDIT_LOG_DIR])]
+    for record in heapq.merge(*streams, key=lambda record: record["t"]):
+        sys.stdout.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,62 +5,151 @@ Bot initialization and configuration
 """
 
 import os
+import time
+import signal
+import asyncio
 import logging
-from telegram.request import HTTPXRequest
+from functools import partial
+from telegram import Update
 from telegram.ext import (Application, CommandHandler, CallbackQueryHandler,
-                       MessageHandler, filters, ChatMemberHandler)
+                       MessageHandler, filters, ChatMemberHandler, TypeHandler)
 from handlers import (start, profile_handler, play_handler, 
                      game_selection_handler, cancel_handler,
                      chat_member_handler, instruction_handler,
-                     test_api_command)
-from user_data import load_user_data
+                     test_api_command, top_handler, broadcast_command,
+                     exposure_command)
+from user_data import start_loading_user_data, wait_for_user_data, preload_user_shards
+from persistence import SqlitePersistence
+import pending_bets
+from callback_router import CallbackRouter
+from rate_limiter import rate_limit_guard
+from lifecycle import lifecycle
+from broadcast import broadcaster
+from traffic_recorder import recorder
+from telegram_request import build_request, build_get_updates_request, prewarm
 
 logger = logging.getLogger(__name__)
 
-def create_bot():
-    """Create and configure the bot application"""
+# When create_bot started, to report how long startup took
+_startup_began = None
 
-    # Get bot token from environment variable
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        raise ValueError(
-            "No TELEGRAM_BOT_TOKEN found in environment variables")
+# Background loops started in post_init. Application.create_task is not
+# used there: the application is not running yet, so PTB would not await
+# those tasks on shutdown. post_stop cancels and awaits these instead
+_background_tasks = set()
 
-    # Create the application
-    application = Application.builder() \
-        .token(token) \
-        .request(HTTPXRequest(connect_timeout=30, read_timeout=30)) \
-        .build()
+def start_background_task(coroutine):
+    """Run a coroutine until post_stop, keeping a handle to cancel it"""
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
-    # Load user data
-    load_user_data()
+async def stop_background_tasks():
+    """Cancel the background loops and wait for them to finish"""
+    tasks = [task for task in _background_tasks if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for task, result in zip(tasks, results):
+        if isinstance(result, Exception):
+            logger.error(f"Background task {task.get_coro().__qualname__} failed: {result}")
+    if tasks:
+        logger.info(f"Stopped {len(tasks)} background tasks")
 
-    # Register handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", start))
-    application.add_handler(CommandHandler("test", test_api_command))
+async def post_init(application):
+    """Start background work once the application is initialized"""
+    # Subsystems that only run in the background are imported here, not at
+    # module load; rounds pulls in the game engine
+    from invoice_pool import invoice_pool
+    from withdrawals import withdrawal_queue
+    from audit_log import audit_log
+    from responsible_gaming import limits
+    from rounds import rounds
+    from payment_webhook import payment_webhook
+    from crypto_payments import process_payment_update
+    from reconciliation import reconciler
+    from snapshots import snapshotter
 
-    # Main navigation handlers
-    application.add_handler(
-        CallbackQueryHandler(profile_handler, pattern="^profile$"))
-    application.add_handler(
-        CallbackQueryHandler(play_handler, pattern="^play$"))
+    # Open the rest of the send pool while user data finishes loading
+    start_background_task(prewarm(application.bot))
+    # User data was loading while the bot connected to Telegram (getMe)
+    await wait_for_user_data()
+    # Loss limits hold across restarts: replay the last day of games
+    await asyncio.to_thread(limits.rebuild_from_audit)
+    # Refund or pay out games interrupted by the previous shutdown or crash
+    await lifecycle.recover(application.bot)
+    # Walk all user shards so statistics and leaderboards cover every user
+    start_background_task(preload_user_shards())
+    # Pending bets persisted in user_data survive restarts
+    pending_bets.restore_from_user_data(application)
+    start_background_task(pending_bets.run_expiry())
+    # Fill the invoice pool before the first "Сделать ставку" click
+    start_background_task(invoice_pool.run_maintenance())
+    # Resume withdrawals left queued by the previous run
+    await withdrawal_queue.start(application.bot)
+    # Shared rounds roll and post in the results channel
+    rounds.start(application.bot)
+    # Paid invoices arrive through the CryptoBot webhook
+    await payment_webhook.start(partial(process_payment_update, bot=application.bot))
+    # Continue a broadcast interrupted by the previous run
+    await broadcaster.start(application.bot)
+    # Low-priority check of local balances against CryptoBot, first pass in an hour
+    start_background_task(reconciler.run())
+    start_background_task(audit_log.run_flush())
+    # Hourly point-in-time snapshots of users, ledger and queues
+    start_background_task(snapshotter.run())
+    # SIGINT/SIGTERM drain games before PTB stops processing updates
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: start_background_task(stop_gracefully(application)))
+    if _startup_began is not None:
+        logger.info(f"Ready to serve updates {time.monotonic() - _startup_began:.2f}s after create_bot")
 
-    # Game handlers
-    application.add_handler(
-        CallbackQueryHandler(game_selection_handler, pattern="^game_"))
+async def stop_gracefully(application):
+    """
+    Stop polling and payment intake and drain running games while the
+    application still processes updates, then let run_polling stop it
+    """
+    logger.info("Stop signal received, draining running games")
+    if application.updater is not None and application.updater.running:
+        await application.updater.stop()
+    await lifecycle.stop_intake()
+    application.stop_running()
 
-    # API Test handler
-    application.add_handler(
-        CallbackQueryHandler(test_api_command, pattern="^test_api$"))
+async def post_stop(application):
+    """Flush state before the application shuts down (draining first if no stop signal did)"""
+    # Games are drained and state flushed after the loops that write it stopped
+    await stop_background_tasks()
+    await lifecycle.shutdown()
 
-    # Instruction handler
-    application.add_handler(
-        CallbackQueryHandler(instruction_handler, pattern="^instruction$"))
+def register_handlers(application):
+    """Register all command and callback handlers on an application"""
+    # Checked before every other handler: replies to live updates get send
+    # budget ahead of broadcasts, no new work once shutdown began, and floods
+    # are rejected without API calls
+    if recorder.enabled:
+        application.add_handler(TypeHandler(Update, recorder.record_update), group=-4)
+    application.add_handler(TypeHandler(Update, broadcaster.note_update), group=-3)
+    application.add_handler(TypeHandler(Update, lifecycle.intake_guard), group=-2)
+    application.add_handler(TypeHandler(Update, rate_limit_guard), group=-1)
 
-    # Return to main menu
-    application.add_handler(
-        CallbackQueryHandler(cancel_handler, pattern="^back_to_main$"))
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", start))
+    application.add_handler(CommandHandler("test", test_api_command))
+    application.add_handler(CommandHandler("top", top_handler))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("exposure", exposure_command))
+
+    # All inline buttons go through one router keyed by callback_data action
+    router = CallbackRouter()
+    router.add("profile", profile_handler)
+    router.add("play", play_handler)
+    router.add("game", game_selection_handler, str)
+    router.add("test_api", test_api_command)
+    router.add("instruction", instruction_handler)
+    router.add("back", cancel_handler)
+    application.add_handler(CallbackQueryHandler(router.dispatch))
 
     # Handle other messages
     application.add_handler(
@@ -70,4 +159,34 @@ def create_bot():
     application.add_handler(
         ChatMemberHandler(chat_member_handler, ChatMemberHandler.MY_CHAT_MEMBER))
 
+def create_bot():
+    """Create and configure the bot application"""
+    global _startup_began
+    _startup_began = time.monotonic()
+
+    # Load the user index in the background; post_init waits for it
+    start_loading_user_data()
+
+    # Get bot token from environment variable
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise ValueError(
+            "No TELEGRAM_BOT_TOKEN found in environment variables")
+
+    # Create the application
+    builder = Application.builder() \
+        .token(token) \
+        .request(build_request()) \
+        .get_updates_request(build_get_updates_request()) \
+        .persistence(SqlitePersistence()) \
+        .post_init(post_init) \
+        .post_stop(post_stop)
+    # A local Bot API server, or the fake one of replay.py
+    base_url = os.getenv("TELEGRAM_API_BASE_URL")
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+
+    register_handlers(application)
+
     return application
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Announcements to all users: a rate-limited, resumable broadcast
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from telegram.error import Forbidden, BadRequest, RetryAfter, NetworkError
+from constants import (BROADCAST_STATE_FILE, BROADCAST_RATE, BROADCAST_CONCURRENCY,
+                       BROADCAST_CHUNK_SIZE, BROADCAST_LIVE_RESERVE, BROADCAST_MAX_ATTEMPTS)
+from user_data import iter_user_id_chunks, set_user_blocked, unblock_user, save_user_data
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Global send budget of `rate` messages per second.
+
+    Live traffic takes tokens with `reserve` and may push the bucket into
+    debt; `acquire` (used by the broadcast) only proceeds once the bucket is
+    positive again, so game messages are never delayed and the broadcast
+    gets whatever budget they leave.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        return now
+
+    def reserve(self, count=1):
+        """Take tokens for live traffic without waiting"""
+        self._refill()
+        self._tokens = max(self._tokens - count, -self.burst)
+
+    def pause(self, seconds):
+        """Hold all acquisitions for `seconds`, e.g. after a 429 from Telegram"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = self._refill()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+            elif self._tokens >= 1:
+                self._tokens -= 1
+                return
+            else:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Broadcaster:
+    """
+    Sends one announcement to every user who has not blocked the bot.
+
+    User IDs are streamed from the shards in chunks and sent by a pool of
+    `concurrency` worker tasks sharing one TokenBucket. After each chunk the
+    position is checkpointed to `state_path`, so a broadcast interrupted by
+    a crash or restart resumes where it stopped (re-sending at most one
+    chunk). Users the bot can no longer write to are marked blocked and
+    skipped from then on.
+    """
+
+    def __init__(self, state_path=BROADCAST_STATE_FILE, rate=BROADCAST_RATE,
+                 concurrency=BROADCAST_CONCURRENCY, chunk_size=BROADCAST_CHUNK_SIZE, owns=None):
+        self.state_path = state_path
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        # In cluster mode: whether this process owns a user (and answers their commands)
+        self.owns = owns or (lambda user_id: True)
+        self.state = None
+        self._bot = None
+        self._task = None
+
+    def load(self):
+        try:
+            if os.path.exists(self.state_path):
+                with open(self.state_path, 'r', encoding='utf-8') as file:
+                    self.state = json.load(file)
+        except Exception as e:
+            logger.error(f"Error loading broadcast state: {e}")
+
+    def save(self):
+        """Write the broadcast state atomically, or remove it when there is none"""
+        try:
+            if self.state is None:
+                if os.path.exists(self.state_path):
+                    os.remove(self.state_path)
+                return
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.state_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.state, file, ensure_ascii=False)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.state_path)
+        except Exception as e:
+            logger.error(f"Error saving broadcast state: {e}")
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot):
+        """Resume a broadcast interrupted by the previous run"""
+        self._bot = bot
+        self.load()
+        if self.state is not None:
+            logger.info(f"Resuming broadcast {self.state['id']} at shard {self.state['shard']}, "
+                        f"offset {self.state['offset']}")
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop sending; the checkpoint lets the next run continue"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def begin(self, text, parse_mode=None, admin_chat_id=None):
+        """
+        Start broadcasting `text` to all users
+
+        Returns:
+            dict: success and message
+        """
+        if self.running:
+            return {"success": False, "message": "Рассылка уже идет"}
+        if self._bot is None:
+            return {"success": False, "message": "Рассылка недоступна"}
+        self.state = {
+            "id": uuid.uuid4().hex,
+            "text": text,
+            "parse_mode": parse_mode,
+            "admin_chat_id": admin_chat_id,
+            "shard": 0,
+            "offset": 0,
+            "sent": 0,
+            "blocked": 0,
+            "failed": 0,
+            "started_at": time.time(),
+        }
+        self.save()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return {"success": True, "message": f"Рассылка {self.state['id']} запущена"}
+
+    async def cancel(self):
+        """Abort the current broadcast and forget it"""
+        if self.state is None:
+            return {"success": False, "message": "Рассылка не идет"}
+        await self.stop()
+        summary = self.summary()
+        self.state = None
+        self.save()
+        return {"success": True, "message": f"Рассылка отменена. {summary}"}
+
+    def summary(self):
+        state = self.state
+        if state is None:
+            return "Рассылка не идет"
+        return (f"Отправлено: {state['sent']}, заблокировали бота: {state['blocked']}, "
+                f"ошибок: {state['failed']}")
+
+    async def note_update(self, update, context):
+        """
+        Run for every incoming update: reserve send budget for the replies
+        it causes, and un-block users who write to the bot again
+        """
+        self.bucket.reserve(BROADCAST_LIVE_RESERVE)
+        user = update.effective_user
+        if user is not None and update.effective_chat is not None and update.effective_chat.type == "private":
+            unblock_user(user.id)
+
+    async def _run(self):
+        state = self.state
+        queue = asyncio.Queue()
+        workers = [asyncio.get_running_loop().create_task(self._work(queue))
+                   for _ in range(self.concurrency)]
+        try:
+            for shard, offset, user_ids in iter_user_id_chunks(
+                    self.chunk_size, state["shard"], state["offset"]):
+                for user_id in user_ids:
+                    queue.put_nowait(user_id)
+                await queue.join()
+                state["shard"], state["offset"] = shard, offset
+                self.save()
+                # Blocked flags go to disk with the checkpoint
+                if state["blocked"]:
+                    save_user_data()
+
+            elapsed = time.time() - state["started_at"]
+            logger.info(f"Broadcast {state['id']} finished in {elapsed:.0f}s: {self.summary()}")
+            admin_chat_id = state.get("admin_chat_id")
+            if admin_chat_id is not None and self.owns(admin_chat_id):
+                try:
+                    await self._bot.send_message(chat_id=admin_chat_id,
+                                                 text=f"✅ Рассылка завершена. {self.summary()}")
+                except Exception as e:
+                    logger.error(f"Error reporting broadcast to {admin_chat_id}: {e}")
+            self.state = None
+            self.save()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _work(self, queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                self.state[await self._send(user_id)] += 1
+            except Exception as e:
+                logger.error(f"Error broadcasting to user {user_id}: {e}")
+                self.state["failed"] += 1
+            finally:
+                queue.task_done()
+
+    async def _send(self, user_id):
+        """Send the announcement to one user; returns the counter to bump"""
+        for attempt in range(BROADCAST_MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await self._bot.send_message(chat_id=user_id, text=self.state["text"],
+                                             parse_mode=self.state["parse_mode"])
+                return "sent"
+            except RetryAfter as e:
+                logger.warning(f"Broadcast throttled by Telegram for {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+            except Forbidden:
+                set_user_blocked(user_id, True)
+                return "blocked"
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    set_user_blocked(user_id, True)
+                    return "blocked"
+                logger.error(f"Broadcast to user {user_id} rejected: {e}")
+                return "failed"
+            except NetworkError as e:
+                logger.warning(f"Network error broadcasting to user {user_id} (attempt {attempt + 1}): {e}")
+        return "failed"
+
+
+broadcaster = Broadcaster()
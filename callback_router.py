@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Single callback-query handler dispatching on a versioned callback_data encoding
+
+callback_data is "<version>|<action>|<arg>|...". It is split once and the
+action is looked up in a dict, so dispatch cost does not grow with the number
+of buttons. Buttons sent before the encoding existed ("profile", "game_bowling",
+...) are still understood.
+
+Usage:
+    python callback_router.py    # dispatch benchmark against a regex handler chain
+"""
+
+import re
+import timeit
+import logging
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_VERSION = "1"
+SEPARATOR = "|"
+
+# Telegram limit for callback_data
+MAX_CALLBACK_DATA_BYTES = 64
+
+# Unversioned callback_data of buttons already sent to users
+LEGACY_CALLBACKS = {
+    "profile": ("profile", []),
+    "play": ("play", []),
+    "test_api": ("test_api", []),
+    "instruction": ("instruction", []),
+    "back_to_main": ("back", []),
+}
+LEGACY_GAME_PREFIX = "game_"
+
+
+def callback_data(action, *args):
+    """Encode a button's callback_data"""
+    data = SEPARATOR.join((CALLBACK_VERSION, action, *map(str, args)))
+    if len(data.encode("utf-8")) > MAX_CALLBACK_DATA_BYTES:
+        raise ValueError(f"callback_data too long: {data}")
+    return data
+
+def parse_callback_data(data):
+    """
+    Decode callback_data
+
+    Returns:
+        tuple: (action or None, list of string arguments)
+    """
+    version, separator, rest = data.partition(SEPARATOR)
+    if separator:
+        if version != CALLBACK_VERSION:
+            return None, []
+        action, *args = rest.split(SEPARATOR)
+        return action, args
+    legacy = LEGACY_CALLBACKS.get(data)
+    if legacy is not None:
+        return legacy
+    if data.startswith(LEGACY_GAME_PREFIX):
+        return "game", [data[len(LEGACY_GAME_PREFIX):]]
+    return None, []
+
+
+class CallbackRouter:
+    """
+    Maps actions to handlers called as handler(update, context, *args).
+
+    Each route declares converters for its positional arguments; callback
+    data with the wrong number or type of arguments is answered and dropped.
+    """
+
+    def __init__(self):
+        self._routes = {}  # action -> (handler, converters)
+
+    def add(self, action, handler, *converters):
+        if SEPARATOR in action:
+            raise ValueError(f"Action must not contain {SEPARATOR!r}: {action}")
+        self._routes[action] = (handler, converters)
+
+    def resolve(self, data):
+        """
+        Find the handler for callback_data
+
+        Returns:
+            tuple: (handler, converted arguments), or (None, None)
+        """
+        action, args = parse_callback_data(data)
+        route = self._routes.get(action)
+        if route is None:
+            return None, None
+        handler, converters = route
+        if len(args) != len(converters):
+            return None, None
+        try:
+            return handler, [convert(arg) for convert, arg in zip(converters, args)]
+        except ValueError:
+            return None, None
+
+    async def dispatch(self, update, context):
+        """Callback for a single CallbackQueryHandler"""
+        query = update.callback_query
+        handler, args = self.resolve(query.data or "")
+        if handler is None:
+            logger.warning(f"Неизвестный callback_data: {query.data}")
+            await query.answer()
+            return
+        await handler(update, context, *args)
+
+
+def benchmark(route_counts=(6, 25, 50, 100, 200), number=200000):
+    """
+    Time resolving the last-registered button with the router and with a
+    chain of regex patterns tried in order, as separate CallbackQueryHandlers do
+    """
+    async def handler(update, context, *args):
+        pass
+
+    print(f"{'routes':>7} {'regex chain ns':>15} {'router ns':>10}")
+    for count in route_counts:
+        actions = [f"action{index}" for index in range(count)]
+        router = CallbackRouter()
+        for action in actions:
+            router.add(action, handler, str)
+        chain = [(re.compile(f"^{action}_"), handler) for action in actions]
+
+        legacy = f"{actions[-1]}_bowling"
+        encoded = callback_data(actions[-1], "bowling")
+
+        def resolve_chain():
+            for pattern, matched in chain:
+                if pattern.match(legacy):
+                    return matched, legacy.split("_", 1)[1:]
+            return None, None
+
+        chain_ns = timeit.timeit(resolve_chain, number=number) / number * 1e9
+        router_ns = timeit.timeit(lambda: router.resolve(encoded), number=number) / number * 1e9
+        print(f"{count:>7} {chain_ns:>15.0f} {router_ns:>10.0f}")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Circuit breaker for calls to external APIs
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an API whose circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of one endpoint.
+
+    After `failure_threshold` failures the circuit opens and calls fail
+    immediately. Once `reset_timeout` seconds have passed a single trial call
+    is let through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+
+    def allow(self):
+        """Whether a call may be made right now"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            # Let exactly one trial call through
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit {self.name} closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit {self.name} opened after {self.failures} failures")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def check(self):
+        """Raise CircuitOpenError if the call may not be made"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable")
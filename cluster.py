@@ -0,0 +1,430 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Multi-process deployment: a front process routes updates to user-sharded workers
+
+The front process polls Telegram and forwards every update, as one JSON line
+over a Unix socket, to worker `user_id % worker_count`. Each worker runs the
+normal handlers on its own Application and owns the user data of its users
+under data/workers/worker_<n>. Messages to channels and groups are sent by
+the front process through a single rate-limited ChannelSender, so all workers
+share one posting budget. CryptoBot updates arrive at the front's webhook and
+are routed the same way, by paying user or by the worker prefix of a pooled
+invoice.
+"""
+
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import itertools
+import multiprocessing
+from collections import deque
+from functools import partial
+from telegram import Update, Message, InlineKeyboardMarkup
+from telegram.error import TelegramError
+from telegram.ext import Application, ExtBot, TypeHandler
+from telegram_request import build_request, build_get_updates_request, prewarm
+from constants import CHANNEL_MESSAGES_PER_MINUTE
+from payment_webhook import payment_webhook
+import user_data
+
+logger = logging.getLogger(__name__)
+
+# Directory for the Unix sockets between the front process and the workers
+SOCKET_DIR = os.getenv("CLUSTER_SOCKET_DIR", "/tmp/casino-bot")
+
+# Base directory for per-worker user data
+WORKER_DATA_DIR = "data/workers"
+
+# Data directory used by the single-process mode, imported on first worker start
+SINGLE_PROCESS_DATA_DIR = "data"
+
+# How long the front process waits for workers to come up
+WORKER_START_TIMEOUT = 30
+
+
+def _worker_socket(index):
+    return os.path.join(SOCKET_DIR, f"worker-{index}.sock")
+
+def _sender_socket():
+    return os.path.join(SOCKET_DIR, "sender.sock")
+
+def _write_line(writer, message):
+    writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+
+def _is_shared_chat(chat_id):
+    """Channels and groups (negative IDs or @usernames) share one posting budget"""
+    if chat_id is None:
+        return False
+    if isinstance(chat_id, str) and chat_id.startswith("@"):
+        return True
+    try:
+        return int(chat_id) < 0
+    except ValueError:
+        return False
+
+
+class ChannelSender:
+    """Sends channel/group messages one at a time within a per-minute budget"""
+
+    def __init__(self, bot, per_minute=CHANNEL_MESSAGES_PER_MINUTE):
+        self.bot = bot
+        self.per_minute = per_minute
+        self._queue = asyncio.Queue()
+        self._sent = deque()
+
+    async def send_message(self, **kwargs):
+        """Queue a send_message call and wait for the resulting Message"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kwargs, future))
+        return await future
+
+    async def _wait_for_slot(self):
+        while True:
+            now = time.monotonic()
+            while self._sent and now - self._sent[0] >= 60:
+                self._sent.popleft()
+            if len(self._sent) < self.per_minute:
+                self._sent.append(now)
+                return
+            await asyncio.sleep(60 - (now - self._sent[0]))
+
+    async def run(self):
+        """Process queued messages forever"""
+        while True:
+            kwargs, future = await self._queue.get()
+            await self._wait_for_slot()
+            try:
+                future.set_result(await self.bot.send_message(**kwargs))
+            except Exception as e:
+                logger.error(f"Error sending shared message to {kwargs.get('chat_id')}: {e}")
+                future.set_exception(e)
+
+
+class ChannelSenderClient:
+    """Worker side of the shared sender: request/response over a Unix socket"""
+
+    def __init__(self, path):
+        self.path = path
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._writer = None
+
+    async def connect(self):
+        # The front process opens the sender socket after starting the workers
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Shared sender socket did not come up in time")
+                await asyncio.sleep(0.2)
+        asyncio.get_running_loop().create_task(self._read_responses(reader))
+
+    async def _read_responses(self, reader):
+        while line := await reader.readline():
+            response = json.loads(line)
+            future = self._pending.pop(response["id"], None)
+            if future is None or future.done():
+                continue
+            if "error" in response:
+                future.set_exception(TelegramError(response["error"]))
+            else:
+                future.set_result(response["result"])
+        for future in self._pending.values():
+            future.set_exception(TelegramError("Shared sender connection closed"))
+        self._pending.clear()
+
+    async def send_message(self, kwargs):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        _write_line(self._writer, {"id": request_id, "kwargs": kwargs})
+        await self._writer.drain()
+        return await future
+
+
+class WorkerBot(ExtBot):
+    """Bot that hands channel and group messages to the front process"""
+
+    __slots__ = ("_shared_sender",)
+
+    def __init__(self, token, shared_sender, **kwargs):
+        super().__init__(token, **kwargs)
+        self._shared_sender = shared_sender
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if not _is_shared_chat(chat_id):
+            return await super().send_message(chat_id=chat_id, text=text, **kwargs)
+        if isinstance(kwargs.get("reply_markup"), InlineKeyboardMarkup):
+            kwargs["reply_markup"] = kwargs["reply_markup"].to_dict()
+        result = await self._shared_sender.send_message({"chat_id": chat_id, "text": text, **kwargs})
+        return Message.de_json(result, self)
+
+
+# --- Worker process ---------------------------------------------------------
+
+def _import_owned_users(index, worker_count):
+    """Copy this worker's users out of the single-process data directory"""
+    owned = (record for record in user_data.iter_user_records(SINGLE_PROCESS_DATA_DIR)
+             if record.user_id % worker_count == index)
+    user_data.import_user_records(owned)
+    user_data.save_user_data()
+
+def _load_worker_users(index, worker_count):
+    first_start = not os.path.exists(user_data.USER_INDEX_FILE)
+    user_data.load_user_data()
+    if first_start:
+        _import_owned_users(index, worker_count)
+
+async def _serve_front(application, reader, writer):
+    from crypto_payments import process_payment_update
+
+    while line := await reader.readline():
+        message = json.loads(line)
+        if message["type"] == "update":
+            await application.update_queue.put(Update.de_json(message["update"], application.bot))
+        elif message["type"] == "payment":
+            application.create_task(process_payment_update(message["payload"], bot=application.bot))
+    writer.close()
+
+async def _worker_main(index, worker_count, token):
+    from bot import register_handlers
+    from persistence import SqlitePersistence
+    import pending_bets
+    from invoice_pool import invoice_pool
+    from withdrawals import withdrawal_queue
+    from ledger import ledger
+    from reconciliation import Reconciler
+    from audit_log import audit_log
+    from lifecycle import lifecycle
+    from broadcast import broadcaster
+    from snapshots import Snapshotter
+    from responsible_gaming import limits
+    from rounds import rounds
+    from exposure import exposure
+    from traffic_recorder import recorder
+
+    worker_dir = os.path.join(WORKER_DATA_DIR, f"worker_{index}")
+    user_data.configure_storage(worker_dir)
+    # Every worker records the updates routed to it into its own file
+    if recorder.enabled:
+        recorder.path = os.path.join(worker_dir, os.path.basename(recorder.path))
+    # Load users in a thread while connecting to the front and to Telegram
+    loading = asyncio.ensure_future(asyncio.to_thread(_load_worker_users, index, worker_count))
+
+    shared_sender = ChannelSenderClient(_sender_socket())
+    await shared_sender.connect()
+
+    bot = WorkerBot(token, shared_sender,
+                    request=build_request())
+    application = Application.builder() \
+        .bot(bot) \
+        .updater(None) \
+        .persistence(SqlitePersistence(os.path.join(worker_dir, "bot_state.sqlite3"))) \
+        .build()
+    register_handlers(application)
+
+    await application.initialize()
+    await loading
+    await application.start()
+    application.create_task(prewarm(application.bot))
+    application.create_task(user_data.preload_user_shards())
+    pending_bets.restore_from_user_data(application)
+    application.create_task(pending_bets.run_expiry())
+    # Worker-tagged payloads let the front route anonymous pool invoices back here
+    invoice_pool.payload_prefix = f"w{index}:"
+    application.create_task(invoice_pool.run_maintenance())
+    ledger.path = os.path.join(worker_dir, "ledger.sqlite3")
+    audit_log.directory = os.path.join(worker_dir, "audit")
+    application.create_task(audit_log.run_flush())
+    await asyncio.to_thread(limits.rebuild_from_audit)
+    lifecycle.journal.path = os.path.join(worker_dir, "game_journal.sqlite3")
+    lifecycle.checkpoint_path = os.path.join(worker_dir, "checkpoint.json")
+    await lifecycle.recover(application.bot)
+    withdrawal_queue.path = os.path.join(worker_dir, "withdrawals.json")
+    await withdrawal_queue.start(application.bot)
+    reconciler = Reconciler(owns=lambda user_id: user_id % worker_count == index,
+                            payload_prefix=f"w{index}:")
+    application.create_task(reconciler.run())
+    # Every worker broadcasts to its own users with a share of the global rate
+    broadcaster.state_path = os.path.join(worker_dir, "broadcast.json")
+    broadcaster.bucket.rate /= worker_count
+    broadcaster.bucket.burst /= worker_count
+    broadcaster.owns = lambda user_id: user_id % worker_count == index
+    await broadcaster.start(application.bot)
+    rounds.start(application.bot)
+    # Each worker covers its own users' bets with a share of the house limits
+    exposure.max_outcome /= worker_count
+    exposure.max_total /= worker_count
+    application.create_task(Snapshotter(worker_dir).run())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    path = _worker_socket(index)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(partial(_serve_front, application), path=path)
+    logger.info(f"Worker {index}/{worker_count} listening on {path}")
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await lifecycle.shutdown()
+        await application.stop()
+        await application.shutdown()
+        user_data.save_user_data()
+        logger.info(f"Worker {index} stopped")
+
+def run_worker(index, worker_count, token):
+    """Entry point of a worker process"""
+    asyncio.run(_worker_main(index, worker_count, token))
+
+
+# --- Front process ----------------------------------------------------------
+
+class WorkerRouter:
+    """Connections from the front process to every worker"""
+
+    def __init__(self, worker_count):
+        self.worker_count = worker_count
+        self._writers = []
+
+    async def connect(self):
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        for index in range(self.worker_count):
+            while True:
+                try:
+                    _, writer = await asyncio.open_unix_connection(_worker_socket(index))
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"Worker {index} did not start in time")
+                    await asyncio.sleep(0.2)
+            self._writers.append(writer)
+        logger.info(f"Connected to {self.worker_count} workers")
+
+    def worker_for(self, user_id):
+        return user_id % self.worker_count if user_id else 0
+
+    async def send(self, user_id, message):
+        await self.send_to_worker(self.worker_for(user_id), message)
+
+    async def send_to_worker(self, index, message):
+        writer = self._writers[index]
+        _write_line(writer, message)
+        await writer.drain()
+
+
+async def _serve_sender(sender, reader, writer):
+    async def handle(request):
+        kwargs = request["kwargs"]
+        if kwargs.get("reply_markup"):
+            kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(kwargs["reply_markup"], sender.bot)
+        try:
+            message = await sender.send_message(**kwargs)
+            _write_line(writer, {"id": request["id"], "result": message.to_dict()})
+        except Exception as e:
+            _write_line(writer, {"id": request["id"], "error": str(e)})
+        await writer.drain()
+
+    while line := await reader.readline():
+        asyncio.get_running_loop().create_task(handle(json.loads(line)))
+
+async def route_update(update: Update, context) -> None:
+    """Forward a Telegram update to the worker owning its user"""
+    user = update.effective_user
+    router = context.application.bot_data["router"]
+    message = {"type": "update", "update": update.to_dict()}
+    if update.message and update.message.text and update.message.text.startswith("/broadcast"):
+        # Each worker broadcasts to the users it owns
+        for index in range(router.worker_count):
+            await router.send_to_worker(index, message)
+        return
+    await router.send(user.id if user else None, message)
+
+async def route_payment_update(application, update_data):
+    """Forward a CryptoBot update to the worker owning the paying user"""
+    from crypto_payments import parse_hidden_message
+
+    router = application.bot_data["router"]
+    invoice = update_data.get("payload", {})
+    user_id, _ = parse_hidden_message(invoice.get("hidden_message", ""))
+    payload = {key: value for key, value in update_data.items() if key in ("update_type", "payload")}
+    message = {"type": "payment", "payload": payload}
+
+    # Pooled invoices carry the index of the worker that handed them out
+    invoice_payload = invoice.get("payload") or ""
+    if not user_id and invoice_payload.startswith("w") and ":" in invoice_payload:
+        index = invoice_payload[1:invoice_payload.index(":")]
+        if index.isdigit() and int(index) < router.worker_count:
+            await router.send_to_worker(int(index), message)
+            return
+    await router.send(user_id, message)
+
+async def _front_post_init(application):
+    from bot import start_background_task
+
+    start_background_task(prewarm(application.bot))
+    sender = ChannelSender(application.bot)
+    start_background_task(sender.run())
+    application.bot_data["sender_server"] = await asyncio.start_unix_server(
+        partial(_serve_sender, sender), path=_sender_socket())
+
+    router = WorkerRouter(application.bot_data["worker_count"])
+    await router.connect()
+    application.bot_data["router"] = router
+    # The front receives CryptoBot updates and passes each to the paying user's worker
+    await payment_webhook.start(partial(route_payment_update, application))
+
+async def _front_post_stop(application):
+    from bot import stop_background_tasks
+
+    await payment_webhook.stop()
+    await stop_background_tasks()
+
+def run_cluster(worker_count):
+    """Run the front process and `worker_count` worker processes"""
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise ValueError(
+            "No TELEGRAM_BOT_TOKEN found in environment variables")
+
+    os.makedirs(SOCKET_DIR, exist_ok=True)
+    if os.path.exists(_sender_socket()):
+        os.unlink(_sender_socket())
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(index, worker_count, token),
+                               name=f"worker-{index}")
+               for index in range(worker_count)]
+    for worker in workers:
+        worker.start()
+
+    application = Application.builder() \
+        .token(token) \
+        .request(build_request()) \
+        .get_updates_request(build_get_updates_request()) \
+        .post_init(_front_post_init) \
+        .post_stop(_front_post_stop) \
+        .build()
+    application.bot_data["worker_count"] = worker_count
+    application.add_handler(TypeHandler(Update, route_update))
+
+    try:
+        logger.info(f"Starting front process with {worker_count} workers")
+        application.run_polling(allowed_updates=["message", "callback_query", "my_chat_member"])
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        logger.info("All workers stopped")
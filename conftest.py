@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared pytest fixtures: every test touching money runs on its own data directory
+"""
+
+import asyncio
+import itertools
+from types import SimpleNamespace
+import pytest
+import user_data
+import crypto_payments
+import audit_log
+import responsible_gaming
+import lifecycle
+import games
+import rounds
+from user_data import UserRecord, update_user_data
+from responsible_gaming import LimitsEngine
+from exposure import ExposureManager
+from ledger import Ledger
+from lifecycle import Lifecycle, GameJournal
+
+
+class FakeBot:
+    """Collects the messages the bot would send; dice show the values in `dice`, then 1"""
+
+    def __init__(self):
+        self.messages = []
+        self.keyboards = []
+        self.rolls = []
+        self.dice = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.messages.append((chat_id, text))
+        self.keyboards.append(kwargs.get("reply_markup"))
+
+    async def send_dice(self, chat_id, emoji=None, **kwargs):
+        value = self.dice.pop(0) if self.dice else 1
+        self.rolls.append((chat_id, emoji, value))
+        return SimpleNamespace(dice=SimpleNamespace(value=value))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Empty working directory with fresh user data and audit log"""
+    monkeypatch.chdir(tmp_path)
+    user_data.load_user_data()
+    log = audit_log.AuditLog(str(tmp_path / "audit"))
+    monkeypatch.setattr(audit_log, "audit_log", log)
+    monkeypatch.setattr(crypto_payments, "ledger", Ledger(str(tmp_path / "ledger.sqlite3")))
+    yield tmp_path
+    log.close()
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """Fresh limits engine in place of the module-level one"""
+    engine = LimitsEngine()
+    monkeypatch.setattr(responsible_gaming, "limits", engine)
+    monkeypatch.setattr(games, "limits", engine)
+    return engine
+
+
+@pytest.fixture
+def game_lifecycle(data_dir, limits, monkeypatch):
+    """Fresh lifecycle with its journal and checkpoint in the data directory"""
+    fresh = Lifecycle(GameJournal(str(data_dir / "journal.sqlite3")),
+                      checkpoint_path=str(data_dir / "checkpoint.json"))
+    for module in (lifecycle, games, rounds):
+        monkeypatch.setattr(module, "lifecycle", fresh)
+    return fresh
+
+
+@pytest.fixture
+def bot():
+    return FakeBot()
+
+
+@pytest.fixture
+def house_exposure(monkeypatch):
+    """Fresh exposure manager in place of the module-level one"""
+    manager = ExposureManager()
+    for module in (games, crypto_payments, rounds):
+        monkeypatch.setattr(module, "exposure", manager)
+    return manager
+
+
+@pytest.fixture
+def payments(game_lifecycle, house_exposure, bot, monkeypatch):
+    """Feed process_payment_update a paid bet: pay(user_id, amount) returns its result"""
+    monkeypatch.setattr(crypto_payments, "ROUND_MODE", False)
+    invoice_ids = itertools.count(1)
+
+    def pay(user_id, amount, comment="Чет и нечет [чет]", invoice_id=None):
+        update = {"update_type": "invoice_paid",
+                  "payload": {"hidden_message": f"user_id:{user_id}", "comment": comment,
+                              "amount": str(amount), "invoice_id": invoice_id or next(invoice_ids)}}
+        return asyncio.run(crypto_payments.process_payment_update(update, bot=bot))
+    return pay
+
+
+def add_user(user_id, balance):
+    """Known user with a balance"""
+    update_user_data(user_id, UserRecord(user_id=user_id, balance=balance))
+    return user_id
@@ -23,5 +23,159 @@ EVEN_ODD_MULTIPLIER = 1.5
 # Higher/Lower game multiplier
 HIGHER_LOWER_MULTIPLIER = 1.5
 
+# Bowling multiplier
+BOWLING_MULTIPLIER = 1.5
+
 # Number to compare in Higher/Lower game
 HIGHER_LOWER_THRESHOLD = 3  # Higher than 3, Lower than 4
+
+# Number of entries shown per leaderboard in /top
+LEADERBOARD_SIZE = 10
+
+# Display names of the game modes
+GAME_DISPLAY_NAMES = {
+    "bowling": "🎳 Боулинг",
+    "even_odd": "🎲 Чет/Нечет",
+    "higher_lower": "📊 Больше/Меньше"
+}
+
+# Messages per minute allowed to the results channel (Telegram allows ~20 for groups)
+CHANNEL_MESSAGES_PER_MINUTE = 20
+
+# SQLite file holding PTB user/chat/bot data (pending bets etc.)
+PERSISTENCE_FILE = "data/bot_state.sqlite3"
+
+# Seconds between batched writes of PTB state
+PERSISTENCE_FLUSH_INTERVAL = 5
+
+# Seconds after which an unpaid pending bet is dropped
+PENDING_BET_TTL = 3600
+
+# Pre-created invoices kept ready, and the level that triggers a refill
+INVOICE_POOL_SIZE = 20
+INVOICE_POOL_LOW_WATER = 5
+
+# Amount of pooled invoices in TON
+INVOICE_POOL_AMOUNT = 1
+
+# Lifetime of pooled invoices in seconds (CryptoBot expires_in)
+INVOICE_TTL = 3600
+
+# CryptoBot API: per-attempt timeout and retries of idempotent calls (seconds)
+API_TIMEOUT = 10
+API_MAX_RETRIES = 3
+API_RETRY_BASE_DELAY = 0.5
+API_RETRY_MAX_DELAY = 5
+
+# Consecutive failures that open an endpoint's circuit, and how long it stays open
+API_BREAKER_FAILURES = 5
+API_BREAKER_RESET_TIMEOUT = 30
+
+# Time budget of a handler for its outgoing API calls
+HANDLER_DEADLINE = 15
+
+# CryptoBot webhook receiving paid invoices (port 0 disables it)
+CRYPTOBOT_WEBHOOK_HOST = os.getenv("CRYPTOBOT_WEBHOOK_HOST", "0.0.0.0")
+CRYPTOBOT_WEBHOOK_PORT = int(os.getenv("CRYPTOBOT_WEBHOOK_PORT", "0"))
+CRYPTOBOT_WEBHOOK_PATH = os.getenv("CRYPTOBOT_WEBHOOK_PATH", "/cryptobot")
+
+# Withdrawal settlement queue: state file, concurrent transfers, retry delay (seconds)
+WITHDRAWALS_FILE = "data/withdrawals.json"
+WITHDRAWAL_PARALLELISM = 4
+WITHDRAWAL_RETRY_DELAY = 30
+
+# Local ledger of credited invoices and paid-out transfers
+LEDGER_FILE = "data/ledger.sqlite3"
+
+# Reconciliation with CryptoBot: seconds between passes, page size, pause between pages
+RECONCILE_INTERVAL = 3600
+RECONCILE_PAGE_SIZE = 100
+RECONCILE_PAGE_PAUSE = 1
+
+# Unpaid invoices older than this (seconds) no longer hold back the reconciliation cursor
+RECONCILE_MAX_OPEN_AGE = 86400
+
+# Audit log: segment directory, rotation by raw size (bytes) or age (seconds), flush interval
+AUDIT_LOG_DIR = "data/audit"
+AUDIT_SEGMENT_BYTES = 64 * 1024 * 1024
+AUDIT_SEGMENT_SECONDS = 86400
+AUDIT_FLUSH_INTERVAL = 5
+
+# Per-user rate limits: rule -> (events, window in seconds). Commands and
+# callback actions use their own rule when listed, else "command"/"callback".
+RATE_LIMITS = {
+    "start": (5, 60),
+    "help": (5, 60),
+    "test": (2, 60),
+    "test_api": (2, 60),
+    "top": (10, 60),
+    "command": (10, 60),
+    "callback": (30, 60),
+    "message": (20, 60),
+}
+
+# Most (user, rule) counters kept in memory; least recently used are dropped
+RATE_LIMIT_MAX_KEYS = 100000
+
+# Graceful shutdown: journal of unsettled games, checkpoint file, seconds to wait for running games
+GAME_JOURNAL_FILE = "data/game_journal.sqlite3"
+CHECKPOINT_FILE = "data/checkpoint.json"
+SHUTDOWN_DRAIN_TIMEOUT = 20
+
+# Telegram Bot API client. The send pool should cover concurrently running
+# handlers plus background senders (channel posts, withdrawal notices).
+TELEGRAM_POOL_SIZE = 32
+TELEGRAM_CONNECT_TIMEOUT = 30
+TELEGRAM_READ_TIMEOUT = 30
+# Seconds a request may wait for a free pooled connection
+TELEGRAM_POOL_TIMEOUT = 5
+# HTTP/2 for sends when the h2 package is installed (httpx[http2])
+TELEGRAM_HTTP2 = os.getenv("TELEGRAM_HTTP2", "1") == "1"
+# Connections opened at startup (HTTP/1.1 only, HTTP/2 multiplexes one)
+TELEGRAM_PREWARM_CONNECTIONS = 4
+
+# Broadcasts: checkpoint file, sends per second across the bot (Telegram allows
+# ~30), concurrent senders and user IDs per checkpointed chunk
+BROADCAST_STATE_FILE = "data/broadcast.json"
+BROADCAST_RATE = 25
+BROADCAST_CONCURRENCY = 8
+BROADCAST_CHUNK_SIZE = 500
+# Sends set aside for the replies to each incoming update, ahead of the broadcast
+BROADCAST_LIVE_RESERVE = 2
+BROADCAST_MAX_ATTEMPTS = 3
+# Telegram user IDs allowed to run admin commands (/broadcast, /exposure), comma-separated
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# State snapshots under <data dir>/snapshots: seconds between snapshots, newest
+# ones kept, and days for which the last snapshot of the day is kept
+SNAPSHOT_INTERVAL = 3600
+SNAPSHOT_KEEP_RECENT = 24
+SNAPSHOT_KEEP_DAILY = 7
+
+# Responsible gaming: stake range in TON (as advertised in the channel), seconds
+# between bets of one user, and the most a user may lose within the rolling window
+BET_MIN_AMOUNT = 0.1
+BET_MAX_AMOUNT = 10
+BET_COOLDOWN = 3
+DAILY_LOSS_LIMIT = 100
+# Rolling loss window in seconds and the number of buckets it is kept in
+LOSS_WINDOW = 86400
+LOSS_WINDOW_BUCKETS = 24
+
+# Shared rounds: paid channel bets are pooled for ROUND_DURATION seconds and
+# settled by one dice roll and one summary post (enable with ROUND_MODE=1)
+ROUND_MODE = os.getenv("ROUND_MODE", "0") == "1"
+ROUND_DURATION = 30
+# Winners listed by name in the round summary
+ROUND_SUMMARY_WINNERS = 20
+
+# House exposure: most the house may owe on one outcome of open bets, and on
+# one face of the die across all outcomes (TON). Bets beyond are reduced to
+# what is left when EXPOSURE_CAP_BETS is set, refused otherwise.
+EXPOSURE_MAX_PER_OUTCOME = 500
+EXPOSURE_MAX_TOTAL = 1000
+EXPOSURE_CAP_BETS = True
+
+# Traffic recording for replay.py: anonymized NDJSON of every incoming update
+# (gzip when the name ends in .gz), off unless set
+TRAFFIC_RECORD_FILE = os.getenv("TRAFFIC_RECORD_FILE", "")
@@ -5,11 +5,22 @@ CryptoBot payment integration
 """
 
 import os
-import uuid
+import time
 import json
+import random
+import asyncio
 import logging
-import aiohttp
+from circuit_breaker import CircuitBreaker
+from constants import (API_TIMEOUT, API_MAX_RETRIES, API_RETRY_BASE_DELAY, API_RETRY_MAX_DELAY,
+                       API_BREAKER_FAILURES, API_BREAKER_RESET_TIMEOUT, HANDLER_DEADLINE, ROUND_MODE)
 from user_data import get_user_data, update_user_data, save_user_data
+import leaderboard
+from pending_bets import pending_bets
+from invoice_pool import invoice_pool
+from ledger import ledger, INVOICE
+from audit_log import log_balance
+from exposure import exposure
+from traffic_recorder import recorder
 
 logger = logging.getLogger(__name__)
 
@@ -18,11 +29,89 @@ CRYPTOBOT_TOKEN = os.getenv("350654:AA4mK8piTvxLsVDBy2Xd2Jt7TrgmePStj2b")
 RESULTS_CHANNEL_ID = os.getenv("-1002305257035")
 
 # CryptoBot API URL
-CRYPTOBOT_API_URL = "https://pay.crypt.bot/api"
+CRYPTOBOT_API_URL = os.getenv("CRYPTOBOT_API_URL", "https://pay.crypt.bot/api")
 
 # Track transactions
 TRANSACTIONS = {}
 
+# One circuit breaker per API endpoint
+_breakers = {}
+
+
+def _get_breaker(endpoint):
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        breaker = _breakers[endpoint] = CircuitBreaker(
+            f"CryptoBot {endpoint}", API_BREAKER_FAILURES, API_BREAKER_RESET_TIMEOUT)
+    return breaker
+
+def make_deadline(seconds=HANDLER_DEADLINE):
+    """Absolute deadline for API calls made on behalf of one handler"""
+    return time.monotonic() + seconds
+
+async def _cryptobot_request(http_method, url, json_data=None, params=None,
+                             idempotent=False, deadline=None):
+    """
+    Call the CryptoBot API through its endpoint's circuit breaker
+
+    Idempotent calls are retried with jittered exponential backoff on
+    connection errors, timeouts and 5xx responses. No attempt runs past
+    `deadline` (a time.monotonic() value).
+
+    Returns:
+        tuple: (HTTP status, parsed JSON body)
+
+    Raises:
+        CircuitOpenError: The endpoint's circuit is open
+        asyncio.TimeoutError: The deadline passed
+    """
+    # Imported on first use: aiohttp is the heaviest import of the bot and
+    # most starts never call CryptoBot before serving the first update
+    import aiohttp
+
+    breaker = _get_breaker(url.rsplit("/", 1)[-1])
+    headers = {
+        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
+        "Content-Type": "application/json"
+    }
+    attempts = API_MAX_RETRIES + 1 if idempotent else 1
+
+    for attempt in range(attempts):
+        # The deadline goes first: a call that is not made must not take the
+        # breaker's half-open trial
+        timeout = API_TIMEOUT
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                raise asyncio.TimeoutError("Deadline exceeded")
+        breaker.check()
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+                async with session.request(http_method, url, json=json_data, params=params,
+                                           headers=headers) as response:
+                    if response.status < 500:
+                        result = await response.json(content_type=None)
+                        breaker.record_success()
+                        return response.status, result
+                    error = aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        except BaseException:
+            # Any other exit (a body that is not JSON, cancellation) is a
+            # failure too, or a half-open circuit would wait for it forever
+            breaker.record_failure()
+            raise
+        breaker.record_failure()
+
+        if attempt == attempts - 1:
+            raise error
+        delay = min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            raise error
+        logger.warning(f"CryptoBot request {url} failed ({error}), retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
 async def create_fixed_invoice(coin_id="TON"):
     """
     Создает инвойс для выбора монеты оплаты через API CryptoBot.
@@ -44,13 +133,14 @@ async def create_fixed_invoice(coin_id="TON"):
 
 #фикс 1
 
-async def create_deposit_invoice(user_id, amount):
+async def create_deposit_invoice(user_id, amount, deadline=None):
     """
     Create a deposit invoice using CryptoBot API with dynamic amount and user-specific details.
     
     Args:
         user_id: Telegram user ID
         amount: Amount to deposit in TON
+        deadline: Optional time.monotonic() deadline for the API call
         
     Returns:
         str: Payment URL for the invoice
@@ -75,38 +165,78 @@ async def create_deposit_invoice(user_id, amount):
         "allow_comments": True  # Разрешаем комментарии к платежу
     }
     
-    # Заголовки запроса
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
     try:
         # Отправляем запрос на создание инвойса
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                result = await response.json()
-                
-                # Проверяем успешность запроса
-                if response.status == 200 and result.get("ok"):
-                    # Возвращаем URL для оплаты
-                    payment_url = result.get("result", {}).get("pay_url")
-                    logger.info(f"Создан динамический счет для пользователя {user_id}: {payment_url}")
-                    return payment_url
-                else:
-                    # Логируем ошибку, если запрос не удался
-                    error_msg = result.get("error", {}).get("message", "Unknown error")
-                    logger.error(f"Ошибка при создании инвойса: {error_msg}")
-                    return None
+        status, result = await _cryptobot_request("POST", url, json_data=payload, deadline=deadline)
+
+        # Проверяем успешность запроса
+        if status == 200 and result.get("ok"):
+            # Возвращаем URL для оплаты
+            payment_url = result.get("result", {}).get("pay_url")
+            logger.info(f"Создан динамический счет для пользователя {user_id}: {payment_url}")
+            return payment_url
+        else:
+            # Логируем ошибку, если запрос не удался
+            error_msg = result.get("error", {}).get("message", "Unknown error")
+            logger.error(f"Ошибка при создании инвойса: {error_msg}")
+            return None
     except Exception as e:
         # Логируем исключение, если что-то пошло не так
         logger.error(f"Исключение при создании инвойса: {e}")
         return None
 
+async def create_pool_invoice(payload, amount, expires_in):
+    """
+    Create an invoice for the invoice pool, identified by its payload
+
+    Args:
+        payload: Unique identifier returned with the paid invoice
+        amount: Amount in TON
+        expires_in: Invoice lifetime in seconds
+
+    Returns:
+        dict: invoice_id and pay_url, or None on error
+    """
+    if not CRYPTOBOT_TOKEN:
+        logger.error("CryptoBot token not found.")
+        return None
+
+    url = f"{CRYPTOBOT_API_URL}/createInvoice"
+
+    request_data = {
+        "asset": "TON",
+        "amount": str(amount),
+        "description": "Ставка в Casino Bot",
+        "payload": payload,
+        "allow_anonymous": False,
+        "allow_comments": True,
+        "expires_in": expires_in
+    }
+
+    try:
+        status, result = await _cryptobot_request("POST", url, json_data=request_data)
+
+        if status == 200 and result.get("ok"):
+            invoice = result.get("result", {})
+            return {
+                "invoice_id": invoice.get("invoice_id"),
+                "pay_url": invoice.get("pay_url")
+            }
+        else:
+            error_msg = result.get("error", {}).get("message", "Unknown error")
+            logger.error(f"Ошибка при создании инвойса для пула: {error_msg}")
+            return None
+    except Exception as e:
+        logger.error(f"Исключение при создании инвойса для пула: {e}")
+        return None
+
 async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=False, cryptobot_user_id=None):
     """
     Create a withdrawal request using CryptoBot API
-    
+
+    The balance is debited right away and the transfer is queued for the
+    settlement worker; the user is notified when it completes.
+
     Args:
         user_id: Telegram user ID
         amount: Amount to withdraw in TON
@@ -114,6 +244,8 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
         use_cryptobot_user: Whether to use CryptoBot user ID for direct transfer
         cryptobot_user_id: CryptoBot user ID for direct transfer
     """
+    from withdrawals import withdrawal_queue
+
     logger.info(f"Создание запроса на вывод для пользователя {user_id} на сумму {amount} TON")
     
     # Проверка достаточности средств
@@ -131,26 +263,47 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
             "success": False,
             "message": "Ошибка: Токен CryptoBot недоступен. Обратитесь к администратору."
         }
-    
-    # Генерируем уникальный ID транзакции
-    transaction_id = str(uuid.uuid4())
-    
-    # Формируем URL запроса
-    url = f"{CRYPTOBOT_API_URL}/transfer"
-    
+
     # Комиссия на вывод (можно настраивать)
     # При выводе на CryptoBot нет комиссии
     fee = 0 if use_cryptobot_user else 0.1  # TON
-    net_amount = amount - fee
-    
+
+    transaction_id = withdrawal_queue.submit(
+        user_id, amount, fee, wallet_address,
+        cryptobot_user_id if use_cryptobot_user else None)
+
+    return {
+        "success": True,
+        "message": f"Заявка на вывод {amount - fee} TON принята. Мы сообщим, когда перевод будет выполнен.",
+        "transaction_id": transaction_id
+    }
+
+async def execute_transfer(transaction, deadline=None):
+    """
+    Send the /transfer call for a queued withdrawal
+
+    The transfer's spend_id makes repeated calls for the same transaction
+    safe, so transient failures can simply be retried.
+
+    Args:
+        transaction: Withdrawal transaction (see withdrawals.WithdrawalQueue.submit)
+        deadline: Optional time.monotonic() deadline for the API call
+
+    Returns:
+        dict: success, transfer_id, error and whether the error is retryable
+    """
+    url = f"{CRYPTOBOT_API_URL}/transfer"
+    net_amount = transaction["net_amount"]
+    user_id = transaction["user_id"]
+
     # Готовим данные для запроса
-    if use_cryptobot_user and cryptobot_user_id:
+    if transaction.get("cryptobot_user_id"):
         # Прямой перевод другому пользователю CryptoBot
         payload = {
-            "user_id": str(cryptobot_user_id),
+            "user_id": str(transaction["cryptobot_user_id"]),
             "asset": "TON",
             "amount": str(net_amount),
-            "spend_id": f"withdrawal_{user_id}_{transaction_id}",
+            "spend_id": transaction["spend_id"],
             "comment": f"Вывод средств из Casino Bot: {net_amount} TON",
             "disable_send_notification": "false"
         }
@@ -159,85 +312,26 @@ async def create_withdrawal(user_id, amount, wallet_address, use_cryptobot_user=
         payload = {
             "asset": "TON",
             "amount": str(net_amount),
-            "wallet_address": wallet_address,
+            "wallet_address": transaction["wallet"],
+            "spend_id": transaction["spend_id"],
             "comment": f"Withdrawal for user {user_id}"
         }
-    
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
-    # Сохраняем информацию о транзакции
-    TRANSACTIONS[transaction_id] = {
-        "user_id": user_id,
-        "type": "withdrawal",
-        "amount": amount,
-        "net_amount": net_amount,
-        "fee": fee,
-        "wallet": wallet_address if not use_cryptobot_user else f"CryptoBot: {cryptobot_user_id}",
-        "status": "pending"
-    }
-    
+
     try:
-        # Списываем средства заранее
-        update_user_balance(user_id, -amount)
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                result = await response.json()
-                
-                if response.status == 200 and result.get("ok"):
-                    transfer_data = result.get("result", {})
-                    transfer_id = transfer_data.get("transfer_id")
-                    
-                    # Обновляем информацию о транзакции
-                    TRANSACTIONS[transaction_id]["transfer_id"] = transfer_id
-                    TRANSACTIONS[transaction_id]["status"] = "completed"
-                    
-                    logger.info(f"Успешно создан вывод #{transfer_id} для пользователя {user_id}")
-                    
-                    if use_cryptobot_user:
-                        return {
-                            "success": True,
-                            "message": f"{net_amount} TON успешно отправлены на ваш CryptoBot аккаунт.",
-                            "transaction_id": transaction_id
-                        }
-                    else:
-                        return {
-                            "success": True,
-                            "message": f"{net_amount} TON успешно отправлены на кошелек {wallet_address}.\nКомиссия: {fee} TON",
-                            "transaction_id": transaction_id
-                        }
-                else:
-                    error_msg = result.get("error", {}).get("message", "Unknown error")
-                    logger.error(f"CryptoBot API error: {error_msg}")
-                    
-                    # Возвращаем средства пользователю
-                    update_user_balance(user_id, amount)
-                    
-                    # Обновляем статус транзакции
-                    TRANSACTIONS[transaction_id]["status"] = "failed"
-                    TRANSACTIONS[transaction_id]["error"] = error_msg
-                    
-                    return {
-                        "success": False,
-                        "message": f"Ошибка при создании вывода: {error_msg}"
-                    }
+        status, result = await _cryptobot_request("POST", url, json_data=payload,
+                                                  idempotent=True, deadline=deadline)
     except Exception as e:
-        logger.error(f"Exception during withdrawal creation: {e}")
-        
-        # Возвращаем средства пользователю
-        update_user_balance(user_id, amount)
-        
-        # Обновляем статус транзакции
-        TRANSACTIONS[transaction_id]["status"] = "failed"
-        TRANSACTIONS[transaction_id]["error"] = str(e)
-        
-        return {
-            "success": False,
-            "message": f"Ошибка соединения с сервисом: {str(e)}"
-        }
+        logger.error(f"Exception during withdrawal transfer: {e}")
+        return {"success": False, "error": str(e), "retryable": True}
+
+    if status == 200 and result.get("ok"):
+        transfer_id = result.get("result", {}).get("transfer_id")
+        logger.info(f"Успешно создан вывод #{transfer_id} для пользователя {user_id}")
+        return {"success": True, "transfer_id": transfer_id}
+
+    error_msg = result.get("error", {}).get("message", "Unknown error")
+    logger.error(f"CryptoBot API error: {error_msg}")
+    return {"success": False, "error": error_msg, "retryable": False}
 
 async def check_transaction_status(transaction_id):
     """Check status of a transaction"""
@@ -262,29 +356,113 @@ def get_user_balance(user_id):
     """Get user balance from user data"""
     user_data = get_user_data(user_id)
     if user_data:
-        return user_data.get("balance", 0)
+        return user_data.balance
     return 0
 
-def update_user_balance(user_id, amount_change):
-    """Update user balance by adding/subtracting amount"""
+def update_user_balance(user_id, amount_change, reason=None, open_game=None, close_game=None):
+    """
+    Update user balance by adding/subtracting amount; `reason` goes to the audit log
+
+    `open_game` / `close_game` add or remove the marker of a journaled game
+    (see lifecycle.py) in the same save as the balance. Closing a game that
+    is no longer open changes nothing and returns None, so a game is never
+    settled twice.
+    """
     user_data = get_user_data(user_id)
     if user_data:
+        if close_game is not None:
+            if close_game not in user_data.open_games:
+                logger.info(f"Игра {close_game} пользователя {user_id} уже рассчитана, баланс не изменен")
+                return None
+            user_data.open_games.remove(close_game)
+        if open_game is not None:
+            user_data.open_games.append(open_game)
         # Ensure we don't go below zero
-        user_data["balance"] = max(0, user_data.get("balance", 0) + amount_change)
+        user_data.balance = max(0, user_data.balance + amount_change)
         update_user_data(user_id, user_data)
         save_user_data()
+        leaderboard.update_balance(user_id, user_data.balance)
+        log_balance(user_id, amount_change, user_data.balance, reason)
         
         # Log the balance change
         if amount_change > 0:
-            logger.info(f"Пополнение баланса пользователя {user_id} на {amount_change} TON. Новый баланс: {user_data['balance']} TON")
+            logger.info(f"Пополнение баланса пользователя {user_id} на {amount_change} TON. Новый баланс: {user_data.balance} TON")
         else:
-            logger.info(f"Списание с баланса пользователя {user_id} на {abs(amount_change)} TON. Новый баланс: {user_data['balance']} TON")
+            logger.info(f"Списание с баланса пользователя {user_id} на {abs(amount_change)} TON. Новый баланс: {user_data.balance} TON")
             
-        return user_data["balance"]
+        return user_data.balance
     return 0
 
-async def process_payment_update(update_data):
-    """Process payment update from CryptoBot"""
+def apply_balance_changes(changes, reason=None, close_games=None):
+    """
+    Apply many balance changes with a single save of user data
+
+    Args:
+        changes: {user_id: amount_change}
+        reason: Reason recorded in the audit log
+        close_games: {user_id: [game_id, ...]} journaled games settled by the
+            changes, whose markers are removed in the same save (see
+            update_user_balance); users may appear here without a change
+
+    Returns:
+        dict: {user_id: new balance} for known users
+    """
+    close_games = close_games or {}
+    balances = {}
+    for user_id in changes.keys() | close_games.keys():
+        amount_change = changes.get(user_id, 0)
+        user_data = get_user_data(user_id)
+        if not user_data:
+            logger.warning(f"Balance change of {amount_change} TON for unknown user {user_id} skipped")
+            continue
+        for game_id in close_games.get(user_id, ()):
+            if game_id in user_data.open_games:
+                user_data.open_games.remove(game_id)
+        if amount_change:
+            user_data.balance = max(0, user_data.balance + amount_change)
+            leaderboard.update_balance(user_id, user_data.balance)
+            log_balance(user_id, amount_change, user_data.balance, reason)
+        update_user_data(user_id, user_data)
+        balances[user_id] = user_data.balance
+    save_user_data()
+    logger.info(f"Applied {len(balances)} balance changes ({reason}), "
+                f"total {sum(changes.values())} TON")
+    return balances
+
+def parse_hidden_message(hidden_message):
+    """
+    Extract the user ID and transaction ID from an invoice hidden message
+
+    Returns:
+        tuple: (user_id or None, transaction_id or None)
+    """
+    user_id = None
+    transaction_id = None
+    if "user_id:" in (hidden_message or ""):
+        parts = hidden_message.split(",")
+        for part in parts:
+            if part.startswith("user_id:"):
+                try:
+                    user_id = int(part.replace("user_id:", "").strip())
+                except ValueError:
+                    logger.error(f"Invalid user_id format in hidden message: {part}")
+            elif part.startswith("txid:"):
+                transaction_id = part.replace("txid:", "").strip()
+    return user_id, transaction_id
+
+async def notify_user(bot, user_id, text):
+    """Message a user about their payment; only logged when there is no bot to send with"""
+    if bot is None:
+        logger.info(f"No bot to notify user {user_id}: {text}")
+        return
+    try:
+        await bot.send_message(chat_id=user_id, text=text)
+    except Exception as e:
+        logger.error(f"Error notifying user {user_id} about a payment: {e}")
+
+async def process_payment_update(update_data, bot=None):
+    """Process payment update from CryptoBot; `bot` tells the payer about refused bets"""
+    recorder.record_payment(update_data)
     try:
         if update_data.get("update_type") == "invoice_paid":
             invoice = update_data.get("payload", {})
@@ -294,9 +472,6 @@ async def process_payment_update(update_data):
             # Log payment comment for debugging
             logger.info(f"Received payment with comment: {payment_comment}")
 
-            user_id = None
-            transaction_id = None
-
             # Determine game type and user choice from comment
             game_type = None
             bet_choice = None
@@ -332,55 +507,136 @@ async def process_payment_update(update_data):
             # Log determined game type and choice
             logger.info(f"Determined game type: {game_type}, bet choice: {bet_choice}")
 
-            # Extract user_id from hidden_message
-            if "user_id:" in hidden_message:
-                parts = hidden_message.split(",")
-                for part in parts:
-                    if part.startswith("user_id:"):
-                        try:
-                            user_id = int(part.replace("user_id:", "").strip())
-                        except ValueError:
-                            logger.error(f"Invalid user_id format in hidden message: {part}")
-                    elif part.startswith("txid:"):
-                        transaction_id = part.replace("txid:", "").strip()
+            # Extract user_id from hidden_message, or from the pooled invoice it was handed out with.
+            # The pool keeps its assignments in memory only; after a restart the
+            # owner is found through the restored pending bet (bet_id == payload)
+            user_id, transaction_id = parse_hidden_message(hidden_message)
+            if not user_id and invoice.get("payload"):
+                user_id = (invoice_pool.owner_of(invoice.get("payload"))
+                           or pending_bets.owner_of(invoice.get("payload")))
 
             if user_id and game_type and bet_choice:
                 amount = float(invoice.get("amount", 0))
                 asset = invoice.get("asset", "TON")
                 invoice_id = invoice.get("invoice_id", "unknown")
 
+                # CryptoBot redelivers updates, and a signed body can be sent
+                # again: the ledger entry is claimed before anything is
+                # credited, and an invoice already in the ledger is skipped.
+                # Claim and credit run back to back with no await between
+                if isinstance(invoice_id, int) and not ledger.claim(INVOICE, invoice_id, user_id, amount, asset):
+                    logger.warning(f"Invoice {invoice_id} of user {user_id} was already processed, skipped")
+                    return {
+                        "success": False,
+                        "message": "Duplicate invoice",
+                        "user_id": user_id,
+                        "invoice_id": invoice_id
+                    }
+
+                # Link the payment to the bet it was made for
+                bet = pending_bets.match_payment(user_id, invoice.get("payload"))
+                bet_id = bet.bet_id if bet else None
+                invoice_pool.release(invoice.get("payload"))
+
+                # Exposure and limits are checked before any money moves. A
+                # refused bet is not played and a capped one stakes less; the
+                # payment (or the rest of it) stays on the balance
+                from games import authorize_stake
+                verdict = authorize_stake(user_id, game_type, bet_choice, amount)
+
                 # Update user balance
-                update_user_balance(user_id, amount)
+                update_user_balance(user_id, amount, "deposit")
                 logger.info(f"Updated balance for user {user_id} with +{amount} {asset}")
 
-                # Process game results
+                if not verdict["success"]:
+                    await notify_user(bot, user_id,
+                                      f"⛔ Ставка не принята: {verdict['message']}\n"
+                                      f"Оплата {amount} TON зачислена на ваш баланс.")
+                    return {
+                        "success": False,
+                        "message": verdict["message"],
+                        "user_id": user_id,
+                        "amount": amount,
+                        "bet_id": bet_id
+                    }
+                stake = verdict["amount"]
+                if stake < amount:
+                    await notify_user(bot, user_id,
+                                      f"⚠️ {verdict.get('message') or f'Ставка уменьшена до {stake} TON.'}\n"
+                                      f"Остаток оплаты {round(amount - stake, 2)} TON зачислен на ваш баланс.")
+
+                # In round mode the stake is taken now and the bet waits for
+                # the next shared dice roll
+                if ROUND_MODE:
+                    from rounds import rounds
+                    round_number = rounds.add_bet(user_id, game_type, bet_choice, stake)
+                    return {
+                        "success": True,
+                        "user_id": user_id,
+                        "amount": amount,
+                        "stake": stake,
+                        "asset": asset,
+                        "game_type": game_type,
+                        "bet_choice": bet_choice,
+                        "transaction_id": transaction_id,
+                        "bet_id": bet_id,
+                        "round": round_number
+                    }
+
+                # Play the game in the payer's private chat: paid bets come
+                # from the webhook, without a Telegram update to reply to.
+                # The stake is journaled and taken from the deposit; it was
+                # counted for the limits on authorization
+                from games import send_game_results, record_game_result
+                from lifecycle import lifecycle
+                game_id = lifecycle.begin_game(user_id, game_type, stake)
                 try:
-                    from games import process_and_send_game_results
-                    game_result = await process_and_send_game_results(
-                        update=update_data.get("update"),
-                        context=update_data.get("context"),
-                        game_type=game_type,
-                        bet_choice=bet_choice,
-                        bet_amount=amount
-                    )
-
-                    # Update user balance with winnings/losses
-                    if game_result.get("user_won"):
-                        winnings = game_result.get("winnings", 0)
-                        update_user_balance(user_id, winnings)
-                        logger.info(f"Updated user balance after game: {winnings} TON")
+                    if bot is None:
+                        raise RuntimeError("no bot to roll the die with")
+                    record = get_user_data(user_id)
+                    username = record.username if record and record.username != "Anonymous" else f"user{user_id}"
+                    game_result = await send_game_results(bot, user_id, username, game_type, bet_choice, stake)
+
+                    # Credit the winnings (if any) and settle the game
+                    payout = game_result.get("winnings", 0) if game_result.get("user_won") else 0
+                    lifecycle.record_outcome(game_id, payout)
+                    lifecycle.finish_game(game_id, user_id, payout)
+                    logger.info(f"Updated user balance after game: {payout} TON")
+                    record_game_result(user_id, game_type, stake, payout,
+                                       bet_choice, game_result.get("dice_value"))
 
                 except Exception as e:
                     logger.error(f"Error processing game results: {e}")
+                    # The stake of a game that did not complete goes back
+                    lifecycle.abort_game(game_id)
+                    await notify_user(bot, user_id,
+                                      f"⚠️ Игра не состоялась, ставка {stake} TON возвращена на ваш баланс.")
+                    return {
+                        "success": False,
+                        "message": f"Game failed: {e}",
+                        "user_id": user_id,
+                        "amount": amount,
+                        "stake": stake,
+                        "bet_id": bet_id
+                    }
+                finally:
+                    exposure.release(game_type, bet_choice, stake)
 
+                await notify_user(bot, user_id,
+                                  f"{'🎉 Выигрыш! +' + str(payout) + ' TON' if payout else '😢 Проигрыш! -' + str(stake) + ' TON'}\n"
+                                  f"Ваш текущий баланс: {get_user_balance(user_id)} TON")
                 return {
                     "success": True,
                     "user_id": user_id,
                     "amount": amount,
+                    "stake": stake,
                     "asset": asset,
                     "game_type": game_type,
                     "bet_choice": bet_choice,
-                    "transaction_id": transaction_id
+                    "transaction_id": transaction_id,
+                    "bet_id": bet_id,
+                    "dice_value": game_result.get("dice_value"),
+                    "payout": payout
                 }
 
             else:
@@ -412,7 +668,7 @@ async def process_payment_update(update_data):
             "message": f"Error: {str(e)}"
         }
 
-async def check_payment_status(invoice_id):
+async def check_payment_status(invoice_id, deadline=None):
     """Check status of a payment by invoice ID"""
     if not CRYPTOBOT_TOKEN:
         logger.error("CryptoBot token not found.")
@@ -424,38 +680,32 @@ async def check_payment_status(invoice_id):
     url = f"{CRYPTOBOT_API_URL}/getInvoices"
     params = {"invoice_ids": [invoice_id]}
     
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, headers=headers) as response:
-                result = await response.json()
-                
-                if response.status == 200 and result.get("ok"):
-                    invoices = result.get("result", {}).get("items", [])
-                    if invoices:
-                        invoice = invoices[0]
-                        return {
-                            "success": True,
-                            "status": invoice.get("status"),
-                            "paid": invoice.get("paid"),
-                            "amount": invoice.get("amount"),
-                            "asset": invoice.get("asset")
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "message": "Invoice not found"
-                        }
-                else:
-                    error_msg = result.get("error", {}).get("message", "Unknown error")
-                    return {
-                        "success": False,
-                        "message": f"API error: {error_msg}"
-                    }
+        status, result = await _cryptobot_request("GET", url, params=params,
+                                                  idempotent=True, deadline=deadline)
+
+        if status == 200 and result.get("ok"):
+            invoices = result.get("result", {}).get("items", [])
+            if invoices:
+                invoice = invoices[0]
+                return {
+                    "success": True,
+                    "status": invoice.get("status"),
+                    "paid": invoice.get("paid"),
+                    "amount": invoice.get("amount"),
+                    "asset": invoice.get("asset")
+                }
+            else:
+                return {
+                    "success": False,
+                    "message": "Invoice not found"
+                }
+        else:
+            error_msg = result.get("error", {}).get("message", "Unknown error")
+            return {
+                "success": False,
+                "message": f"API error: {error_msg}"
+            }
     except Exception as e:
         logger.error(f"Error checking payment status: {e}")
         return {
@@ -463,7 +713,7 @@ async def check_payment_status(invoice_id):
             "message": f"Error: {str(e)}"
         }
 
-async def test_api_connection():
+async def test_api_connection(deadline=None):
     """Test connection to CryptoBot API"""
     if not CRYPTOBOT_TOKEN:
         logger.error("CryptoBot token not found.")
@@ -474,32 +724,25 @@ async def test_api_connection():
     
     url = f"{CRYPTOBOT_API_URL}/getMe"
     
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                result = await response.json()
-                
-                if response.status == 200 and result.get("ok"):
-                    app_info = result.get("result", {})
-                    return {
-                        "success": True,
-                        "app_id": app_info.get("app_id"),
-                        "name": app_info.get("name"),
-                        "payment_processing_bot_username": app_info.get("payment_processing_bot_username")
-                    }
-                else:
-                    error_msg = result.get("error", {}).get("message", "Unknown error")
-                    error_code = result.get("error", {}).get("code", None)
-                    return {
-                        "success": False,
-                        "message": error_msg,
-                        "code": error_code
-                    }
+        status, result = await _cryptobot_request("GET", url, idempotent=True, deadline=deadline)
+
+        if status == 200 and result.get("ok"):
+            app_info = result.get("result", {})
+            return {
+                "success": True,
+                "app_id": app_info.get("app_id"),
+                "name": app_info.get("name"),
+                "payment_processing_bot_username": app_info.get("payment_processing_bot_username")
+            }
+        else:
+            error_msg = result.get("error", {}).get("message", "Unknown error")
+            error_code = result.get("error", {}).get("code", None)
+            return {
+                "success": False,
+                "message": error_msg,
+                "code": error_code
+            }
     except Exception as e:
         logger.error(f"Error testing API connection: {e}")
         return {
@@ -507,6 +750,44 @@ async def test_api_connection():
             "message": f"Connection error: {str(e)}"
         }
 
+async def list_api_items(method, offset=0, count=100):
+    """
+    One page of getInvoices/getTransfers, newest first
+
+    Returns:
+        dict: success and items, or message on failure
+    """
+    if not CRYPTOBOT_TOKEN:
+        return {
+            "success": False,
+            "message": "CryptoBot token not available"
+        }
+
+    url = f"{CRYPTOBOT_API_URL}/{method}"
+    try:
+        status, result = await _cryptobot_request("GET", url, params={"offset": offset, "count": count},
+                                                  idempotent=True)
+        if status == 200 and result.get("ok"):
+            return {
+                "success": True,
+                "items": result.get("result", {}).get("items", [])
+            }
+        error_msg = result.get("error", {}).get("message", "Unknown error")
+        return {
+            "success": False,
+            "message": f"API error: {error_msg}"
+        }
+    except Exception as e:
+        logger.error(f"Error listing {method}: {e}")
+        return {
+            "success": False,
+            "message": f"Error: {str(e)}"
+        }
+
+def api_circuits_closed():
+    """Whether no CryptoBot endpoint is currently failing"""
+    return all(breaker.state == breaker.CLOSED for breaker in _breakers.values())
+
 def validate_ton_wallet(address):
     """Validate TON wallet address format"""
     # Базовая валидация TON-адреса
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+House exposure: what open bets would cost the house, kept up to date per bet
+"""
+
+import logging
+from constants import EXPOSURE_MAX_PER_OUTCOME, EXPOSURE_MAX_TOTAL, EXPOSURE_CAP_BETS, BET_MIN_AMOUNT
+from outcomes import OUTCOMES, OUTCOME_KEYS, OUTCOME_CODES, DICE_VALUES
+
+logger = logging.getLogger(__name__)
+
+
+class ExposureManager:
+    """
+    Running liability totals of open bets.
+
+    For every (game, choice) outcome it keeps the open stakes and the payout
+    owed if that outcome wins; for every face of the die it keeps the payout
+    owed if the die shows it, which is what a shared round can cost at once.
+    Reserving or releasing a bet touches one outcome and six faces, and
+    `report` reads the totals without walking any bets.
+
+    A bet that would push an outcome past `max_outcome` or any face past
+    `max_total` is capped to the headroom left (when `cap` is set and the
+    headroom is at least the minimum stake) or refused.
+    """
+
+    def __init__(self, max_outcome=EXPOSURE_MAX_PER_OUTCOME, max_total=EXPOSURE_MAX_TOTAL,
+                 cap=EXPOSURE_CAP_BETS, min_amount=BET_MIN_AMOUNT):
+        self.max_outcome = max_outcome
+        self.max_total = max_total
+        self.cap = cap
+        self.min_amount = min_amount
+        self.stakes = [0.0] * len(OUTCOME_KEYS)
+        self.liability = [0.0] * len(OUTCOME_KEYS)
+        self.by_face = [0.0] * len(DICE_VALUES)
+        self.open_bets = 0
+        self.rejected = 0
+        self.capped = 0
+        self._rows = list(OUTCOMES.values())
+
+    def headroom(self, code):
+        """Largest stake the outcome with index `code` can still take"""
+        row = self._rows[code]
+        multiplier = max(row)
+        limit = (self.max_outcome - self.liability[code]) / multiplier
+        for face, payout in enumerate(row):
+            if payout:
+                limit = min(limit, (self.max_total - self.by_face[face]) / payout)
+        return max(limit, 0.0)
+
+    def _apply(self, code, amount, sign):
+        row = self._rows[code]
+        self.stakes[code] += sign * amount
+        self.liability[code] += sign * amount * max(row)
+        for face, payout in enumerate(row):
+            if payout:
+                self.by_face[face] += sign * amount * payout
+        self.open_bets += sign
+
+    def reserve(self, game_type, bet_choice, amount):
+        """
+        Count an open bet, capped or refused if the house cannot cover it
+
+        Returns:
+            dict: success, the stake actually accepted, and a message for the
+            user when the stake was refused or reduced
+        """
+        code = OUTCOME_CODES[(game_type, bet_choice)]
+        headroom = self.headroom(code)
+        if amount <= headroom:
+            self._apply(code, amount, 1)
+            return {"success": True, "amount": amount}
+
+        # Whole cents, so the capped stake never exceeds the headroom
+        capped = int(headroom * 100) / 100
+        if self.cap and capped >= self.min_amount:
+            self._apply(code, capped, 1)
+            self.capped += 1
+            logger.info(f"Bet of {amount} TON on {game_type}/{bet_choice} capped to {capped} TON by exposure limits")
+            return {"success": True, "amount": capped,
+                    "message": f"Ставка уменьшена до {capped} TON из-за лимита риска."}
+
+        self.rejected += 1
+        logger.warning(f"Bet of {amount} TON on {game_type}/{bet_choice} refused by exposure limits")
+        return {"success": False, "amount": 0,
+                "message": "Лимит ставок на этот исход исчерпан, попробуйте позже."}
+
+    def release(self, game_type, bet_choice, amount):
+        """The bet was settled, refunded or aborted"""
+        self._apply(OUTCOME_CODES[(game_type, bet_choice)], amount, -1)
+
+    def release_code(self, code, amount):
+        """Same as release, for an outcome given by its index in OUTCOME_KEYS (as rounds store it)"""
+        self._apply(code, amount, -1)
+
+    def report(self):
+        """Live exposure: per outcome stakes and liability, and the worst face of the die"""
+        worst = max(range(len(self.by_face)), key=self.by_face.__getitem__)
+        return {
+            "open_bets": self.open_bets,
+            "outcomes": {f"{game_type}/{bet_choice}": {"stakes": round(self.stakes[code], 2),
+                                                       "liability": round(self.liability[code], 2)}
+                         for code, (game_type, bet_choice) in enumerate(OUTCOME_KEYS)},
+            "by_face": [round(total, 2) for total in self.by_face],
+            "worst_case": {"face": DICE_VALUES[worst], "payout": round(self.by_face[worst], 2)},
+            "limits": {"per_outcome": self.max_outcome, "total": self.max_total},
+            "rejected": self.rejected,
+            "capped": self.capped,
+        }
+
+
+exposure = ExposureManager()
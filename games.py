@@ -10,8 +10,13 @@ import logging
 import os
 from telegram import Update
 from telegram.ext import CallbackContext
-from crypto_payments import update_user_balance, get_user_balance
-from user_data import get_user_data
+from crypto_payments import get_user_balance
+from user_data import get_user_data, record_game
+import leaderboard
+from audit_log import log_game
+from lifecycle import lifecycle
+from responsible_gaming import limits
+from exposure import exposure
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +24,25 @@ logger = logging.getLogger(__name__)
 RESULTS_CHANNEL_ID = os.getenv("RESULTS_CHANNEL_ID", "-1002305257035")
 
 
+def record_game_result(user_id, game_type, bet_amount, payout, bet_choice=None, dice_value=None):
+    """
+    Record a settled game in the statistics subsystems and the audit log
+
+    Args:
+        user_id: Telegram user ID
+        game_type: Type of game (even_odd, higher_lower, bowling)
+        bet_amount: Bet amount in TON
+        payout: Amount credited back to the user (0 if the bet was lost)
+        bet_choice: User's bet choice, for the audit log
+        dice_value: Dice roll that settled the game, for the audit log
+    """
+    record_game(user_id, game_type, bet_amount, payout)
+    leaderboard.record_game(user_id, payout - bet_amount)
+    log_game(user_id, game_type, bet_amount, payout, bet_choice, dice_value)
+    # The stake was counted for the limits when it was authorized
+    limits.record_payout(user_id, payout)
+
+
 async def process_and_send_game_results(update: Update, context: CallbackContext, game_type: str, bet_choice: str, bet_amount: float):
     """
     Process game results and send them to the channel
@@ -31,23 +55,41 @@ async def process_and_send_game_results(update: Update, context: CallbackContext
         bet_amount: Bet amount in TON
     """
     user = update.effective_user
-    username = user.username or f"user{user.id}"
+    message = update.callback_query.message
+    return await send_game_results(context.bot, message.chat_id, user.username or f"user{user.id}",
+                                   game_type, bet_choice, bet_amount,
+                                   reply_to_message_id=message.message_id)
+
+
+async def send_game_results(bot, chat_id, username, game_type, bet_choice, bet_amount, reply_to_message_id=None):
+    """
+    Roll the die in a chat and send the result to the channel; used for
+    button games and for paid bets, which have no Telegram update
 
+    Args:
+        bot: Bot to send with
+        chat_id: Chat the die is rolled in
+        username: Player name shown in the channel
+        game_type: Type of game (even_odd, higher_lower, bowling)
+        bet_choice: User's bet choice
+        bet_amount: Bet amount in TON
+        reply_to_message_id: Message the die replies to, if any
+    """
     if game_type == "bowling":
-        message = await update.callback_query.message.reply_dice(emoji="🎳")
+        message = await bot.send_dice(chat_id=chat_id, emoji="🎳", reply_to_message_id=reply_to_message_id)
         dice_value = message.dice.value
         user_won = (bet_choice == "win" and dice_value >= 4) or (bet_choice == "lose" and dice_value < 4)
         result_text = f"Выпало: {dice_value} очков"
 
     elif game_type == "even_odd":
-        message = await update.callback_query.message.reply_dice(emoji="🎲")
+        message = await bot.send_dice(chat_id=chat_id, emoji="🎲", reply_to_message_id=reply_to_message_id)
         dice_value = message.dice.value
         is_even = dice_value % 2 == 0
         user_won = (bet_choice == "even" and is_even) or (bet_choice == "odd" and not is_even)
         result_text = "Чет" if is_even else "Нечет"
 
     else:  # higher_lower
-        message = await update.callback_query.message.reply_dice(emoji="🎲")
+        message = await bot.send_dice(chat_id=chat_id, emoji="🎲", reply_to_message_id=reply_to_message_id)
         dice_value = message.dice.value
         is_higher = dice_value > 3
         user_won = (bet_choice == "higher" and is_higher) or (bet_choice == "lower" and not is_higher)
@@ -84,7 +126,7 @@ async def process_and_send_game_results(update: Update, context: CallbackContext
     )
 
     # Send result to channel
-    await context.bot.send_message(
+    await bot.send_message(
         chat_id=RESULTS_CHANNEL_ID,
         text=channel_message,
         parse_mode="Markdown"
@@ -99,13 +141,57 @@ async def process_and_send_game_results(update: Update, context: CallbackContext
     }
 
 
+def authorize_stake(user_id, game_type, bet_choice, bet_amount):
+    """
+    Reserve house exposure and check the user's limits for a bet, which
+    counts the stake for the limits; call right before the stake is taken
+    and release the exposure once settled
+
+    Returns:
+        dict: success, the stake to take (reduced if exposure is short) and
+        a message for the user when the bet was refused or reduced
+    """
+    reservation = exposure.reserve(game_type, bet_choice, bet_amount)
+    if not reservation["success"]:
+        return reservation
+    verdict = limits.authorize(user_id, reservation["amount"])
+    if not verdict["success"]:
+        exposure.release(game_type, bet_choice, reservation["amount"])
+        return {"success": False, "amount": 0, "message": verdict["message"]}
+    return reservation
+
+async def _authorize_bet(update, context, user_id, game_type, bet_choice, bet_amount):
+    """authorize_stake, telling the user when the bet was refused or reduced"""
+    verdict = authorize_stake(user_id, game_type, bet_choice, bet_amount)
+    if verdict.get("message"):
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       text=f"{'⚠️' if verdict['success'] else '⛔'} {verdict['message']}")
+    return verdict
+
+
 async def play_even_odd(update: Update, context: CallbackContext, user_id, bet_choice, bet_amount):
     """
     Play even/odd game
     """
-    # First subtract the bet amount from user balance
-    current_balance = update_user_balance(user_id, -bet_amount)
-
+    # House exposure, then stake range, cooldown and loss limit, before any money moves
+    verdict = await _authorize_bet(update, context, user_id, "even_odd", bet_choice, bet_amount)
+    if not verdict["success"]:
+        return verdict
+    bet_amount = verdict["amount"]
+
+    # Journal the game, then take the stake
+    game_id = lifecycle.begin_game(user_id, "even_odd", bet_amount)
+    try:
+        return await _play_even_odd_round(update, context, user_id, bet_choice, bet_amount, game_id)
+    except Exception:
+        # Never keep the stake of a game that did not complete
+        lifecycle.abort_game(game_id)
+        raise
+    finally:
+        exposure.release("even_odd", bet_choice, bet_amount)
+
+
+async def _play_even_odd_round(update, context, user_id, bet_choice, bet_amount, game_id):
     # Send dice animation
     message = await update.callback_query.message.reply_dice(emoji="🎲")
     dice_value = message.dice.value
@@ -114,6 +200,7 @@ async def play_even_odd(update: Update, context: CallbackContext, user_id, bet_c
     is_even = dice_value % 2 == 0
     result_text = "Чет" if is_even else "Нечет"
     user_won = (bet_choice == "even" and is_even) or (bet_choice == "odd" and not is_even)
+    lifecycle.record_outcome(game_id, int(bet_amount * 1.5) if user_won else 0)
 
     # Format user-friendly bet choice text
     bet_choice_text = "Чет" if bet_choice == "even" else "Нечет"
@@ -129,11 +216,10 @@ async def play_even_odd(update: Update, context: CallbackContext, user_id, bet_c
             f"Текущий баланс: {get_user_balance(user_id)} TON"
     )
 
-    # Update balance if user won
-    winnings = 0
-    if user_won:
-        winnings = int(bet_amount * 1.5)  # Уменьшен коэффициент с 2 до 1.5
-        update_user_balance(user_id, winnings)
+    # Credit the winnings (if any) and settle the journaled game in one step
+    winnings = int(bet_amount * 1.5) if user_won else 0  # Уменьшен коэффициент с 2 до 1.5
+    lifecycle.finish_game(game_id, user_id, winnings)
+    record_game_result(user_id, "even_odd", bet_amount, winnings, bet_choice, dice_value)
 
     # Create result message for user
     user_message = (
@@ -164,8 +250,8 @@ async def play_even_odd(update: Update, context: CallbackContext, user_id, bet_c
         f"💰 Результат: {'Выигрыш ' + str(winnings) + ' TON' if user_won else 'Проигрыш ' + str(bet_amount) + ' TON'}\n"
         f"💵 Текущий баланс: {get_user_balance(user_id)} TON\n\n"
         f"📊 Статистика игр:\n"
-        f"🎮 Всего игр: {get_user_data(user_id).get('games_played', 0) + 1}\n"
-        f"🎲 Игр в режиме Чет/нечет: {get_user_data(user_id).get('even_odd_games', 0) + 1}"
+        f"🎮 Всего игр: {get_user_data(user_id).games_played}\n"
+        f"🎲 Игр в режиме Чет/нечет: {get_user_data(user_id).even_odd_games}"
     )
 
     return {
@@ -179,9 +265,25 @@ async def play_even_odd(update: Update, context: CallbackContext, user_id, bet_c
 
 async def play_higher_lower(update: Update, context: CallbackContext, user_id, bet_choice, bet_amount):
     """Play higher/lower game"""
-    # First subtract the bet amount from user balance
-    current_balance = update_user_balance(user_id, -bet_amount)
-
+    # House exposure, then stake range, cooldown and loss limit, before any money moves
+    verdict = await _authorize_bet(update, context, user_id, "higher_lower", bet_choice, bet_amount)
+    if not verdict["success"]:
+        return verdict
+    bet_amount = verdict["amount"]
+
+    # Journal the game, then take the stake
+    game_id = lifecycle.begin_game(user_id, "higher_lower", bet_amount)
+    try:
+        return await _play_higher_lower_round(update, context, user_id, bet_choice, bet_amount, game_id)
+    except Exception:
+        # Never keep the stake of a game that did not complete
+        lifecycle.abort_game(game_id)
+        raise
+    finally:
+        exposure.release("higher_lower", bet_choice, bet_amount)
+
+
+async def _play_higher_lower_round(update, context, user_id, bet_choice, bet_amount, game_id):
     # Send dice animation
     message = await update.callback_query.message.reply_dice(emoji="🎲")
     dice_value = message.dice.value
@@ -190,6 +292,7 @@ async def play_higher_lower(update: Update, context: CallbackContext, user_id, b
     is_higher = dice_value > 3
     result_text = "Больше 3" if is_higher else "Меньше 4"
     user_won = (bet_choice == "higher" and is_higher) or (bet_choice == "lower" and not is_higher)
+    lifecycle.record_outcome(game_id, int(bet_amount * 1.5) if user_won else 0)
 
     # Format user-friendly bet choice text
     bet_choice_text = "Больше 3" if bet_choice == "higher" else "Меньше 4"
@@ -205,11 +308,10 @@ async def play_higher_lower(update: Update, context: CallbackContext, user_id, b
              f"Текущий баланс: {get_user_balance(user_id)} TON"
     )
 
-    # Update balance if user won
-    winnings = 0
-    if user_won:
-        winnings = int(bet_amount * 1.5)
-        update_user_balance(user_id, winnings)
+    # Credit the winnings (if any) and settle the journaled game in one step
+    winnings = int(bet_amount * 1.5) if user_won else 0
+    lifecycle.finish_game(game_id, user_id, winnings)
+    record_game_result(user_id, "higher_lower", bet_amount, winnings, bet_choice, dice_value)
 
     # Create result message for user
     user_message = (
@@ -240,8 +342,8 @@ async def play_higher_lower(update: Update, context: CallbackContext, user_id, b
         f"💰 Результат: {'Выигрыш ' + str(winnings) + ' TON' if user_won else 'Проигрыш ' + str(bet_amount) + ' TON'}\n"
         f"💵 Текущий баланс: {get_user_balance(user_id)} TON\n\n"
         f"📊 Статистика игр:\n"
-        f"🎮 Всего игр: {get_user_data(user_id).get('games_played', 0) + 1}\n"
-        f"📈 Игр в режиме Больше/меньше: {get_user_data(user_id).get('higher_lower_games', 0) + 1}"
+        f"🎮 Всего игр: {get_user_data(user_id).games_played}\n"
+        f"📈 Игр в режиме Больше/меньше: {get_user_data(user_id).higher_lower_games}"
     )
 
     return {
@@ -5,20 +5,31 @@ Handler functions for the Telegram bot commands and callbacks
 """
 
 import os
-import datetime
+import time
+import uuid
 import logging
 import random
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from user_data import (get_user_data, update_user_data, save_user_data, 
-                     get_games_played, get_registration_date, get_favorite_game)
-from crypto_payments import create_deposit_invoice, test_api_connection, create_fixed_invoice, create_payment_url
+from user_data import (UserRecord, get_user_data, update_user_data, save_user_data,
+                     format_timestamp, set_user_blocked)
+from crypto_payments import create_deposit_invoice, test_api_connection, create_fixed_invoice, make_deadline
+from leaderboard import render_top_message
+from constants import GAME_DISPLAY_NAMES, ADMIN_IDS, INVOICE_POOL_AMOUNT
+from pending_bets import pending_bets, get_metrics as get_pending_bet_metrics
+from invoice_pool import invoice_pool
+from callback_router import callback_data
+from broadcast import broadcaster
+from exposure import exposure
 
 logger = logging.getLogger(__name__)
 
 # Get channel ID for posting results from environment variables
 RESULTS_CHANNEL_ID = os.getenv("-1002305257035")
 
+# Rendered profile texts: user_id -> (record version, text)
+_profile_cache = {}
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /start command."""
     try:
@@ -37,25 +48,15 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         user_data = get_user_data(user_id)
         if not user_data:
             logger.info(f"Creating new user data for user {user_id}")
-            user_data = {
-                "user_id": user_id,
-                "username": user.username or "Anonymous",
-                "registration_date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "games_played": 0,
-                "favorite_game": None,
-                "balance": 0,
-                "even_odd_games": 0,
-                "higher_lower_games": 0,
-                "last_activity": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
+            user_data = UserRecord(user_id=user_id, username=user.username or "Anonymous")
             update_user_data(user_id, user_data)
             save_user_data()
 
         # Create welcome keyboard
         keyboard = [
             [
-                InlineKeyboardButton("Профиль", callback_data="profile"),
-                InlineKeyboardButton("ИГРАТЬ", callback_data="play")
+                InlineKeyboardButton("Профиль", callback_data=callback_data("profile")),
+                InlineKeyboardButton("ИГРАТЬ", callback_data=callback_data("play"))
             ]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -95,15 +96,67 @@ async def create_payment_url(user_id, bet_amount=4.0):
     logger.info(f"Created payment URL: {fixed_invoice_url}")
     return fixed_invoice_url
 
+def take_bet_link(user_id):
+    """
+    Personal payment link for a new bet, taken from the invoice pool.
+
+    Returns:
+        tuple: (payment URL, bet ID) - the bet ID is the invoice payload, or
+        None when the pool is empty and the fixed invoice is used instead
+    """
+    invoice = invoice_pool.acquire(user_id)
+    if invoice is None:
+        logger.warning(f"Invoice pool is empty, using the fixed invoice for user {user_id}")
+        return "https://t.me/CryptoBot?start=IV15707697", None
+    return invoice.pay_url, invoice.payload
+
+def bet_amount_hint(bet_id):
+    """How much to pay: pooled invoices have a fixed amount, the fixed invoice takes any"""
+    if bet_id:
+        return f"Сумма ставки: {INVOICE_POOL_AMOUNT} TON"
+    return "Введите удобную для вас сумму от 0.1 до 10 TON"
+
+def find_bet_link(context):
+    """Payment link of the user's newest pending bet, or the fixed invoice"""
+    for bet in reversed(list((context.user_data.get("bets") or {}).values())):
+        if bet.get("pay_url"):
+            return bet["pay_url"], True
+    return "https://t.me/CryptoBot?start=IV15707697", False
+
+def register_pending_bet(context, user_id, message=None, bet_id=None, pay_url=None):
+    """Remember a bet announced to the user until its payment arrives"""
+    if not context.user_data.get("bets"):
+        context.user_data["bets"] = {}
+
+    now = time.time()
+    bet_id = bet_id or uuid.uuid4().hex
+    message_id = message.message_id if message else None
+    context.user_data["bets"][bet_id] = {
+        "game_type": "user_choice",  # User will choose when paying
+        "bet_choice": "user_choice",  # User will choose when paying
+        "message_id": message_id,
+        "pay_url": pay_url,
+        "timestamp": now
+    }
+    pending_bets.add(bet_id, user_id, message_id, now)
+    return bet_id
+
 async def send_channel_bet_message(context, user, game_type=None, bet_choice=None, bet_amount=4.0):
     """
-    Sends a bet message to the game channel
+    Announce a new bet in the game channel and register it
+
+    The payment link is personal (a pooled invoice pays into this user's
+    balance), so the channel only gets the instructions; the caller shows
+    the link to the user in private.
+
+    Returns:
+        tuple: (payment URL, bet ID or None), see take_bet_link
     """
     logger.info(f"🎮 Sending bet message for user {user.id}")
 
     try:
-        # Create payment URL with arbitrary amount selection
-        payment_url = await create_payment_url(user.id, 0.1)
+        # Personal payment link from the invoice pool
+        payment_url, bet_id = take_bet_link(user.id)
 
         # Send bet message to channel
         message = await context.bot.send_message(
@@ -116,16 +169,16 @@ async def send_channel_bet_message(context, user, game_type=None, bet_choice=Non
                 f"• 🎳 Боулинг: `бол - победа` или `бол - поражение`\n"
                 f"• 🎲 Чет/Нечет: `чет` или `нечет`\n"
                 f"• 📊 Больше/Меньше: `больше` или `меньше`\n\n"
-                f"👇 *Введите удобную для вас сумму от 0.1 до 10 TON* при оплате через CryptoBot:"
+                f"👇 Ссылка для оплаты — в личных сообщениях бота"
             ),
             parse_mode="Markdown",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
-                [InlineKeyboardButton("📋 Инструкция", callback_data="instruction")]
+                [InlineKeyboardButton("📋 Инструкция", callback_data=callback_data("instruction"))]
             ])
         )
+        register_pending_bet(context, user.id, message, bet_id, payment_url if bet_id else None)
 
-        return message
+        return payment_url, bet_id
     except Exception as e:
         logger.error(f"Error sending bet message: {e}")
         raise
@@ -134,8 +187,8 @@ def get_main_keyboard():
     """Main menu keyboard"""
     keyboard = [
         [
-            InlineKeyboardButton("Профиль", callback_data="profile"),
-            InlineKeyboardButton("ИГРАТЬ", callback_data="play")
+            InlineKeyboardButton("Профиль", callback_data=callback_data("profile")),
+            InlineKeyboardButton("ИГРАТЬ", callback_data=callback_data("play"))
         ]
     ]
     return InlineKeyboardMarkup(keyboard)
@@ -143,98 +196,137 @@ def get_main_keyboard():
 def get_game_keyboard():
     """Game selection keyboard"""
     keyboard = [
-        [InlineKeyboardButton("🎲 Чет/нечет", callback_data="game_even_odd")],
-        [InlineKeyboardButton("📊 Больше/меньше", callback_data="game_higher_lower")],
-        [InlineKeyboardButton("🎳 Боулинг", callback_data="game_bowling")],
-        [InlineKeyboardButton("🧪 Тест API", callback_data="test_api")],
-        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")],
+        [InlineKeyboardButton("🎲 Чет/нечет", callback_data=callback_data("game", "even_odd"))],
+        [InlineKeyboardButton("📊 Больше/меньше", callback_data=callback_data("game", "higher_lower"))],
+        [InlineKeyboardButton("🎳 Боулинг", callback_data=callback_data("game", "bowling"))],
+        [InlineKeyboardButton("🧪 Тест API", callback_data=callback_data("test_api"))],
+        [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))],
     ]
     return InlineKeyboardMarkup(keyboard)
 
+def render_profile(user_id):
+    """Profile text for a user, re-rendered only when the user record changed"""
+    user_data = get_user_data(user_id)
+    version = user_data.version if user_data else None
+    cached = _profile_cache.get(user_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    if not user_data:
+        profile_text = (
+            "👤 Ваш профиль:\n\n"
+            "🎮 Вы еще не сыграли ни одной игры!\n\n"
+            "📅 Дата регистрации: Unknown\n\n"
+            "❤️ У вас еще нет любимого режима игры."
+        )
+    else:
+        if user_data.games_played > 0:
+            streak = user_data.current_streak
+            streak_text = f"{streak} побед подряд" if streak > 0 else f"{-streak} поражений подряд"
+            games_text = (
+                f"🎮 Количество сыгранных игр: {user_data.games_played}\n"
+                f"✅ Побед: {user_data.wins} | ❌ Поражений: {user_data.losses}\n"
+                f"💰 Итог: {round(user_data.net_profit, 2)} TON\n"
+                f"🔥 Серия: {streak_text} (лучшая: {user_data.best_streak})"
+            )
+        else:
+            games_text = "🎮 Вы еще не сыграли ни одной игры!"
+        favorite_game = user_data.favorite_game
+        favorite_text = (f"❤️ Любимый режим: {GAME_DISPLAY_NAMES.get(favorite_game, favorite_game)}"
+                         if favorite_game else "❤️ У вас еще нет любимого режима игры.")
+
+        profile_text = (
+            "👤 Ваш профиль:\n\n"
+            f"{games_text}\n\n"
+            f"📅 Дата регистрации: {format_timestamp(user_data.registration_date)}\n\n"
+            f"{favorite_text}"
+        )
+
+    _profile_cache[user_id] = (version, profile_text)
+    return profile_text
+
 async def profile_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle profile button click."""
     query = update.callback_query
     await query.answer()
 
-    user_id = query.from_user.id
-    games_played = get_games_played(user_id)
-    registration_date = get_registration_date(user_id)
-    favorite_game = get_favorite_game(user_id)
-
-    games_text = f"🎮 Количество сыгранных игр: {games_played}" if games_played > 0 else "🎮 Вы еще не сыграли ни одной игры!"
-    favorite_text = f"❤️ Любимый режим: {favorite_game}" if favorite_game else "❤️ У вас еще нет любимого режима игры."
-
-    profile_text = (
-        "👤 Ваш профиль:\n\n"
-        f"{games_text}\n\n"
-        f"📅 Дата регистрации: {registration_date}\n\n"
-        f"{favorite_text}"
-    )
+    profile_text = render_profile(query.from_user.id)
 
     await query.edit_message_text(
         text=profile_text,
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+            [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
         ])
     )
 
+async def top_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle the /top command."""
+    await update.message.reply_text(
+        render_top_message(),
+        reply_markup=get_main_keyboard()
+    )
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Handle /broadcast <text>, /broadcast status and /broadcast cancel (admins only)
+
+    In cluster mode every worker receives the command and broadcasts to its
+    own users; only the worker owning the admin answers.
+    """
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        return
+
+    parts = (update.message.text_html or "").split(maxsplit=1)
+    argument = parts[1] if len(parts) > 1 else ""
+    if argument in ("", "status"):
+        result = {"message": broadcaster.summary() if broadcaster.running else "Рассылка не идет"}
+    elif argument == "cancel":
+        result = await broadcaster.cancel()
+    else:
+        result = broadcaster.begin(argument, parse_mode="HTML", admin_chat_id=update.effective_chat.id)
+        logger.info(f"Broadcast requested by admin {user.id}: {result['message']}")
+
+    if broadcaster.owns(user.id):
+        await update.message.reply_text(result["message"])
+
+async def exposure_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /exposure: live house exposure of open bets (admins only)"""
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        return
+
+    report = exposure.report()
+    lines = [f"📊 Открытых ставок: {report['open_bets']}"]
+    for outcome, totals in report["outcomes"].items():
+        if totals["stakes"]:
+            lines.append(f"• {outcome}: ставки {totals['stakes']} TON, к выплате {totals['liability']} TON")
+    worst = report["worst_case"]
+    lines.append(f"⚠️ Худший исход: {worst['face']} — выплата {worst['payout']} TON "
+                 f"(лимит {report['limits']['total']} TON)")
+    lines.append(f"Отклонено: {report['rejected']}, уменьшено: {report['capped']}")
+    await update.message.reply_text("\n".join(lines))
+
 async def play_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик кнопки 'ИГРАТЬ'."""
     query = update.callback_query
     await query.answer()
 
     user = query.from_user
+    channel_id = RESULTS_CHANNEL_ID
 
-    # Создаем платежный URL для CryptoBot
-    payment_url = await create_payment_url(user.id)
+    try:
+        # Announce the bet in the channel; the personal link stays in this chat
+        payment_url, bet_id = await send_channel_bet_message(context, user)
+        logger.info(f"Successfully sent bet message to channel {channel_id}")
 
-    # Отправляем сообщение с кнопкой для перехода в CryptoBot
-    await query.edit_message_text(
-        text="💎 Хочешь испытать удачу?\n\n👇 Нажми на кнопку ниже, чтобы перейти в @CryptoBot и сделать ставку.",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-        ])
-    )
- # Send bet message to the channel
-message = await context.bot.send_message(
-    chat_id=channel_id,
-    text=(
-        f"🎮 *НОВАЯ СТАВКА* 🔥\n\n"
-        f"👤 Игрок: {user.first_name}\n\n"
-        f"📝 *В комментарии к платежу укажите:*\n\n"
-        f"*Режим и исход:*\n"
-        f"• 🎳 Боулинг: `бол - победа` или `бол - поражение`\n"
-        f"• 🎲 Чет/Нечет: `чет` или `нечет`\n"
-        f"• 📊 Больше/Меньше: `больше` или `меньше`\n\n"
-        f"👇 *Введите удобную для вас сумму от 0.1 до 10 TON* при оплате через CryptoBot:"
-    ),
-    parse_mode="Markdown",
-    reply_markup=InlineKeyboardMarkup([
-        [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
-        [InlineKeyboardButton("📋 Инструкция", callback_data="instruction")]
-    ])
-)
-logger.info(f"Successfully sent bet message to channel {channel_id}")
-
-        # Save bet information in context
-        if not context.user_data.get("bets"):
-            context.user_data["bets"] = {}
-
-        bet_id = f"{user.id}_{int(datetime.datetime.now().timestamp())}"
-        context.user_data["bets"][bet_id] = {
-            "game_type": "user_choice",  # User will choose when paying
-            "bet_choice": "user_choice",  # User will choose when paying
-            "message_id": message.message_id if message else None,
-            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        }
-
-        # Send success message to user
+        # Отправляем сообщение с кнопкой для перехода в CryptoBot
         await query.edit_message_text(
-            text="💎 Хочешь испытать удачу?\n\n💰 Сообщение со ставкой отправлено в канал! Нажмите на кнопку для перехода в канал и оплаты ставки.",
+            text=f"💎 Хочешь испытать удачу?\n\n{bet_amount_hint(bet_id)}\n\n"
+                 f"👇 Нажми на кнопку ниже, чтобы перейти в @CryptoBot и сделать ставку.",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🎲 Перейти в канал", url=channel_url)],
-                [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+                [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
+                [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
             ])
         )
     except Exception as e:
@@ -243,34 +335,31 @@ logger.info(f"Successfully sent bet message to channel {channel_id}")
             await query.edit_message_text(
                 text="⚠️ Бот не имеет доступа к игровому каналу. Пожалуйста, добавьте бота в канал как администратора и попробуйте снова.",
                 reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+                    [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
                 ])
             )
         except Exception as edit_error:
             logger.error(f"Failed to send error message to user: {edit_error}")
 
-async def game_selection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def game_selection_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, game_type: str) -> None:
     """Handle game selection."""
     query = update.callback_query
     await query.answer()
 
-    logger.info(f"Выбран режим игры: {query.data}")
-
-    parts = query.data.split("_", 1)
-
-    if len(parts) != 2:
-        logger.error(f"Неверный формат callback_data: {query.data}")
-        return
-
-    prefix, game_type = parts
+    logger.info(f"Выбран режим игры: {game_type}")
 
     user = query.from_user
 
-    await send_channel_bet_message(context, user, None, None)
+    payment_url, bet_id = await send_channel_bet_message(context, user, None, None)
 
+    # The link is personal, so it is shown here and not in the channel
     await query.edit_message_text(
-        text="✅ Ваша ставка принята! Переходите в канал, чтобы сделать ставку.",
-        reply_markup=get_main_keyboard()
+        text=f"✅ Ваша ставка принята! {bet_amount_hint(bet_id)}\n\n"
+             f"👇 Оплатите ее через CryptoBot по кнопке ниже.",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
+            [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
+        ])
     )
 
 async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -279,11 +368,11 @@ async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         query = update.callback_query
         await query.answer()
 
-        if query.data == "back_to_main":
-            await query.edit_message_text(
-                text="Приветствуем вас в нашем захватывающем казино! 🎰💥 Погрузитесь в мир азарта и удачи прямо сейчас!",
-                reply_markup=get_main_keyboard()
-            )
+        # Only the "back" button is routed here
+        await query.edit_message_text(
+            text="Приветствуем вас в нашем захватывающем казино! 🎰💥 Погрузитесь в мир азарта и удачи прямо сейчас!",
+            reply_markup=get_main_keyboard()
+        )
     elif update.message:
         await update.message.reply_text(
             "Пожалуйста, используйте кнопки для взаимодействия с ботом.",
@@ -293,25 +382,39 @@ async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def instruction_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик кнопки инструкция"""
     query = update.callback_query
-    await query.answer()
-
     user_id = query.from_user.id
 
-    instruction_text = "Для продолжения нажмите кнопку 'Сделать ставку' ниже и выберите удобную вам сумму (от 0.1 до 10 TON)"
-
-    logger.warning(f"🔴🔴🔴 СОЗДАНИЕ ССЫЛКИ В ИНСТРУКЦИИ для пользователя {user_id}")
-    payment_url = await create_payment_url(user_id, 0.1)
+    # The instruction belongs to a bet already placed: show that bet's link
+    # instead of taking another invoice from the pool
+    payment_url, pooled = find_bet_link(context)
+    if pooled:
+        instruction_text = (f"Для продолжения нажмите кнопку 'Сделать ставку' ниже и оплатите ставку "
+                            f"({INVOICE_POOL_AMOUNT} TON)")
+    else:
+        instruction_text = "Для продолжения нажмите кнопку 'Сделать ставку' ниже и выберите удобную вам сумму (от 0.1 до 10 TON)"
+    pay_button = [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)]
 
-    logger.warning(f"===DEBUG=== Созданный WebApp payment_url: {payment_url}")
+    if query.message is not None and query.message.chat.type == "private":
+        await query.answer()
+        await query.edit_message_text(
+            text=instruction_text,
+            parse_mode="Markdown",
+            reply_markup=InlineKeyboardMarkup([
+                pay_button,
+                [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
+            ])
+        )
+        return
 
-    await query.edit_message_text(
-        text=instruction_text,
-        parse_mode="Markdown",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
-            [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
-        ])
-    )
+    # Clicked under a channel post: the link pays into the clicker's balance,
+    # so it goes to them in private and the post is left as it is
+    try:
+        await context.bot.send_message(chat_id=user_id, text=instruction_text,
+                                       reply_markup=InlineKeyboardMarkup([pay_button]))
+        await query.answer("Ссылка для оплаты отправлена вам в личные сообщения")
+    except Exception as e:
+        logger.warning(f"Could not send the payment link to user {user_id} in private: {e}")
+        await query.answer("Сначала запустите бота в личных сообщениях (/start)", show_alert=True)
 
 async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда для тестирования API CryptoBot"""
@@ -324,15 +427,18 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     else:
         message = await update.message.reply_text("🔄 Тестирование подключения к CryptoBot API...")
 
-    api_result = await test_api_connection()
+    api_result = await test_api_connection(deadline=make_deadline())
 
     logger.info(f"API test result: {api_result}")
 
     if api_result.get("success"):
+        bet_metrics = get_pending_bet_metrics()
         await message.edit_text(
             f"✅ Успешное подключение к CryptoBot API!\n\n"
             f"App ID: {api_result.get('app_id')}\n"
             f"Name: {api_result.get('name')}\n\n"
+            f"Ожидающих ставок: {bet_metrics['pending']}\n"
+            f"Несопоставленных платежей: {bet_metrics['unmatched_payments']}\n\n"
             f"Создаем тестовый платеж..."
         )
 
@@ -356,7 +462,7 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                     text=test_success_text,
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("Оплатить тестовый счет", url=payment_url)],
-                        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+                        [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
                     ])
                 )
 
@@ -385,7 +491,7 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
                 await message.edit_text(
                     text=error_text,
                     reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+                        [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
                     ])
                 )
             else:
@@ -399,7 +505,7 @@ async def test_api_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             await message.edit_text(
                 text=error_text,
                 reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("◀️ Назад", callback_data="back_to_main")]
+                    [InlineKeyboardButton("◀️ Назад", callback_data=callback_data("back"))]
                 ])
             )
         else:
@@ -437,7 +543,7 @@ async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
                 parse_mode="Markdown",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("💰 Сделать ставку", url=payment_url)],
-                    [InlineKeyboardButton("📋 Инструкция", callback_data="instruction")]
+                    [InlineKeyboardButton("📋 Инструкция", callback_data=callback_data("instruction"))]
                 ])
             )
             logger.info(f"Отправлено приветственное сообщение в чат {chat_id}")
@@ -446,6 +552,9 @@ async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     elif chat_member.new_chat_member.status in ["left", "kicked"]:
         logger.info(f"Бот удален из чата {chat_id}")
+        # In a private chat this means the user blocked the bot
+        if chat_member.chat.type == "private":
+            set_user_blocked(chat_id, True)
 
 async def process_game_result(update: Update, context: ContextTypes.DEFAULT_TYPE, game_type: str, bet_choice: str, amount: float):
     """
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Pool of pre-created CryptoBot invoices handed out to users without an API round trip
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+from constants import (INVOICE_POOL_SIZE, INVOICE_POOL_LOW_WATER,
+                       INVOICE_POOL_AMOUNT, INVOICE_TTL)
+
+logger = logging.getLogger(__name__)
+
+# Invoices this close to expiry are no longer handed out
+INVOICE_EXPIRY_MARGIN = 300
+
+# Seconds between expiry/refill passes of the maintenance task
+MAINTENANCE_INTERVAL = 60
+
+
+@dataclass(slots=True)
+class PooledInvoice:
+    """An invoice created ahead of time, identified by its payload"""
+    payload: str
+    invoice_id: int
+    pay_url: str
+    expires_at: float
+    user_id: Optional[int] = None
+
+
+class InvoicePool:
+    """
+    Anonymous invoices waiting in a queue, plus those assigned to users.
+
+    Each invoice carries a unique `payload`, which is also used as the bet ID,
+    so a paid invoice identifies both the user and the bet. The pool is refilled
+    in the background whenever it drops below `low_water`.
+    """
+
+    def __init__(self, size=INVOICE_POOL_SIZE, low_water=INVOICE_POOL_LOW_WATER,
+                 amount=INVOICE_POOL_AMOUNT, ttl=INVOICE_TTL):
+        self.size = size
+        self.low_water = low_water
+        self.amount = amount
+        self.ttl = ttl
+        # Prefix of generated payloads, lets the cluster front route payments
+        self.payload_prefix = ""
+        self._available = deque()  # ordered by creation, so also by expiry
+        self._assigned = {}  # payload -> PooledInvoice
+        self._refill_task = None
+        # After a refill that created nothing, wait before calling the API again
+        self._retry_after = 0
+
+    def __len__(self):
+        return len(self._available)
+
+    def acquire(self, user_id) -> Optional[PooledInvoice]:
+        """Take an invoice for a user, or None if the pool is empty"""
+        self._drop_expired_available(time.time())
+        invoice = self._available.popleft() if self._available else None
+        if invoice is not None:
+            invoice.user_id = user_id
+            self._assigned[invoice.payload] = invoice
+        if len(self._available) < self.low_water:
+            self.schedule_refill()
+        return invoice
+
+    def owner_of(self, payload):
+        """User an invoice was handed to, or None"""
+        invoice = self._assigned.get(payload)
+        return invoice.user_id if invoice else None
+
+    def release(self, payload):
+        """Forget an assigned invoice once it has been paid"""
+        self._assigned.pop(payload, None)
+
+    def _drop_expired_available(self, now):
+        while self._available and self._available[0].expires_at - INVOICE_EXPIRY_MARGIN <= now:
+            self._available.popleft()
+
+    def expire(self, now=None):
+        """Drop unused invoices that expired or are about to"""
+        now = now or time.time()
+        self._drop_expired_available(now)
+        expired = [payload for payload, invoice in self._assigned.items() if invoice.expires_at <= now]
+        for payload in expired:
+            del self._assigned[payload]
+        return len(expired)
+
+    def schedule_refill(self):
+        """Start a background refill unless one is already running"""
+        if time.time() < self._retry_after:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.get_running_loop().create_task(self.refill())
+
+    async def refill(self):
+        """Create invoices until the pool is full again"""
+        from crypto_payments import create_pool_invoice
+
+        missing = self.size - len(self._available)
+        if missing <= 0:
+            return
+        payloads = [f"{self.payload_prefix}bet_{uuid.uuid4().hex}" for _ in range(missing)]
+        results = await asyncio.gather(
+            *(create_pool_invoice(payload, self.amount, self.ttl) for payload in payloads))
+        created = 0
+        for payload, result in zip(payloads, results):
+            if result:
+                self._available.append(PooledInvoice(
+                    payload, result["invoice_id"], result["pay_url"], time.time() + self.ttl))
+                created += 1
+        if not created:
+            self._retry_after = time.time() + MAINTENANCE_INTERVAL
+        logger.info(f"Invoice pool refilled with {created}/{missing} invoices ({len(self._available)} available)")
+
+    async def run_maintenance(self, interval=MAINTENANCE_INTERVAL):
+        """Expire unused invoices and top up the pool periodically"""
+        while True:
+            self.expire()
+            self.schedule_refill()
+            await asyncio.sleep(interval)
+
+
+invoice_pool = InvoicePool()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Incrementally maintained leaderboards and the cached /top message
+"""
+
+import time
+import logging
+from bisect import insort
+from heapq import heappush, heappop, heapify
+from datetime import date
+from constants import LEADERBOARD_SIZE
+from user_data import get_user_data, add_shard_load_listener
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    """
+    Scores per user, with the top `size` entries kept in order.
+
+    Only the visible top is sorted; everyone else waits in a heap with lazy
+    deletion (an entry is stale once its user's score changed or the user
+    is in the top). An update costs O(log n) for the heap plus O(size) for
+    the short top list. `version` is bumped only when the visible top
+    entries actually change, so it can be used as a cache key for rendered
+    output.
+    """
+
+    def __init__(self, size=LEADERBOARD_SIZE):
+        self.size = size
+        self.scores = {}
+        self._top = []  # sorted (-score, user_id), at most `size`
+        self._top_users = set()
+        self._rest = []  # heap of (-score, user_id) of users outside the top
+        self.version = 0
+
+    def set(self, user_id, score):
+        """Set the score of a user"""
+        old_score = self.scores.get(user_id)
+        if old_score == score:
+            return
+        self.scores[user_id] = score
+        entry = (-score, user_id)
+        if user_id in self._top_users:
+            # Its place may now belong to someone from the heap
+            self._top.remove((-old_score, user_id))
+            self._top_users.discard(user_id)
+            heappush(self._rest, entry)
+            self._refill()
+            self.version += 1
+        elif len(self._top) < self.size or entry < self._top[-1]:
+            insort(self._top, entry)
+            self._top_users.add(user_id)
+            if len(self._top) > self.size:
+                evicted = self._top.pop()
+                self._top_users.discard(evicted[1])
+                heappush(self._rest, evicted)
+            self.version += 1
+        else:
+            heappush(self._rest, entry)
+        if len(self._rest) > 2 * len(self.scores) + 64:
+            self._compact()
+
+    def _refill(self):
+        """Move the best users from the heap into the top until it is full"""
+        while len(self._top) < self.size and self._rest:
+            entry = heappop(self._rest)
+            score, user_id = entry
+            if user_id not in self._top_users and self.scores.get(user_id) == -score:
+                insort(self._top, entry)
+                self._top_users.add(user_id)
+
+    def _compact(self):
+        """Drop stale heap entries"""
+        self._rest = [(-score, user_id) for user_id, score in self.scores.items()
+                      if user_id not in self._top_users]
+        heapify(self._rest)
+
+    def add(self, user_id, delta):
+        """Add delta to the score of a user"""
+        self.set(user_id, self.scores.get(user_id, 0) + delta)
+
+    def top(self):
+        """Top entries as (user_id, score) pairs, highest first"""
+        return [(user_id, -score) for score, user_id in self._top]
+
+    def clear(self):
+        """Drop all scores"""
+        self.scores = {}
+        self._top = []
+        self._top_users = set()
+        self._rest = []
+        self.version += 1
+
+
+class WindowedLeaderboard(Leaderboard):
+    """Leaderboard that resets itself when a new day or week starts"""
+
+    def __init__(self, period, size=LEADERBOARD_SIZE):
+        super().__init__(size)
+        self.period = period
+        self.window = self._current_window()
+
+    def _current_window(self):
+        day = date.fromtimestamp(time.time())
+        if self.period == "week":
+            return day.toordinal() - day.weekday()
+        return day.toordinal()
+
+    def roll(self):
+        """Reset the scores if the current window has ended"""
+        window = self._current_window()
+        if window != self.window:
+            logger.info(f"Leaderboard window rolled over ({self.period})")
+            self.window = window
+            self.clear()
+
+    def set(self, user_id, score):
+        self.roll()
+        super().set(user_id, score)
+
+    def top(self):
+        self.roll()
+        return super().top()
+
+
+boards = {
+    "winners_day": WindowedLeaderboard("day"),
+    "winners_week": WindowedLeaderboard("week"),
+    "games_day": WindowedLeaderboard("day"),
+    "games_week": WindowedLeaderboard("week"),
+    "games_all": Leaderboard(),
+    "balance": Leaderboard(),
+}
+
+# Boards shown by /top, in display order
+TOP_SECTIONS = [
+    ("🏆 Выигрыши за день", "winners_day", "TON"),
+    ("🏆 Выигрыши за неделю", "winners_week", "TON"),
+    ("💰 Баланс", "balance", "TON"),
+    ("🎮 Игр за неделю", "games_week", "игр"),
+]
+
+_rendered = {"key": None, "text": None}
+
+
+def seed(records):
+    """Seed the all-time boards from user records loaded from disk"""
+    for record in records:
+        if record.games_played:
+            boards["games_all"].set(record.user_id, record.games_played)
+        if record.balance:
+            boards["balance"].set(record.user_id, record.balance)
+
+# Users are loaded shard by shard, seed the boards as each shard comes in
+add_shard_load_listener(seed)
+
+def record_game(user_id, net_result):
+    """Update the leaderboards after a settled game"""
+    boards["winners_day"].add(user_id, net_result)
+    boards["winners_week"].add(user_id, net_result)
+    boards["games_day"].add(user_id, 1)
+    boards["games_week"].add(user_id, 1)
+    boards["games_all"].add(user_id, 1)
+
+def update_balance(user_id, balance):
+    """Update the balance leaderboard after a balance change"""
+    boards["balance"].set(user_id, balance)
+
+def _display_name(user_id):
+    user_data = get_user_data(user_id)
+    if user_data and user_data.username != "Anonymous":
+        return f"@{user_data.username}"
+    return f"user{user_id}"
+
+def render_top_message():
+    """Rendered /top text, re-rendered only when a visible top list changed"""
+    sections = [(title, boards[name], unit) for title, name, unit in TOP_SECTIONS]
+    for _, board, _ in sections:
+        if isinstance(board, WindowedLeaderboard):
+            board.roll()
+    key = tuple(board.version for _, board, _ in sections)
+    if _rendered["key"] == key:
+        return _rendered["text"]
+
+    lines = ["📊 Таблица лидеров\n"]
+    for title, board, unit in sections:
+        lines.append(title)
+        entries = board.top()
+        if not entries:
+            lines.append("  пока никого нет")
+        for place, (user_id, score) in enumerate(entries, start=1):
+            value = round(score, 2) if isinstance(score, float) else score
+            lines.append(f"  {place}. {_display_name(user_id)} — {value} {unit}")
+        lines.append("")
+
+    _rendered["key"] = key
+    _rendered["text"] = "\n".join(lines).rstrip()
+    return _rendered["text"]
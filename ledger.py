@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local ledger of CryptoBot money movements, used for reconciliation
+"""
+
+import os
+import time
+import sqlite3
+import logging
+from constants import LEDGER_FILE
+
+logger = logging.getLogger(__name__)
+
+# Entry kinds
+INVOICE = "invoice"
+TRANSFER = "transfer"
+
+
+class Ledger:
+    """
+    Invoices credited to and transfers paid out of local balances.
+
+    Rows live in SQLite so reconciliation can look entries up one at a time
+    instead of loading the history. The file also keeps the reconciliation
+    cursors and the discrepancies found so far.
+    """
+
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "kind TEXT NOT NULL, remote_id INTEGER NOT NULL, user_id INTEGER, "
+                "amount REAL NOT NULL, asset TEXT, spend_id TEXT, created_at REAL NOT NULL, "
+                "reconciled INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (kind, remote_id));"
+                "CREATE INDEX IF NOT EXISTS entries_spend_id ON entries (spend_id);"
+                "CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS discrepancies ("
+                "kind TEXT NOT NULL, remote_id TEXT NOT NULL, issue TEXT NOT NULL, "
+                "details TEXT, found_at REAL NOT NULL, PRIMARY KEY (kind, remote_id, issue));")
+            self._connection = connection
+        return self._connection
+
+    def record(self, kind, remote_id, user_id, amount, asset="TON", spend_id=None):
+        """Add an entry; recording the same remote ID twice is a no-op"""
+        try:
+            connection = self._connect()
+            with connection:
+                connection.execute(
+                    "INSERT OR IGNORE INTO entries "
+                    "(kind, remote_id, user_id, amount, asset, spend_id, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (kind, int(remote_id), user_id, float(amount), asset, spend_id, time.time()))
+        except Exception as e:
+            logger.error(f"Error recording {kind} {remote_id} in ledger: {e}")
+
+    def claim(self, kind, remote_id, user_id, amount, asset="TON"):
+        """
+        Add an entry before crediting it, so one remote ID is credited once
+
+        Returns:
+            bool: True if the entry is new, False if it was already recorded
+        """
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO entries (kind, remote_id, user_id, amount, asset, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, int(remote_id), user_id, float(amount), asset, time.time()))
+        return cursor.rowcount > 0
+
+    def find(self, kind, remote_id=None, spend_id=None):
+        """Entry as (remote_id, user_id, amount, reconciled), or None"""
+        if spend_id is not None:
+            query, key = "spend_id = ?", spend_id
+        else:
+            query, key = "remote_id = ?", int(remote_id)
+        return self._connect().execute(
+            f"SELECT remote_id, user_id, amount, reconciled FROM entries WHERE kind = ? AND {query}",
+            (kind, key)).fetchone()
+
+    def mark_reconciled(self, kind, remote_id):
+        connection = self._connect()
+        with connection:
+            connection.execute("UPDATE entries SET reconciled = 1 WHERE kind = ? AND remote_id = ?",
+                               (kind, int(remote_id)))
+
+    def iter_unreconciled(self, kind, after_id, created_before):
+        """Unmatched entries above `after_id`, streamed from SQLite"""
+        yield from self._connect().execute(
+            "SELECT remote_id, user_id, amount FROM entries WHERE kind = ? AND reconciled = 0 "
+            "AND remote_id > ? AND created_at < ? ORDER BY remote_id",
+            (kind, after_id, created_before))
+
+    def get_cursor(self, name):
+        row = self._connect().execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def set_cursor(self, name, value):
+        connection = self._connect()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO cursors (name, value) VALUES (?, ?)", (name, value))
+
+    def add_discrepancy(self, kind, remote_id, issue, details=""):
+        """
+        Store a discrepancy
+
+        Returns:
+            bool: True if it had not been reported before
+        """
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO discrepancies (kind, remote_id, issue, details, found_at) "
+                "VALUES (?, ?, ?, ?, ?)", (kind, str(remote_id), issue, details, time.time()))
+        return cursor.rowcount > 0
+
+    def iter_discrepancies(self, since=0):
+        yield from self._connect().execute(
+            "SELECT kind, remote_id, issue, details, found_at FROM discrepancies "
+            "WHERE found_at >= ? ORDER BY found_at", (since,))
+
+
+ledger = Ledger()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Process lifecycle: journaled in-flight games, graceful shutdown and recovery
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import logging
+from telegram.ext import ApplicationHandlerStop
+from constants import GAME_JOURNAL_FILE, CHECKPOINT_FILE, SHUTDOWN_DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class GameJournal:
+    """
+    Games whose stake was taken but which are not settled yet.
+
+    A row is written before the stake is debited, gets the payout once the
+    dice are known, and is deleted after the game is settled. Debiting and
+    settling also add and remove the game in the user's `open_games`, in the
+    same save as the balance, so a row left after a crash tells what to
+    refund or pay out and the marker tells whether that already happened.
+    """
+
+    def __init__(self, path=GAME_JOURNAL_FILE):
+        self.path = path
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS games ("
+                "game_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, game_type TEXT NOT NULL, "
+                "stake REAL NOT NULL, payout REAL, started_at REAL NOT NULL)")
+            self._connection = connection
+        return self._connection
+
+    def open(self, game_id, user_id, game_type, stake):
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "INSERT INTO games (game_id, user_id, game_type, stake, started_at) VALUES (?, ?, ?, ?, ?)",
+                (game_id, user_id, game_type, stake, time.time()))
+
+    def set_payout(self, game_id, payout):
+        connection = self._connect()
+        with connection:
+            connection.execute("UPDATE games SET payout = ? WHERE game_id = ?", (payout, game_id))
+
+    def close(self, game_id):
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+
+    def close_many(self, game_ids):
+        connection = self._connect()
+        with connection:
+            connection.executemany("DELETE FROM games WHERE game_id = ?", ((game_id,) for game_id in game_ids))
+
+    def get(self, game_id):
+        """Game as (game_id, user_id, game_type, stake, payout), or None"""
+        return self._connect().execute(
+            "SELECT game_id, user_id, game_type, stake, payout FROM games WHERE game_id = ?",
+            (game_id,)).fetchone()
+
+    def iter_open(self):
+        yield from self._connect().execute(
+            "SELECT game_id, user_id, game_type, stake, payout FROM games ORDER BY started_at").fetchall()
+
+
+class Lifecycle:
+    """
+    Tracks games in progress and runs the shutdown and startup sequences.
+
+    Shutdown stops taking new updates, waits up to `drain_timeout` seconds
+    for games in progress, flushes user data, queues and logs, and writes a
+    checkpoint. Startup reads the checkpoint and settles whatever the
+    journal still holds: games with a known outcome are paid out, the rest
+    get their stake back.
+    """
+
+    def __init__(self, journal=None, checkpoint_path=CHECKPOINT_FILE,
+                 drain_timeout=SHUTDOWN_DRAIN_TIMEOUT):
+        self.journal = journal or GameJournal()
+        self.checkpoint_path = checkpoint_path
+        self.drain_timeout = drain_timeout
+        self.accepting = True
+        self.drained = None
+        self._active = set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    # --- Games ---
+
+    def begin_game(self, user_id, game_type, stake):
+        """Journal a game, then debit its stake; returns its ID"""
+        from crypto_payments import update_user_balance
+
+        game_id = uuid.uuid4().hex
+        self.journal.open(game_id, user_id, game_type, stake)
+        self._active.add(game_id)
+        self._drained.clear()
+        update_user_balance(user_id, -stake, "bet", open_game=game_id)
+        return game_id
+
+    def record_outcome(self, game_id, payout):
+        """The dice decided the game; `payout` is credited on settlement"""
+        self.journal.set_payout(game_id, payout)
+
+    def finish_game(self, game_id, user_id, payout):
+        """Credit the payout (0 for a lost game) and settle the game"""
+        from crypto_payments import update_user_balance
+
+        update_user_balance(user_id, payout, "payout", close_game=game_id)
+        self.journal.close(game_id)
+        self._forget(game_id)
+
+    def finish_games(self, settlements, reason="payout"):
+        """
+        Settle many games with one save of user data (a shared round)
+
+        Args:
+            settlements: (game_id, user_id, payout) per game, payout 0 if lost
+            reason: Reason recorded in the audit log
+
+        Returns:
+            dict: {user_id: new balance}
+        """
+        from crypto_payments import apply_balance_changes
+
+        changes = {}
+        closes = {}
+        for game_id, user_id, payout in settlements:
+            changes[user_id] = changes.get(user_id, 0) + payout
+            closes.setdefault(user_id, []).append(game_id)
+        balances = apply_balance_changes({user_id: change for user_id, change in changes.items() if change},
+                                         reason, close_games=closes)
+        game_ids = [game_id for game_ids in closes.values() for game_id in game_ids]
+        self.journal.close_many(game_ids)
+        for game_id in game_ids:
+            self._forget(game_id)
+        return balances
+
+    def abort_game(self, game_id):
+        """Settle a game that failed halfway, e.g. on a Telegram API error"""
+        game = self.journal.get(game_id)
+        if game is not None:
+            self._settle(game, counted=True)
+        self._forget(game_id)
+
+    def _forget(self, game_id):
+        self._active.discard(game_id)
+        if not self._active:
+            self._drained.set()
+
+    def _settle(self, game, counted=False):
+        """
+        Refund or pay out a journaled game and drop it from the journal
+
+        `counted` tells whether this process counted the stake for the limits
+        when it was authorized; games of a previous run were not counted.
+        """
+        from crypto_payments import update_user_balance
+        from responsible_gaming import limits
+
+        game_id, user_id, game_type, stake, payout = game
+        if payout is None:
+            amount, reason = stake, "refund"
+            resolution = f"ставка {stake} TON возвращена"
+        else:
+            amount, reason = payout, "payout"
+            resolution = f"выигрыш {payout} TON зачислен" if payout > 0 else None
+        # No marker: the stake was never taken or the game was already settled
+        if update_user_balance(user_id, amount, reason, close_game=game_id) is None:
+            self.journal.close(game_id)
+            logger.info(f"Dropped journaled game {game_id} ({game_type}) of user {user_id}: nothing to settle")
+            return user_id, None
+        # A played game counts against the loss limit, a refunded one does not
+        if counted:
+            limits.record_payout(user_id, amount)
+        elif payout is not None:
+            limits.record_bet(user_id, stake)
+            limits.record_payout(user_id, payout)
+        self.journal.close(game_id)
+        logger.info(f"Settled unfinished game {game_id} ({game_type}) of user {user_id}: {resolution or 'lost'}")
+        return user_id, resolution
+
+    # --- Shutdown ---
+
+    async def intake_guard(self, update, context):
+        """Drop updates that arrive once shutdown has begun"""
+        if not self.accepting:
+            raise ApplicationHandlerStop
+
+    async def drain(self):
+        """Wait for games in progress; False if some were still running at the deadline"""
+        try:
+            await asyncio.wait_for(self._drained.wait(), self.drain_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"{len(self._active)} games still running after {self.drain_timeout}s, "
+                           f"they will be settled on the next start")
+            return False
+
+    async def stop_intake(self):
+        """
+        Stop taking updates and payments, then wait for games in progress.
+        Run while the application still processes updates; later calls only
+        return the result of the first one.
+        """
+        from payment_webhook import payment_webhook
+
+        from rounds import rounds
+
+        if self.accepting:
+            self.accepting = False
+            await payment_webhook.stop()
+            # Bets of the open round are journaled games, settle them now
+            await rounds.close()
+            self.drained = await self.drain()
+        return self.drained
+
+    async def shutdown(self):
+        """Stop intake and drain games if not done yet, flush everything and write the checkpoint"""
+        from user_data import save_user_data
+        from withdrawals import withdrawal_queue
+        from audit_log import audit_log
+        from broadcast import broadcaster
+        from traffic_recorder import recorder
+
+        drained = await self.stop_intake()
+        # The broadcast checkpoint is already on disk, the next run resumes it
+        await broadcaster.stop()
+        save_user_data()
+        await withdrawal_queue.stop()
+        audit_log.flush()
+        audit_log.close()
+        recorder.close()
+        self.write_checkpoint(clean=drained, unfinished_games=len(self._active),
+                              queued_withdrawals=len(withdrawal_queue.pending()))
+        logger.info("Shutdown complete")
+
+    # --- Startup ---
+
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"Error reading checkpoint: {e}")
+            return None
+
+    def write_checkpoint(self, **state):
+        """Write the checkpoint atomically"""
+        try:
+            directory = os.path.dirname(self.checkpoint_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.checkpoint_path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({"written_at": time.time(), **state}, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.checkpoint_path)
+        except Exception as e:
+            logger.error(f"Error writing checkpoint: {e}")
+
+    async def recover(self, bot=None):
+        """Settle games left unfinished by the previous run and notify their players"""
+        checkpoint = self.read_checkpoint()
+        if checkpoint is None:
+            logger.info("No shutdown checkpoint found")
+        elif not checkpoint.get("clean"):
+            logger.warning(f"Previous run did not shut down cleanly: {checkpoint}")
+        # Until the next graceful shutdown, a crash is what the checkpoint reports
+        self.write_checkpoint(clean=False, running_since=time.time())
+
+        settled = 0
+        for game in self.journal.iter_open():
+            user_id, resolution = self._settle(game)
+            settled += 1
+            if bot is not None and resolution:
+                try:
+                    await bot.send_message(
+                        chat_id=user_id,
+                        text=f"⚠️ Игра была прервана перезапуском бота, {resolution}.")
+                except Exception as e:
+                    logger.error(f"Error notifying user {user_id} about recovered game: {e}")
+        if settled:
+            logger.info(f"Settled {settled} games left unfinished by the previous run")
+        return settled
+
+
+lifecycle = Lifecycle()
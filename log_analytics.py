@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline analytics over bot.log and audit log segments
+
+Files are streamed line by line (plain logs through mmap), so memory use does
+not depend on their size. Reports:
+    - Telegram Bot API call latencies and HTTP statuses per method
+    - log records and errors per logger (module)
+    - errors per handler: the function that logged the error, or for an
+      exception PTB caught, the bot function its traceback entered first
+    - bets, stakes and payouts per game, balance changes per reason
+    - house profit and loss per hour
+
+Usage:
+    python log_analytics.py [--jobs N] [--json] FILE_OR_DIR ...
+"""
+
+import os
+import re
+import sys
+import mmap
+import json
+import time
+import argparse
+from datetime import datetime
+from multiprocessing import Pool
+from audit_log import SEGMENT_SUFFIX, GAME, BALANCE, iter_segment_lines
+
+# Upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float("inf"))
+
+# Logger name, then since main.py logs it ":function" (absent in older logs)
+_RECORD = re.compile(rb"(\d{4}-\d{2}-\d{2}) (\d{2}):(\d{2}):(\d{2}),(\d{3}) - ([^\s:]+)(?::(\S+))? - ([A-Z]+) - ")
+_FRAME = re.compile(rb'\s*File "([^"]+)", line \d+, in (\S+)')
+_API_CALL = re.compile(rb"(Entering|Exiting): (\w+)")
+_HTTP_REQUEST = re.compile(rb'HTTP Request: \w+ https://api\.telegram\.org/bot[^/\s]+/(\w+) "HTTP/[\d.]+ (\d{3})')
+
+_CAMEL_CASE = re.compile(r"(?<!^)(?=[A-Z])")
+
+_API_LOGGER = b"telegram.ext.ExtBot"
+
+# Logs the exceptions raised by handlers, with their traceback
+_HANDLER_ERROR_LOGGER = b"telegram.ext.Application"
+
+# Bot modules that call handlers rather than handle updates themselves
+_DISPATCH_MODULES = {"callback_router"}
+
+# Calls in flight kept per method; calls that never logged "Exiting" fall off
+MAX_OPEN_CALLS = 64
+
+
+class LogStats:
+    """Aggregates of one or more files; partial results are merged"""
+
+    def __init__(self):
+        self.api_latency = {}  # method -> [calls, total_ms, max_ms, bucket counts]
+        self.api_status = {}  # method -> {status: count}
+        self.records = {}  # logger -> [records, errors]
+        self.handler_errors = {}  # "module.function" -> [errors]
+        self.games = {}  # game -> [bets, staked, paid out]
+        self.balance = {}  # reason -> [changes, total delta]
+        self.pnl_by_hour = {}  # "YYYY-MM-DD HH" -> house profit
+
+    def add_latency(self, method, milliseconds):
+        entry = self.api_latency.get(method)
+        if entry is None:
+            entry = self.api_latency[method] = [0, 0.0, 0.0, [0] * len(LATENCY_BUCKETS)]
+        entry[0] += 1
+        entry[1] += milliseconds
+        entry[2] = max(entry[2], milliseconds)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if milliseconds <= bound:
+                entry[3][index] += 1
+                break
+
+    def merge(self, other):
+        for method, (calls, total, longest, buckets) in other.api_latency.items():
+            entry = self.api_latency.setdefault(method, [0, 0.0, 0.0, [0] * len(LATENCY_BUCKETS)])
+            entry[0] += calls
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+            entry[3] = [mine + theirs for mine, theirs in zip(entry[3], buckets)]
+        for method, statuses in other.api_status.items():
+            mine = self.api_status.setdefault(method, {})
+            for status, count in statuses.items():
+                mine[status] = mine.get(status, 0) + count
+        for table in ("records", "handler_errors", "games", "balance"):
+            mine = getattr(self, table)
+            for key, values in getattr(other, table).items():
+                current = mine.setdefault(key, [0] * len(values))
+                mine[key] = [a + b for a, b in zip(current, values)]
+        for hour, profit in other.pnl_by_hour.items():
+            self.pnl_by_hour[hour] = self.pnl_by_hour.get(hour, 0) + profit
+        return self
+
+    def to_dict(self):
+        latency = {}
+        for method, (calls, total, longest, buckets) in sorted(self.api_latency.items()):
+            latency[method] = {
+                "calls": calls,
+                "avg_ms": round(total / calls, 1),
+                "p50_ms": _percentile(buckets, calls, 0.5),
+                "p95_ms": _percentile(buckets, calls, 0.95),
+                "max_ms": round(longest, 1),
+                "statuses": self.api_status.get(method, {}),
+            }
+        for method, statuses in self.api_status.items():
+            latency.setdefault(method, {"statuses": statuses})
+        return {
+            "api": latency,
+            "loggers": {name: {"records": total, "errors": errors,
+                               "error_rate": round(errors / total, 4)}
+                        for name, (total, errors) in sorted(self.records.items())},
+            "handlers": {handler: {"errors": errors}
+                         for handler, (errors,) in sorted(self.handler_errors.items())},
+            "games": {game: {"bets": bets, "staked": round(staked, 9), "paid_out": round(paid, 9)}
+                      for game, (bets, staked, paid) in sorted(self.games.items())},
+            "balance": {reason: {"changes": count, "total": round(total, 9)}
+                        for reason, (count, total) in sorted(self.balance.items())},
+            "pnl_by_hour": {hour: round(profit, 9) for hour, profit in sorted(self.pnl_by_hour.items())},
+        }
+
+
+def _percentile(buckets, calls, fraction):
+    """Upper bound of the bucket holding the given fraction of calls, None past the last bound"""
+    threshold = calls * fraction
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, buckets):
+        seen += count
+        if seen >= threshold:
+            return bound if bound != float("inf") else None
+    return None
+
+
+def _handler_frame(line):
+    """"module.function" of a traceback line in a bot module, else None"""
+    frame = _FRAME.match(line)
+    if frame is None:
+        return None
+    path = frame.group(1).decode(errors="replace")
+    if "site-packages" in path or "dist-packages" in path or os.sep + "lib" + os.sep + "python" in path:
+        return None
+    module = os.path.splitext(os.path.basename(path))[0]
+    if module in _DISPATCH_MODULES:
+        return None
+    return f"{module}.{frame.group(2).decode()}"
+
+def _iter_file_lines(path):
+    """Lines of a plain file through mmap, without reading it into memory"""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from iter(mapped.readline, b"")
+
+def analyze_log(path, stats=None):
+    """Aggregate one bot.log-format file"""
+    stats = stats or LogStats()
+    started = {}  # method -> start times of calls in flight, newest last
+    midnight = {}  # date -> epoch of its midnight
+    counters_by_name = {}  # raw logger name -> its stats.records entry
+    in_traceback = False  # a handler exception was logged, its handler not found yet
+
+    for line in _iter_file_lines(path):
+        match = _RECORD.match(line)
+        if match is None:
+            # Traceback or other continuation line
+            if in_traceback:
+                handler = _handler_frame(line)
+                if handler is not None:
+                    stats.handler_errors.setdefault(handler, [0])[0] += 1
+                    in_traceback = False
+            continue
+        date, hours, minutes, seconds, millis, name, function, level = match.groups()
+        if in_traceback:
+            stats.handler_errors.setdefault("unknown", [0])[0] += 1
+            in_traceback = False
+
+        counters = counters_by_name.get(name)
+        if counters is None:
+            counters = counters_by_name[name] = stats.records.setdefault(name.decode(), [0, 0])
+        counters[0] += 1
+        if level in (b"ERROR", b"CRITICAL"):
+            counters[1] += 1
+            if name == _HANDLER_ERROR_LOGGER:
+                in_traceback = True
+            elif function is not None:
+                handler = f"{name.decode().rsplit('.', 1)[-1]}.{function.decode()}"
+                stats.handler_errors.setdefault(handler, [0])[0] += 1
+
+        message_start = match.end()
+        if name == _API_LOGGER:
+            call = _API_CALL.match(line, message_start)
+            if call is None:
+                continue
+            day = midnight.get(date)
+            if day is None:
+                day = midnight[date] = time.mktime(time.strptime(date.decode(), "%Y-%m-%d"))
+            timestamp = day + int(hours) * 3600 + int(minutes) * 60 + int(seconds) + int(millis) / 1000
+            method = call.group(2).decode()
+            in_flight = started.setdefault(method, [])
+            if call.group(1) == b"Entering":
+                in_flight.append(timestamp)
+                if len(in_flight) > MAX_OPEN_CALLS:
+                    del in_flight[0]
+            elif in_flight:
+                # Pair with the latest start, so calls that failed without
+                # "Exiting" do not shift every later pairing
+                stats.add_latency(method, (timestamp - in_flight.pop()) * 1000)
+        elif name == b"httpx":
+            request = _HTTP_REQUEST.search(line, message_start)
+            if request is not None:
+                method = _CAMEL_CASE.sub("_", request.group(1).decode()).lower()
+                statuses = stats.api_status.setdefault(method, {})
+                status = request.group(2).decode()
+                statuses[status] = statuses.get(status, 0) + 1
+    if in_traceback:
+        stats.handler_errors.setdefault("unknown", [0])[0] += 1
+    return stats
+
+def analyze_audit(path, stats=None):
+    """Aggregate one audit log segment"""
+    stats = stats or LogStats()
+    for line in iter_segment_lines(path):
+        record = json.loads(line)
+        if record["e"] == GAME:
+            game = stats.games.setdefault(record["game"], [0, 0.0, 0.0])
+            game[0] += 1
+            game[1] += record["bet"]
+            game[2] += record["payout"]
+            hour = datetime.fromtimestamp(record["t"]).strftime("%Y-%m-%d %H")
+            stats.pnl_by_hour[hour] = stats.pnl_by_hour.get(hour, 0) + record["bet"] - record["payout"]
+        elif record["e"] == BALANCE:
+            reason = stats.balance.setdefault(record.get("reason") or "other", [0, 0.0])
+            reason[0] += 1
+            reason[1] += record["delta"]
+    return stats
+
+def analyze_path(path):
+    """Aggregate one file, picking the parser by its name"""
+    if path.endswith(SEGMENT_SUFFIX):
+        return analyze_audit(path)
+    return analyze_log(path)
+
+def expand_paths(paths):
+    """Files given directly plus audit segments and logs inside given directories"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith(SEGMENT_SUFFIX) or name.endswith(".log"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def analyze(paths, jobs=1):
+    """Aggregate all files, in `jobs` processes when more than one"""
+    files = list(expand_paths(paths))
+    total = LogStats()
+    if jobs > 1 and len(files) > 1:
+        with Pool(min(jobs, len(files))) as pool:
+            for partial in pool.imap_unordered(analyze_path, files):
+                total.merge(partial)
+    else:
+        for path in files:
+            total.merge(analyze_path(path))
+    return total
+
+
+def _format_bound(bound):
+    return f"<= {bound} ms" if bound is not None else f"> {LATENCY_BUCKETS[-2]} ms"
+
+def _print_report(report):
+    print("Telegram API calls:")
+    for method, entry in report["api"].items():
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(entry["statuses"].items()))
+        if "calls" in entry:
+            print(f"  {method:<24} {entry['calls']:>7} calls  avg {entry['avg_ms']:>8} ms  "
+                  f"p50 {_format_bound(entry['p50_ms'])}  p95 {_format_bound(entry['p95_ms'])}  max {entry['max_ms']} ms"
+                  f"{'  [' + statuses + ']' if statuses else ''}")
+        else:
+            print(f"  {method:<24} [{statuses}]")
+
+    print("\nLog records per logger:")
+    for name, entry in report["loggers"].items():
+        print(f"  {name:<32} {entry['records']:>8} records  {entry['errors']:>6} errors  "
+              f"({entry['error_rate']:.2%})")
+
+    print("\nErrors per handler:")
+    for handler, entry in sorted(report["handlers"].items(), key=lambda item: -item[1]["errors"]):
+        print(f"  {handler:<40} {entry['errors']:>6} errors")
+
+    print("\nGames:")
+    for game, entry in report["games"].items():
+        print(f"  {game:<16} {entry['bets']:>7} bets  staked {entry['staked']} TON  "
+              f"paid out {entry['paid_out']} TON")
+
+    print("\nBalance changes:")
+    for reason, entry in report["balance"].items():
+        print(f"  {reason:<16} {entry['changes']:>7} changes  total {entry['total']} TON")
+
+    print("\nHouse P&L per hour:")
+    for hour, profit in report["pnl_by_hour"].items():
+        print(f"  {hour}:00  {profit:+} TON")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate bot.log and audit log files")
+    parser.add_argument("paths", nargs="+", help="Log files, audit segments or directories")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes, one file each")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    report = analyze(args.paths, args.jobs).to_dict()
+    if args.json:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
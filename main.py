@@ -6,12 +6,12 @@ Main entry point for the Telegram casino bot
 """
 
 import os
+import time
 import logging
-from bot import create_bot
 
 # Set up logging with both console and file handlers (from original code)
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s:%(funcName)s - %(levelname)s - %(message)s',
     level=logging.DEBUG,
     handlers=[
         logging.StreamHandler(),
@@ -22,12 +22,28 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 if __name__ == '__main__':
+    # BOT_WORKERS > 1 runs a front process plus user-sharded worker processes
+    worker_count = int(os.getenv("BOT_WORKERS", "1"))
+    if worker_count > 1:
+        from cluster import run_cluster
+        run_cluster(worker_count)
+        raise SystemExit
+
     try:
+        # Start reading user data before the heavy telegram imports
+        import user_data
+        user_data.start_loading_user_data()
+        imports_began = time.monotonic()
+        from bot import create_bot
+        logger.info(f"Bot modules imported in {time.monotonic() - imports_began:.2f}s "
+                     f"(profile with: python startup_profile.py)")
+
         # Create and run the bot
         logger.info("Starting bot initialization...")
         bot = create_bot()
         logger.info("Bot created successfully, starting polling...")
-        bot.run_polling(allowed_updates=["message", "callback_query", "my_chat_member"])
+        # Stop signals are handled by bot.stop_gracefully, installed in post_init
+        bot.run_polling(allowed_updates=["message", "callback_query", "my_chat_member"], stop_signals=None)
         logger.info("Bot started successfully")
     except Exception as e:
         logger.error(f"Error occurred: {e}")
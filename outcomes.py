@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Payout table of the dice games
+"""
+
+from constants import (EVEN_ODD_MULTIPLIER, HIGHER_LOWER_MULTIPLIER, BOWLING_MULTIPLIER,
+                       HIGHER_LOWER_THRESHOLD)
+
+# Faces of the die, 1..6
+DICE_VALUES = range(1, 7)
+
+
+def _payout_row(wins, multiplier):
+    """Payout per staked TON for dice values 1..6"""
+    return tuple(multiplier if wins(value) else 0.0 for value in DICE_VALUES)
+
+# (game type, bet choice) -> payout per staked TON for each dice value.
+# Hot paths keep an index into OUTCOME_KEYS instead of the key itself.
+OUTCOMES = {
+    ("even_odd", "even"): _payout_row(lambda value: value % 2 == 0, EVEN_ODD_MULTIPLIER),
+    ("even_odd", "odd"): _payout_row(lambda value: value % 2 == 1, EVEN_ODD_MULTIPLIER),
+    ("higher_lower", "higher"): _payout_row(lambda value: value > HIGHER_LOWER_THRESHOLD,
+                                            HIGHER_LOWER_MULTIPLIER),
+    ("higher_lower", "lower"): _payout_row(lambda value: value <= HIGHER_LOWER_THRESHOLD,
+                                           HIGHER_LOWER_MULTIPLIER),
+    ("bowling", "win"): _payout_row(lambda value: value >= 4, BOWLING_MULTIPLIER),
+    ("bowling", "lose"): _payout_row(lambda value: value < 4, BOWLING_MULTIPLIER),
+}
+OUTCOME_KEYS = list(OUTCOMES)
+OUTCOME_CODES = {key: code for code, key in enumerate(OUTCOME_KEYS)}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CryptoBot webhook: the entry point of paid-invoice updates
+
+CryptoBot POSTs every update as JSON to the URL set for the app, signed
+with crypto-pay-api-signature (HMAC-SHA256 of the body, keyed with the
+SHA-256 of the API token). Verified updates are handed to a callback and
+acknowledged right away; anything unsigned or malformed is rejected.
+"""
+
+import hmac
+import json
+import asyncio
+import hashlib
+import logging
+from constants import CRYPTOBOT_WEBHOOK_HOST, CRYPTOBOT_WEBHOOK_PORT, CRYPTOBOT_WEBHOOK_PATH
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "crypto-pay-api-signature"
+
+
+def verify_signature(token, body, signature):
+    """Whether `signature` is CryptoBot's signature of `body` for the API token"""
+    if not token or not signature:
+        return False
+    secret = hashlib.sha256(token.encode()).digest()
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class PaymentWebhook:
+    """
+    Small aiohttp server receiving CryptoBot updates.
+
+    The coroutine passed to `start` is called with the parsed update (the
+    dict process_payment_update takes) in a task of its own, so CryptoBot
+    gets its 200 without waiting for the game to be played. Disabled when
+    `port` is 0.
+    """
+
+    def __init__(self, handle=None, host=CRYPTOBOT_WEBHOOK_HOST, port=CRYPTOBOT_WEBHOOK_PORT,
+                 path=CRYPTOBOT_WEBHOOK_PATH):
+        self.handle = handle
+        self.host = host
+        self.port = port
+        self.path = path
+        self.received = 0
+        self.rejected = 0
+        self._runner = None
+        self._tasks = set()
+
+    @property
+    def enabled(self):
+        return bool(self.port)
+
+    async def _receive(self, request):
+        # Imported on first use, like every other aiohttp user of the bot
+        from aiohttp import web
+        import crypto_payments
+
+        body = await request.read()
+        if not verify_signature(crypto_payments.CRYPTOBOT_TOKEN, body,
+                                request.headers.get(SIGNATURE_HEADER)):
+            self.rejected += 1
+            logger.warning(f"Rejected CryptoBot webhook with a bad signature from {request.remote}")
+            return web.Response(status=401)
+        try:
+            update_data = json.loads(body)
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+
+        self.received += 1
+        task = asyncio.get_running_loop().create_task(self._dispatch(update_data))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({"ok": True})
+
+    async def _dispatch(self, update_data):
+        try:
+            await self.handle(update_data)
+        except Exception as e:
+            logger.error(f"Error handling CryptoBot update {update_data.get('update_id')}: {e}")
+
+    async def start(self, handle=None):
+        """Listen for updates; the single process handles them, the cluster front routes them"""
+        self.handle = handle or self.handle
+        if not self.enabled:
+            logger.info("CryptoBot webhook disabled (CRYPTOBOT_WEBHOOK_PORT is not set)")
+            return
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post(self.path, self._receive)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"CryptoBot webhook listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Stop accepting updates and wait for the ones being handled"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+payment_webhook = PaymentWebhook()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Index of pending bets, used to match incoming CryptoBot payments to bets
+"""
+
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+from constants import PENDING_BET_TTL
+
+logger = logging.getLogger(__name__)
+
+# Resolution of the expiry timer wheel in seconds
+WHEEL_SLOT_SECONDS = 10
+
+
+@dataclass(slots=True)
+class PendingBet:
+    """A bet announced to the user/channel and waiting for its payment"""
+    bet_id: str
+    user_id: int
+    created_at: float
+    expires_at: float
+    message_id: Optional[int] = None
+
+
+class TimerWheel:
+    """
+    Buckets keys by expiry time so expiring them touches only due buckets.
+
+    The wheel spans at least the longest timeout; keys further out simply
+    stay in their bucket until a later turn reaches their expiry time.
+    """
+
+    def __init__(self, span, slot_seconds=WHEEL_SLOT_SECONDS):
+        self.slot_seconds = slot_seconds
+        self.slots = [dict() for _ in range(int(span // slot_seconds) + 2)]
+        self._current_tick = int(time.time() // slot_seconds)
+
+    def _slot(self, tick):
+        return self.slots[tick % len(self.slots)]
+
+    def add(self, key, expires_at):
+        tick = max(int(expires_at // self.slot_seconds), self._current_tick)
+        self._slot(tick)[key] = expires_at
+
+    def remove(self, key, expires_at):
+        tick = max(int(expires_at // self.slot_seconds), self._current_tick)
+        self._slot(tick).pop(key, None)
+
+    def advance(self, now=None):
+        """Pop and return keys expired up to `now`"""
+        now = now or time.time()
+        target_tick = int(now // self.slot_seconds)
+        expired = []
+        # Never walk more than one full turn, every bucket is visited by then
+        first_tick = max(self._current_tick, target_tick - len(self.slots) + 1)
+        for tick in range(first_tick, target_tick + 1):
+            bucket = self._slot(tick)
+            due = [key for key, expires_at in bucket.items() if expires_at <= now]
+            for key in due:
+                del bucket[key]
+            expired.extend(due)
+        self._current_tick = target_tick
+        return expired
+
+
+class PendingBetIndex:
+    """
+    Pending bets by bet ID and by user, with timer-wheel expiry.
+
+    Once bound to an application, a bet leaving the index (paid or expired)
+    is also removed from its user's context.user_data["bets"], so persisted
+    state never holds bets the index has already dropped.
+    """
+
+    def __init__(self, ttl=PENDING_BET_TTL):
+        self.ttl = ttl
+        self._bets = {}
+        self._by_user = {}  # user_id -> {bet_id: PendingBet}, oldest first
+        self._wheel = TimerWheel(ttl)
+        self._application = None
+        self.metrics = {
+            "created": 0,
+            "matched": 0,
+            "expired": 0,
+            "unmatched_payments": 0,
+        }
+
+    def __len__(self):
+        return len(self._bets)
+
+    def bind(self, application):
+        """Keep the bets in the application's context.user_data in step with the index"""
+        self._application = application
+
+    def _forget(self, bet):
+        if self._application is None:
+            return
+        data = self._application.user_data.get(bet.user_id)
+        bets = data.get("bets") if data else None
+        if bets and bets.pop(bet.bet_id, None) is not None:
+            self._application.mark_data_for_update_persistence(user_ids=[bet.user_id])
+
+    def add(self, bet_id, user_id, message_id=None, created_at=None):
+        """Register a pending bet"""
+        created_at = created_at or time.time()
+        bet = PendingBet(bet_id, user_id, created_at, created_at + self.ttl, message_id)
+        if bet.expires_at <= time.time():
+            return None
+        self._remove(bet_id)
+        self._bets[bet_id] = bet
+        self._by_user.setdefault(user_id, {})[bet_id] = bet
+        self._wheel.add(bet_id, bet.expires_at)
+        self.metrics["created"] += 1
+        return bet
+
+    def _remove(self, bet_id):
+        bet = self._bets.pop(bet_id, None)
+        if bet is None:
+            return None
+        user_bets = self._by_user.get(bet.user_id)
+        if user_bets is not None:
+            user_bets.pop(bet_id, None)
+            if not user_bets:
+                del self._by_user[bet.user_id]
+        self._wheel.remove(bet_id, bet.expires_at)
+        return bet
+
+    def owner_of(self, bet_id):
+        """User the pending bet belongs to, None for an unknown bet"""
+        bet = self._bets.get(bet_id)
+        return bet.user_id if bet else None
+
+    def match_payment(self, user_id, payload=None):
+        """
+        Find and remove the bet a payment belongs to
+
+        Matches the invoice payload (a bet ID) when present, otherwise the
+        user's oldest pending bet.
+        """
+        bet = None
+        if payload and payload in self._bets:
+            bet = self._remove(payload)
+        elif user_id in self._by_user:
+            bet = self._remove(next(iter(self._by_user[user_id])))
+
+        if bet is None:
+            self.metrics["unmatched_payments"] += 1
+            logger.warning(f"Unmatched payment from user {user_id} (payload: {payload})")
+        else:
+            self.metrics["matched"] += 1
+            self._forget(bet)
+        return bet
+
+    def expire(self, now=None):
+        """Drop all bets whose time ran out"""
+        now = now or time.time()
+        expired = 0
+        for bet_id in self._wheel.advance(now):
+            bet = self._bets.get(bet_id)
+            # Stale wheel entry of a bet that was matched or re-registered
+            if bet is None or bet.expires_at > now:
+                continue
+            del self._bets[bet_id]
+            user_bets = self._by_user.get(bet.user_id)
+            if user_bets is not None:
+                user_bets.pop(bet_id, None)
+                if not user_bets:
+                    del self._by_user[bet.user_id]
+            self._forget(bet)
+            expired += 1
+        self.metrics["expired"] += expired
+        return expired
+
+
+pending_bets = PendingBetIndex()
+
+
+def get_metrics():
+    """Counters of the pending bet index plus its current size"""
+    return {**pending_bets.metrics, "pending": len(pending_bets)}
+
+def restore_from_user_data(application):
+    """
+    Re-register bets persisted in context.user_data after a restart
+
+    Bets that already expired are removed from the user data, and the index
+    keeps it up to date from then on.
+    """
+    pending_bets.bind(application)
+    dropped = []
+    for user_id, data in application.user_data.items():
+        bets = data.get("bets") or {}
+        for bet_id, bet in list(bets.items()):
+            timestamp = bet.get("timestamp")
+            if (not isinstance(timestamp, (int, float))
+                    or pending_bets.add(bet_id, user_id, bet.get("message_id"), timestamp) is None):
+                del bets[bet_id]
+                dropped.append(user_id)
+    if dropped:
+        application.mark_data_for_update_persistence(user_ids=dropped)
+    logger.info(f"Restored {len(pending_bets)} pending bets, dropped {len(dropped)} expired")
+
+async def run_expiry(interval=WHEEL_SLOT_SECONDS):
+    """Expire pending bets every wheel slot"""
+    while True:
+        await asyncio.sleep(interval)
+        expired = pending_bets.expire()
+        if expired:
+            logger.info(f"Expired {expired} pending bets")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+SQLite-backed persistence for PTB user/chat/bot data
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+from telegram.ext import BasePersistence
+from constants import PERSISTENCE_FILE, PERSISTENCE_FLUSH_INTERVAL, PENDING_BET_TTL
+
+logger = logging.getLogger(__name__)
+
+
+def prune_stale_bets(data, ttl=PENDING_BET_TTL, now=None):
+    """
+    Remove bets older than `ttl` seconds from a context.user_data dict in place
+
+    Returns:
+        int: Number of removed bets
+    """
+    bets = data.get("bets")
+    if not bets:
+        return 0
+    cutoff = (now or time.time()) - ttl
+    stale = [bet_id for bet_id, bet in bets.items()
+             if not isinstance(bet.get("timestamp"), (int, float)) or bet["timestamp"] < cutoff]
+    for bet_id in stale:
+        del bets[bet_id]
+    return len(stale)
+
+
+class SqlitePersistence(BasePersistence):
+    """
+    Stores user, chat, bot and conversation data in a local SQLite file.
+
+    Updates from the application are only buffered; a background task
+    writes the buffer in one transaction every `flush_interval` seconds.
+    Bets older than `bet_ttl` are left out of what is loaded and written;
+    the pending bet index removes them from the application's own user data.
+    """
+
+    def __init__(self, filepath=PERSISTENCE_FILE, flush_interval=PERSISTENCE_FLUSH_INTERVAL,
+                 bet_ttl=PENDING_BET_TTL):
+        super().__init__(update_interval=flush_interval)
+        self.filepath = filepath
+        self.flush_interval = flush_interval
+        self.bet_ttl = bet_ttl
+        self._connection = None
+        # (kind, key) -> serialized value, or None to delete the row
+        self._pending = {}
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.filepath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.filepath, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (kind, key))")
+        return self._connection
+
+    def _load(self, kind):
+        rows = self._connect().execute("SELECT key, value FROM state WHERE kind = ?", (kind,))
+        return {key: json.loads(value) for key, value in rows}
+
+    def _write_rows(self, rows):
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO state (kind, key, value) VALUES (?, ?, ?)",
+                [(kind, key, value) for (kind, key), value in rows.items() if value is not None])
+            connection.executemany(
+                "DELETE FROM state WHERE kind = ? AND key = ?",
+                [(kind, key) for (kind, key), value in rows.items() if value is None])
+
+    def _enqueue(self, kind, key, value):
+        self._pending[(kind, str(key))] = None if value is None else json.dumps(
+            value, ensure_ascii=False, default=str)
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, {}
+            await asyncio.to_thread(self._write_rows, rows)
+            logger.debug(f"Persisted {len(rows)} state rows")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._write_pending()
+            except Exception as e:
+                logger.error(f"Error writing persistent state: {e}")
+
+    async def get_user_data(self):
+        now = time.time()
+        user_data = {int(key): value for key, value in self._load("user").items()}
+        for data in user_data.values():
+            prune_stale_bets(data, self.bet_ttl, now)
+        return user_data
+
+    async def get_chat_data(self):
+        return {int(key): value for key, value in self._load("chat").items()}
+
+    async def get_bot_data(self):
+        return self._load("bot").get("bot_data", {})
+
+    async def get_callback_data(self):
+        data = self._load("callback").get("callback_data")
+        return tuple(data) if data is not None else None
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): state
+                for key, state in self._load(f"conversation:{name}").items()}
+
+    async def update_conversation(self, name, key, new_state):
+        self._enqueue(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    async def update_user_data(self, user_id, data):
+        prune_stale_bets(data, self.bet_ttl)
+        self._enqueue("user", user_id, data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._enqueue("chat", chat_id, data)
+
+    async def update_bot_data(self, data):
+        self._enqueue("bot", "bot_data", data)
+
+    async def update_callback_data(self, data):
+        self._enqueue("callback", "callback_data", data)
+
+    async def drop_user_data(self, user_id):
+        self._enqueue("user", user_id, None)
+
+    async def drop_chat_data(self, chat_id):
+        self._enqueue("chat", chat_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._write_pending()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        logger.info(f"Flushed persistent state to {self.filepath}")
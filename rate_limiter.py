@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-user sliding-window rate limiting of commands, buttons and messages
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from telegram.ext import ApplicationHandlerStop
+from constants import RATE_LIMITS, RATE_LIMIT_MAX_KEYS
+from callback_router import parse_callback_data
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowLimiter:
+    """
+    Sliding-window counters keyed by (user_id, rule).
+
+    Each key keeps only the counts of the current and previous fixed window;
+    the previous one is weighted by how much of it still overlaps the
+    sliding window. Keys are kept in LRU order and the least recently used
+    ones are dropped beyond `max_keys`, which bounds memory.
+    """
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()  # key -> [window index, previous count, current count]
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._counters)
+
+    def allow(self, key, limit, window, now=None):
+        """Count one event for `key` unless that would exceed `limit` per `window` seconds"""
+        now = now or time.monotonic()
+        index = int(now // window)
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters[key] = [index, 0, 0]
+            if len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        else:
+            self._counters.move_to_end(key)
+            if counter[0] != index:
+                counter[1] = counter[2] if counter[0] == index - 1 else 0
+                counter[2] = 0
+                counter[0] = index
+
+        overlap = 1 - (now % window) / window
+        if counter[1] * overlap + counter[2] >= limit:
+            self.rejected += 1
+            return False
+        counter[2] += 1
+        return True
+
+
+limiter = SlidingWindowLimiter()
+
+
+def rule_for(update):
+    """Name of the RATE_LIMITS rule an update falls under, or None"""
+    query = update.callback_query
+    if query is not None:
+        action, _ = parse_callback_data(query.data or "")
+        return action if action in RATE_LIMITS else "callback"
+    message = update.message
+    if message is not None and message.text:
+        if message.text.startswith("/"):
+            parts = message.text[1:].split(maxsplit=1)
+            if not parts:
+                # A bare "/" is still a command-shaped message
+                return "command"
+            command = parts[0].split("@", 1)[0].lower()
+            return command if command in RATE_LIMITS else "command"
+        return "message"
+    return None
+
+async def rate_limit_guard(update, context):
+    """
+    Run before all other handlers; drop updates over their user's limit
+
+    Rejected updates are dropped without any API call, so flooding costs
+    only this check.
+    """
+    user = update.effective_user
+    if user is None:
+        return
+    rule = rule_for(update)
+    if rule is None:
+        return
+    limit, window = RATE_LIMITS[rule]
+    if not limiter.allow((user.id, rule), limit, window):
+        logger.debug(f"Rate limit '{rule}' exceeded by user {user.id}")
+        raise ApplicationHandlerStop
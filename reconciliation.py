@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background reconciliation of CryptoBot invoices and transfers against the local ledger
+"""
+
+import re
+import sys
+import time
+import asyncio
+import logging
+from datetime import datetime
+from constants import (RECONCILE_INTERVAL, RECONCILE_PAGE_SIZE, RECONCILE_PAGE_PAUSE,
+                       RECONCILE_MAX_OPEN_AGE)
+from crypto_payments import list_api_items, api_circuits_closed, parse_hidden_message
+from ledger import ledger, INVOICE, TRANSFER
+
+logger = logging.getLogger(__name__)
+
+# Amounts closer than this are considered equal
+AMOUNT_TOLERANCE = 1e-9
+
+_SPEND_ID_USER = re.compile(r"^withdrawal_(\d+)_")
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+class ReconciliationError(Exception):
+    """A page could not be fetched; the pass is retried later"""
+
+
+class Reconciler:
+    """
+    Compares CryptoBot's history with the ledger, one page at a time.
+
+    Each kind keeps a cursor in the ledger: everything at or below it has
+    been checked and can no longer change. A pass pages newest-first down to
+    the cursor, looks every item up in the ledger, and then streams the
+    ledger's unmatched entries above the old cursor. Discrepancies are stored
+    once and logged. `owns` restricts the check to users this process
+    serves, for cluster workers that keep their own ledger.
+    """
+
+    def __init__(self, ledger=ledger, owns=None, payload_prefix="",
+                 page_size=RECONCILE_PAGE_SIZE, page_pause=RECONCILE_PAGE_PAUSE):
+        self.ledger = ledger
+        self.owns = owns or (lambda user_id: True)
+        self.payload_prefix = payload_prefix
+        self.page_size = page_size
+        self.page_pause = page_pause
+        self.last_report = {}
+
+    async def _iter_new(self, method, id_field, cursor):
+        """Yield items with an ID above `cursor`, newest first"""
+        offset = 0
+        while True:
+            page = await list_api_items(method, offset, self.page_size)
+            if not page["success"]:
+                raise ReconciliationError(page["message"])
+            items = page["items"]
+            reached_cursor = False
+            for item in items:
+                if item[id_field] > cursor:
+                    yield item
+                else:
+                    reached_cursor = True
+            if reached_cursor or len(items) < self.page_size:
+                return
+            offset += len(items)
+            # Leave the API and the event loop to live traffic
+            await asyncio.sleep(self.page_pause)
+
+    def _report(self, kind, remote_id, issue, details):
+        if self.ledger.add_discrepancy(kind, remote_id, issue, details):
+            logger.warning(f"Reconciliation: {kind} {remote_id} {issue} ({details})")
+            return 1
+        return 0
+
+    def _owns_invoice(self, invoice):
+        user_id, _ = parse_hidden_message(invoice.get("hidden_message", ""))
+        if user_id:
+            return self.owns(user_id)
+        return (invoice.get("payload") or "").startswith(self.payload_prefix)
+
+    async def reconcile_invoices(self):
+        started = time.time()
+        cursor = self.ledger.get_cursor(INVOICE)
+        newest = cursor
+        oldest_open = None
+        checked = found = 0
+
+        async for invoice in self._iter_new("getInvoices", "invoice_id", cursor):
+            invoice_id = invoice["invoice_id"]
+            newest = max(newest, invoice_id)
+            status = invoice.get("status")
+            if status == "active":
+                # May still be paid, so the cursor must stay below it
+                if started - _timestamp(invoice.get("created_at")) < RECONCILE_MAX_OPEN_AGE:
+                    oldest_open = invoice_id if oldest_open is None else min(oldest_open, invoice_id)
+                continue
+            if status != "paid" or not self._owns_invoice(invoice):
+                continue
+
+            checked += 1
+            amount = float(invoice.get("amount", 0))
+            entry = self.ledger.find(INVOICE, invoice_id)
+            if entry is None:
+                found += self._report(INVOICE, invoice_id, "paid_not_credited",
+                                      f"{amount} {invoice.get('asset')}")
+                continue
+            if abs(entry[2] - amount) > AMOUNT_TOLERANCE:
+                found += self._report(INVOICE, invoice_id, "amount_mismatch",
+                                      f"paid {amount}, credited {entry[2]}")
+            if not entry[3]:
+                self.ledger.mark_reconciled(INVOICE, invoice_id)
+
+        # Credits recorded before the pass started were paid by then, so the scan saw them
+        for invoice_id, user_id, amount in self.ledger.iter_unreconciled(INVOICE, cursor, started):
+            found += self._report(INVOICE, invoice_id, "credited_not_paid",
+                                  f"user {user_id}, {amount}")
+
+        self.ledger.set_cursor(INVOICE, oldest_open - 1 if oldest_open is not None else newest)
+        return checked, found
+
+    async def reconcile_transfers(self):
+        started = time.time()
+        cursor = self.ledger.get_cursor(TRANSFER)
+        newest = cursor
+        checked = found = 0
+
+        async for transfer in self._iter_new("getTransfers", "transfer_id", cursor):
+            transfer_id = transfer["transfer_id"]
+            newest = max(newest, transfer_id)
+            spend_id = transfer.get("spend_id") or ""
+            match = _SPEND_ID_USER.match(spend_id)
+            if match and not self.owns(int(match.group(1))):
+                continue
+
+            checked += 1
+            amount = float(transfer.get("amount", 0))
+            entry = self.ledger.find(TRANSFER, spend_id=spend_id) if spend_id else None
+            if entry is None:
+                found += self._report(TRANSFER, transfer_id, "paid_out_not_recorded",
+                                      f"{amount} {transfer.get('asset')}, spend_id {spend_id or '-'}")
+                continue
+            if abs(entry[2] - amount) > AMOUNT_TOLERANCE:
+                found += self._report(TRANSFER, transfer_id, "amount_mismatch",
+                                      f"sent {amount}, recorded {entry[2]}")
+            if not entry[3]:
+                self.ledger.mark_reconciled(TRANSFER, entry[0])
+
+        for transfer_id, user_id, amount in self.ledger.iter_unreconciled(TRANSFER, cursor, started):
+            found += self._report(TRANSFER, transfer_id, "recorded_not_sent",
+                                  f"user {user_id}, {amount}")
+
+        # Transfers are final as soon as they exist
+        self.ledger.set_cursor(TRANSFER, newest)
+        return checked, found
+
+    async def run_pass(self):
+        """Reconcile everything new since the last pass"""
+        invoices = await self.reconcile_invoices()
+        transfers = await self.reconcile_transfers()
+        self.last_report = {
+            "finished_at": time.time(),
+            "invoices_checked": invoices[0],
+            "transfers_checked": transfers[0],
+            "discrepancies": invoices[1] + transfers[1],
+        }
+        logger.info(f"Reconciliation pass: {self.last_report}")
+        return self.last_report
+
+    async def run(self, interval=RECONCILE_INTERVAL):
+        """Reconcile periodically, skipping passes while the API is failing"""
+        while True:
+            await asyncio.sleep(interval)
+            if not api_circuits_closed():
+                logger.info("Skipping reconciliation pass, CryptoBot API is degraded")
+                continue
+            try:
+                await self.run_pass()
+            except Exception as e:
+                logger.error(f"Reconciliation pass failed: {e}")
+
+
+reconciler = Reconciler()
+
+
+if __name__ == "__main__":
+    # Print discrepancies found since an optional epoch timestamp
+    since = float(sys.argv[1]) if len(sys.argv) > 1 else 0
+    for kind, remote_id, issue, details, found_at in ledger.iter_discrepancies(since):
+        found = datetime.fromtimestamp(found_at).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{found}\t{kind}\t{remote_id}\t{issue}\t{details}")
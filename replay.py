@@ -0,0 +1,427 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Accelerated replay of recorded traffic for performance regression testing
+
+Feeds a recording made with TRAFFIC_RECORD_FILE (see traffic_recorder.py)
+into bot.create_bot() with the Telegram Bot API and CryptoBot served by a
+local fake server. Dice values come from a seeded generator, so two runs
+with the same seed see the same sequence of rolls. Every update is timed
+from when the recording says it arrived (scaled by --speed) to when the
+bot finished handling it.
+
+Usage:
+    python replay.py run traffic.ndjson.gz [--speed 1|10|max] [--build DIR] [--json]
+    python replay.py compare traffic.ndjson.gz OLD_BUILD NEW_BUILD [--speed max] [--repeat 3]
+
+A build is a checkout of this repository; the bot is imported from it and
+runs in a scratch data directory that starts empty (or as a copy of --data).
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import inspect
+import argparse
+import tempfile
+import subprocess
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TOKEN = "123456:replay"
+# The fake bot as returned by getMe
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Replay", "username": "replay_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False,
+            "supports_inline_queries": False}
+
+
+def read_recording(path):
+    """Records of a recording, in order (kept free of bot imports, see run)"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def recorded_user_ids(records):
+    """Positive (user) IDs that appear as senders or in payment hidden messages"""
+    user_ids = set()
+    for record in records:
+        data = record["d"]
+        if record["k"] == "tg":
+            for key in ("message", "edited_message", "callback_query", "my_chat_member"):
+                sender = (data.get(key) or {}).get("from") or {}
+                if isinstance(sender.get("id"), int) and sender["id"] > 0:
+                    user_ids.add(sender["id"])
+        else:
+            for part in (data.get("payload") or {}).get("hidden_message", "").split(","):
+                if part.startswith("user_id:") and part[len("user_id:"):].strip().isdigit():
+                    user_ids.add(int(part[len("user_id:"):]))
+    return user_ids
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def pick(quantile):
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    return {"count": len(samples), "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "p50_ms": round(pick(0.50) * 1000, 3), "p95_ms": round(pick(0.95) * 1000, 3),
+            "p99_ms": round(pick(0.99) * 1000, 3), "max_ms": round(samples[-1] * 1000, 3)}
+
+
+class FakeApis:
+    """
+    Telegram Bot API and CryptoBot stand-ins on one local aiohttp server
+
+    Only what the bot uses is modelled: sends and edits return a message,
+    sendDice rolls from the seeded generator, CryptoBot invoices and
+    transfers get increasing IDs. Anything else succeeds with `true`.
+    """
+
+    def __init__(self, seed=0, latency=0.0):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.calls = {}
+        self._next_id = 0
+        self._runner = None
+        self.port = None
+
+    def _id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _count(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _message(self, params):
+        chat_id = params.get("chat_id", "0")
+        try:
+            chat_id = int(chat_id)
+        except ValueError:
+            chat_id = -1
+        message = {"message_id": int(params.get("message_id") or self._id()), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                   "from": BOT_USER}
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    async def telegram(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        self._count(f"telegram.{method}")
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        lowered = method.lower()
+        if lowered == "getme":
+            result = BOT_USER
+        elif lowered == "senddice":
+            result = self._message(params)
+            result["dice"] = {"emoji": params.get("emoji", "🎲"), "value": self.rng.randint(1, 6)}
+        elif lowered.startswith("send") or (lowered.startswith("edit") and "chat_id" in params):
+            result = self._message(params)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def cryptobot(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"]
+        self._count(f"cryptobot.{method}")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "createInvoice":
+            invoice_id = self._id()
+            result = {"invoice_id": invoice_id, "status": "active",
+                      "pay_url": f"https://t.me/CryptoBot?start=IVreplay{invoice_id}"}
+        elif method == "getInvoices":
+            result = {"items": []}
+        elif method == "transfer":
+            result = {"transfer_id": self._id(), "status": "completed"}
+        elif method == "getMe":
+            result = {"app_id": 1, "name": "replay", "payment_processing_bot_username": "CryptoBot"}
+        else:
+            result = {}
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.telegram)
+        app.router.add_route("*", "/crypto/{method}", self.cryptobot)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _replay(records, speed, seed, balance, api_latency):
+    fake = FakeApis(seed, api_latency)
+    await fake.start()
+    os.environ["TELEGRAM_BOT_TOKEN"] = TELEGRAM_TOKEN
+    os.environ["TELEGRAM_API_BASE_URL"] = f"http://127.0.0.1:{fake.port}/bot"
+    os.environ["CRYPTOBOT_API_URL"] = f"http://127.0.0.1:{fake.port}/crypto"
+    random.seed(seed)
+
+    # Imported only now, from the build under test, with the fake URLs in place
+    from telegram import Update
+    from bot import create_bot
+    import crypto_payments
+    from crypto_payments import process_payment_update
+
+    # Set directly as well, for builds that read neither from the environment
+    crypto_payments.CRYPTOBOT_TOKEN = "replay"
+    crypto_payments.CRYPTOBOT_API_URL = os.environ["CRYPTOBOT_API_URL"]
+    application = create_bot()
+    if "bot" in inspect.signature(process_payment_update).parameters:
+        # Builds that play paid bets with the bot get it, like bot.py passes it
+        process_payment_update = partial(process_payment_update, bot=application.bot)
+    if not application.bot.base_url.startswith(os.environ["TELEGRAM_API_BASE_URL"]):
+        raise RuntimeError("This build ignores TELEGRAM_API_BASE_URL and would call the real Bot API")
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    if balance:
+        from user_data import get_user_data, update_user_data, save_user_data, UserRecord
+        for user_id in recorded_user_ids(records):
+            if get_user_data(user_id) is None:
+                update_user_data(user_id, UserRecord(user_id=user_id, balance=balance))
+        save_user_data()
+    try:
+        from rounds import rounds
+        if speed:
+            rounds.duration /= speed
+    except ImportError:
+        pass
+    fake.calls.clear()
+
+    loop = asyncio.get_running_loop()
+    latencies = {"tg": [], "pay": []}
+    service = {"tg": [], "pay": []}
+    errors = 0
+    # Telegram updates are handled like the application's own fetcher does:
+    # in arrival order, at most concurrent_updates at a time (waiters on the
+    # semaphore are woken first come, first served)
+    slots = asyncio.Semaphore(max(application.concurrent_updates, 1))
+    tasks = []
+
+    async def handle(kind, data, due):
+        nonlocal errors
+        async with slots if kind == "tg" else _NO_LIMIT:
+            began = loop.time()
+            try:
+                if kind == "tg":
+                    await application.process_update(Update.de_json(data, application.bot))
+                else:
+                    await process_payment_update(data)
+            except Exception as e:
+                errors += 1
+                logger.error(f"Error replaying {kind} record: {e}")
+            finished = loop.time()
+        latencies[kind].append(finished - due)
+        service[kind].append(finished - began)
+
+    started = loop.time()
+    for record in records:
+        due = started + (record["t"] / speed if speed else 0)
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(handle(record["k"], record["d"], due)))
+    await asyncio.gather(*tasks)
+    wall_time = loop.time() - started
+
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    await fake.stop()
+
+    return {
+        "events": len(records),
+        "speed": speed or "max",
+        "seed": seed,
+        "wall_time_s": round(wall_time, 3),
+        "throughput_per_s": round(len(records) / wall_time, 1) if wall_time else None,
+        "errors": errors,
+        "latency": {"all": percentiles(latencies["tg"] + latencies["pay"]),
+                    "tg": percentiles(latencies["tg"]), "pay": percentiles(latencies["pay"])},
+        "service": {"tg": percentiles(service["tg"]), "pay": percentiles(service["pay"])},
+        "api_calls": dict(sorted(fake.calls.items())),
+    }
+
+
+class _Unlimited:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+# Payments arrive as webhooks and are handled concurrently, not through the queue
+_NO_LIMIT = _Unlimited()
+
+
+def run(recording, speed=1.0, seed=0, build=None, data=None, balance=0.0, api_latency=0.0, keep=False):
+    """
+    Replay a recording against one build in this process
+
+    Returns:
+        dict: throughput, latency percentiles per kind and API calls per method
+    """
+    records = read_recording(os.path.abspath(recording))
+    build = os.path.abspath(build or os.path.dirname(os.path.abspath(__file__)))
+    # The build's modules are imported instead of the ones next to this file
+    sys.path[0] = build
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    if data:
+        shutil.copytree(data, os.path.join(workdir, "data"))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        result = asyncio.run(_replay(records, speed, seed, balance, api_latency))
+    finally:
+        os.chdir(cwd)
+        if keep:
+            logger.warning(f"Replay data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    result["build"] = build
+    return result
+
+def _flatten(result):
+    """Metrics compared between builds"""
+    metrics = {"throughput_per_s": result["throughput_per_s"], "wall_time_s": result["wall_time_s"],
+               "errors": result["errors"], "api_calls": sum(result["api_calls"].values())}
+    for kind, stats in result["latency"].items():
+        for name in ("p50_ms", "p95_ms", "p99_ms", "max_ms"):
+            if name in stats:
+                metrics[f"latency.{kind}.{name}"] = stats[name]
+    return metrics
+
+def _run_subprocess(recording, build, options):
+    command = [sys.executable, os.path.abspath(__file__), "run", recording, "--build", build, "--json"] + options
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise SystemExit(f"Replay against {build} failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def compare(recording, old_build, new_build, options, repeat=1):
+    """
+    Replay the recording against two builds, each in a fresh interpreter
+
+    Returns:
+        dict: metric -> (old, new, change in percent), medians over `repeat` runs
+    """
+    medians = []
+    for build in (old_build, new_build):
+        runs = [_flatten(_run_subprocess(recording, build, options)) for _ in range(repeat)]
+        medians.append({name: sorted(run_[name] for run_ in runs)[len(runs) // 2] for name in runs[0]})
+    old, new = medians
+    report = {}
+    for name in old:
+        if name in new:
+            change = (new[name] - old[name]) / old[name] * 100 if old[name] else None
+            report[name] = (old[name], new[name], round(change, 1) if change is not None else None)
+    return report
+
+def print_result(result):
+    print(f"Build: {result['build']}")
+    print(f"Replayed {result['events']} updates at speed {result['speed']} in {result['wall_time_s']}s "
+          f"({result['throughput_per_s']}/s, {result['errors']} errors)\n")
+    print(f"  {'latency':<10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, stats in result["latency"].items():
+        if stats["count"]:
+            print(f"  {kind:<10} {stats['count']:>7} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+                  f"{stats['p99_ms']:>9} {stats['max_ms']:>9}")
+    print("\nAPI calls:")
+    for method, count in result["api_calls"].items():
+        print(f"  {method:<36} {count:>7}")
+
+def print_comparison(report, old_build, new_build):
+    print(f"A: {old_build}\nB: {new_build}\n")
+    print(f"  {'metric':<28} {'A':>12} {'B':>12} {'change':>9}")
+    for name, (old, new, change) in report.items():
+        change = f"{change:+.1f}%" if change is not None else "-"
+        print(f"  {name:<28} {old:>12} {new:>12} {change:>9}")
+
+
+def _speed(value):
+    return 0.0 if value == "max" else float(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against fake APIs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "compare"):
+        command = commands.add_parser(name)
+        command.add_argument("recording", help="NDJSON recording, optionally .gz")
+        if name == "compare":
+            command.add_argument("old_build", help="Checkout of the baseline build")
+            command.add_argument("new_build", help="Checkout of the build under test")
+            command.add_argument("--repeat", type=int, default=1, help="Runs per build, medians compared")
+        else:
+            command.add_argument("--build", help="Checkout to import the bot from (default: this one)")
+            command.add_argument("--keep", action="store_true", help="Keep the scratch data directory")
+        command.add_argument("--speed", type=_speed, default=1.0, help="1, 10, ... or max (default: 1)")
+        command.add_argument("--seed", type=int, default=0, help="Seed of the dice and the bot's random")
+        command.add_argument("--data", help="Data directory to start from (default: empty)")
+        command.add_argument("--balance", type=float, default=0.0,
+                             help="Starting balance of recorded users not in --data")
+        command.add_argument("--api-latency", type=float, default=0.0,
+                             help="Seconds the fake APIs take per call")
+        command.add_argument("--json", action="store_true", help="Print the result as JSON")
+        command.add_argument("--verbose", action="store_true", help="Show the bot's log")
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(name)s:%(funcName)s - %(levelname)s - %(message)s',
+                        level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr)
+
+    if args.command == "run":
+        result = run(args.recording, args.speed, args.seed, args.build, args.data,
+                     args.balance, args.api_latency, args.keep)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print_result(result)
+        return
+
+    options = ["--speed", str(args.speed or "max"), "--seed", str(args.seed),
+               "--balance", str(args.balance), "--api-latency", str(args.api_latency)]
+    if args.data:
+        options += ["--data", os.path.abspath(args.data)]
+    report = compare(os.path.abspath(args.recording), os.path.abspath(args.old_build),
+                     os.path.abspath(args.new_build), options, args.repeat)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_comparison(report, args.old_build, args.new_build)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Responsible-gaming limits checked before every stake is taken
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from constants import (BET_MIN_AMOUNT, BET_MAX_AMOUNT, BET_COOLDOWN, DAILY_LOSS_LIMIT,
+                       LOSS_WINDOW, LOSS_WINDOW_BUCKETS)
+from audit_log import iter_records, GAME
+
+logger = logging.getLogger(__name__)
+
+
+class _Window:
+    """Net loss of one user over the rolling window, in fixed time buckets"""
+
+    __slots__ = ("last_bet", "newest", "net_loss", "buckets")
+
+    def __init__(self, bucket_count):
+        self.last_bet = 0.0
+        self.newest = 0
+        self.net_loss = 0.0
+        self.buckets = [0.0] * bucket_count
+
+
+class LimitsEngine:
+    """
+    Stake range, cooldown between bets and a rolling loss limit per user.
+
+    Each user's net loss (stakes minus payouts) is kept in `bucket_count`
+    buckets covering `window` seconds plus a running total. Advancing the
+    window expires at most `bucket_count` buckets, so checking and recording
+    a bet costs the same whatever the user's history. Users are kept in
+    order of their last bet; those idle for a whole window hold no loss and
+    are dropped. A stake is recorded in the same step that authorizes it,
+    so bets arriving before the first one settles (a shared round) see it
+    in the cooldown and the loss; payouts and refunds are credited back
+    when the game is settled.
+    """
+
+    def __init__(self, min_amount=BET_MIN_AMOUNT, max_amount=BET_MAX_AMOUNT,
+                 cooldown=BET_COOLDOWN, loss_limit=DAILY_LOSS_LIMIT,
+                 window=LOSS_WINDOW, bucket_count=LOSS_WINDOW_BUCKETS):
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.cooldown = cooldown
+        self.loss_limit = loss_limit
+        self.window = window
+        self.bucket_count = bucket_count
+        self.bucket_seconds = window / bucket_count
+        self._windows = OrderedDict()  # user_id -> _Window, oldest last bet first
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._windows)
+
+    def _advance(self, state, now):
+        """Expire buckets that fell out of the window"""
+        index = int(now // self.bucket_seconds)
+        if index - state.newest >= self.bucket_count:
+            state.buckets = [0.0] * self.bucket_count
+            state.net_loss = 0.0
+        else:
+            for expired in range(state.newest + 1, index + 1):
+                slot = expired % self.bucket_count
+                state.net_loss -= state.buckets[slot]
+                state.buckets[slot] = 0.0
+        state.newest = max(state.newest, index)
+        return index % self.bucket_count
+
+    def _window(self, user_id, now, create=False):
+        state = self._windows.get(user_id)
+        if state is None and create:
+            state = self._windows[user_id] = _Window(self.bucket_count)
+            state.newest = int(now // self.bucket_seconds)
+        return state
+
+    def _drop_idle(self, now):
+        while self._windows:
+            user_id, state = next(iter(self._windows.items()))
+            if now - state.last_bet < self.window:
+                break
+            del self._windows[user_id]
+
+    def net_loss(self, user_id, now=None):
+        """User's net loss within the rolling window"""
+        now = now or time.time()
+        state = self._window(user_id, now)
+        if state is None:
+            return 0.0
+        self._advance(state, now)
+        return max(state.net_loss, 0.0)
+
+    def check(self, user_id, amount, now=None):
+        """
+        Check a stake against the limits without recording it
+
+        Returns:
+            dict: success, and a message for the user when it is refused
+        """
+        now = now or time.time()
+        if amount < self.min_amount or amount > self.max_amount:
+            message = f"Ставка должна быть от {self.min_amount} до {self.max_amount} TON."
+        else:
+            state = self._window(user_id, now)
+            message = None
+            if state is not None:
+                wait = state.last_bet + self.cooldown - now
+                self._advance(state, now)
+                if wait > 0:
+                    message = f"Слишком частые ставки, подождите {wait:.0f} сек."
+                elif state.net_loss + amount > self.loss_limit:
+                    left = max(self.loss_limit - state.net_loss, 0)
+                    message = (f"Достигнут лимит проигрыша {self.loss_limit} TON за сутки. "
+                               f"Доступно для ставок: {left:.2f} TON.")
+        if message is not None:
+            self.rejected += 1
+            logger.info(f"Bet of {amount} TON by user {user_id} refused: {message}")
+            return {"success": False, "message": message}
+        return {"success": True}
+
+    def authorize(self, user_id, amount, now=None):
+        """Check a stake and, if it is allowed, record it at once; returns the check verdict"""
+        now = now or time.time()
+        verdict = self.check(user_id, amount, now=now)
+        if verdict["success"]:
+            self.record_bet(user_id, amount, now=now)
+        return verdict
+
+    def record_bet(self, user_id, amount, now=None):
+        """Count a stake; its payout or refund is recorded with record_payout"""
+        now = now or time.time()
+        self._drop_idle(now)
+        state = self._window(user_id, now, create=True)
+        slot = self._advance(state, now)
+        state.buckets[slot] += amount
+        state.net_loss += amount
+        state.last_bet = now
+        self._windows.move_to_end(user_id)
+
+    def record_payout(self, user_id, payout, now=None):
+        """Credit a payout or refund against the user's window"""
+        if not payout:
+            return
+        now = now or time.time()
+        state = self._window(user_id, now)
+        if state is None:
+            return
+        slot = self._advance(state, now)
+        state.buckets[slot] -= payout
+        state.net_loss -= payout
+
+    def rebuild_from_audit(self, directory=None, now=None):
+        """Restore the windows from games settled within the last window (run at startup)"""
+        from audit_log import audit_log
+
+        now = now or time.time()
+        games = 0
+        for record in iter_records(directory or audit_log.directory, since=now - self.window):
+            if record["e"] == GAME:
+                self.record_bet(record["u"], record["bet"], now=record["t"])
+                self.record_payout(record["u"], record["payout"], now=record["t"])
+                games += 1
+        logger.info(f"Rebuilt gaming limits of {len(self._windows)} users from {games} games")
+        return games
+
+
+limits = LimitsEngine()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared rounds: one dice roll settles every paid bet placed during the round
+"""
+
+import time
+import random
+import asyncio
+import logging
+from array import array
+from constants import ROUND_DURATION, ROUND_SUMMARY_WINNERS, GAME_DISPLAY_NAMES
+from outcomes import OUTCOMES, OUTCOME_KEYS, OUTCOME_CODES
+from games import record_game_result, RESULTS_CHANNEL_ID
+from exposure import exposure
+from lifecycle import lifecycle
+
+logger = logging.getLogger(__name__)
+
+
+class Round:
+    """Bets of one round, one typed column per field"""
+
+    def __init__(self, number):
+        self.number = number
+        self.opened_at = time.time()
+        self.user_ids = array("q")
+        self.amounts = array("d")
+        self.outcomes = array("B")
+        self.game_ids = []
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def add(self, user_id, game_type, bet_choice, amount, game_id):
+        self.user_ids.append(user_id)
+        self.amounts.append(amount)
+        self.outcomes.append(OUTCOME_CODES[(game_type, bet_choice)])
+        self.game_ids.append(game_id)
+
+    def settle(self, dice_value):
+        """Payout of every bet for a dice value, in bet order"""
+        column = [row[dice_value - 1] for row in OUTCOMES.values()]
+        return [amount * column[code] for amount, code in zip(self.amounts, self.outcomes)]
+
+
+class RoundManager:
+    """
+    Collects paid bets into time-boxed rounds and settles them together.
+
+    The first bet opens a round; `duration` seconds later a single 🎲 is
+    rolled in the results channel and settles all bets of every game mode
+    (bowling bets read the same die: 4 or more is a win). Every bet is a
+    journaled game whose stake is taken when it joins the round, so bets of
+    a round lost to a crash are refunded by Lifecycle.recover. Winnings are
+    credited and the games settled in one batch with one save of user data,
+    and one summary is posted, so a round costs two Telegram calls however
+    many bets it holds.
+    """
+
+    def __init__(self, channel_id=RESULTS_CHANNEL_ID, duration=ROUND_DURATION):
+        self.channel_id = channel_id
+        self.duration = duration
+        self.current = None
+        self.number = 0
+        self._bot = None
+        self._timer = None
+
+    def start(self, bot):
+        self._bot = bot
+
+    def add_bet(self, user_id, game_type, bet_choice, amount):
+        """Journal a paid bet, take its stake and put it into the open round; returns the round number"""
+        game_id = lifecycle.begin_game(user_id, game_type, amount)
+        if self.current is None:
+            self.number += 1
+            self.current = Round(self.number)
+            self._timer = asyncio.get_running_loop().create_task(self._close_later())
+        self.current.add(user_id, game_type, bet_choice, amount, game_id)
+        return self.current.number
+
+    async def _close_later(self):
+        await asyncio.sleep(self.duration)
+        self._timer = None
+        await self.close()
+
+    async def close(self):
+        """Settle the open round now (also used at shutdown)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        round_, self.current = self.current, None
+        if round_ is None:
+            return None
+        try:
+            return await self._settle(round_)
+        except Exception as e:
+            logger.error(f"Error settling round {round_.number} ({len(round_)} bets): {e}")
+            # Refund the bets that were not settled
+            for game_id in round_.game_ids:
+                lifecycle.abort_game(game_id)
+        finally:
+            for amount, code in zip(round_.amounts, round_.outcomes):
+                exposure.release_code(code, amount)
+
+    async def _roll(self):
+        """Roll the round's die in the channel, or locally if Telegram is unavailable"""
+        if self._bot is not None:
+            try:
+                message = await self._bot.send_dice(chat_id=self.channel_id, emoji="🎲")
+                return message.dice.value
+            except Exception as e:
+                logger.error(f"Error rolling the round dice in the channel: {e}")
+        return random.randint(1, 6)
+
+    async def _settle(self, round_):
+        dice_value = await self._roll()
+        payouts = round_.settle(dice_value)
+
+        winnings = {}
+        for user_id, payout in zip(round_.user_ids, payouts):
+            if payout:
+                winnings[user_id] = winnings.get(user_id, 0) + payout
+        lifecycle.finish_games(zip(round_.game_ids, round_.user_ids, payouts))
+        for user_id, amount, code, payout in zip(round_.user_ids, round_.amounts,
+                                                 round_.outcomes, payouts):
+            game_type, bet_choice = OUTCOME_KEYS[code]
+            record_game_result(user_id, game_type, amount, payout, bet_choice, dice_value)
+
+        total_staked = sum(round_.amounts)
+        total_paid = sum(payouts)
+        logger.info(f"Round {round_.number} settled with {dice_value}: {len(round_)} bets, "
+                    f"{total_staked} TON staked, {total_paid} TON paid to {len(winnings)} players")
+        await self._post_summary(round_, dice_value, winnings, total_staked, total_paid)
+        return {"round": round_.number, "dice_value": dice_value, "bets": len(round_),
+                "winners": len(winnings), "staked": total_staked, "paid": total_paid}
+
+    async def _post_summary(self, round_, dice_value, winnings, total_staked, total_paid):
+        from user_data import get_user_data
+
+        games = {}
+        for code in round_.outcomes:
+            game_type = OUTCOME_KEYS[code][0]
+            games[game_type] = games.get(game_type, 0) + 1
+        lines = [
+            f"🎲 Раунд #{round_.number}: выпало {dice_value}",
+            "🎮 " + ", ".join(f"{GAME_DISPLAY_NAMES.get(game, game)}: {count}"
+                             for game, count in games.items()),
+            f"💰 Ставок: {len(round_)} на {total_staked:g} TON",
+            f"🏆 Выплачено: {total_paid:g} TON ({len(winnings)} победителей)",
+        ]
+        top = sorted(winnings.items(), key=lambda item: -item[1])[:ROUND_SUMMARY_WINNERS]
+        for user_id, payout in top:
+            record = get_user_data(user_id)
+            name = f"@{record.username}" if record and record.username != "Anonymous" else f"user{user_id}"
+            lines.append(f"• {name}: +{payout:g} TON")
+        if len(winnings) > len(top):
+            lines.append(f"… и еще {len(winnings) - len(top)}")
+
+        if self._bot is None:
+            return
+        try:
+            await self._bot.send_message(chat_id=self.channel_id, text="\n".join(lines))
+        except Exception as e:
+            logger.error(f"Error posting summary of round {round_.number}: {e}")
+
+
+rounds = RoundManager()
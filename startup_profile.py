@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Import-time breakdown of the bot's startup
+
+Imports a module in a fresh interpreter with -X importtime and summarizes
+the output: total time, time per top-level package, and the slowest
+individual imports.
+
+Usage:
+    python startup_profile.py [--module bot] [--top 15]
+"""
+
+import re
+import sys
+import argparse
+import subprocess
+
+# "import time:      self [us] |  cumulative | imported package"
+_IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)")
+
+
+def profile_imports(module):
+    """
+    Import `module` in a subprocess
+
+    Returns:
+        list: (self_us, cumulative_us, module name) per import
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, name = match.groups()
+            entries.append((int(self_us), int(cumulative_us), name))
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr.splitlines()[-1] + "\n")
+    return entries
+
+def summarize(entries, top=15):
+    total = sum(self_us for self_us, _, _ in entries)
+    by_package = {}
+    for self_us, _, name in entries:
+        package = name.split(".", 1)[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+
+    print(f"Total import time: {total / 1000:.1f} ms ({len(entries)} modules)\n")
+    print("By top-level package:")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<32} {self_us / 1000:>8.1f} ms  {self_us / total:>6.1%}")
+
+    print("\nSlowest imports (cumulative):")
+    for self_us, cumulative_us, name in sorted(entries, key=lambda entry: -entry[1])[:top]:
+        print(f"  {name:<40} {cumulative_us / 1000:>8.1f} ms  (self {self_us / 1000:.1f} ms)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show what the bot spends its import time on")
+    parser.add_argument("--module", default="bot", help="Module to import (default: bot)")
+    parser.add_argument("--top", type=int, default=15, help="Rows per table")
+    args = parser.parse_args(argv)
+
+    entries = profile_imports(args.module)
+    if entries:
+        summarize(entries, args.top)
+
+
+if __name__ == "__main__":
+    main()
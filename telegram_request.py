@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Connection pools for the Telegram Bot API client
+"""
+
+import asyncio
+import logging
+import importlib.util
+from telegram.request import HTTPXRequest
+from constants import (TELEGRAM_POOL_SIZE, TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT,
+                       TELEGRAM_POOL_TIMEOUT, TELEGRAM_HTTP2, TELEGRAM_PREWARM_CONNECTIONS)
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available():
+    """Whether HTTP/2 is enabled and httpx can speak it"""
+    return TELEGRAM_HTTP2 and importlib.util.find_spec("h2") is not None
+
+def build_request():
+    """Pool for all API calls except getUpdates"""
+    http_version = "2" if http2_available() else "1.1"
+    if TELEGRAM_HTTP2 and http_version != "2":
+        logger.warning("TELEGRAM_HTTP2 is set but h2 is not installed, using HTTP/1.1")
+    return HTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        http_version=http_version,
+    )
+
+def build_get_updates_request():
+    """
+    Dedicated connection for long polling
+
+    getUpdates holds its connection for the whole poll timeout, so it gets
+    its own pool and sends never wait behind it.
+    """
+    return HTTPXRequest(
+        connection_pool_size=1,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+    )
+
+async def prewarm(bot):
+    """
+    Open send connections ahead of the first updates
+
+    Application.initialize already opened one connection with getMe; a few
+    concurrent getMe calls open the rest, so first sends skip the TCP and
+    TLS handshakes.
+    """
+    connections = 1 if http2_available() else TELEGRAM_PREWARM_CONNECTIONS
+    if connections <= 1:
+        return
+    results = await asyncio.gather(*(bot.get_me() for _ in range(connections)),
+                                   return_exceptions=True)
+    failed = sum(isinstance(result, Exception) for result in results)
+    logger.info(f"Pre-warmed {connections - failed}/{connections} Telegram connections")
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the background tasks started in post_init and stopped in post_stop
+"""
+
+import asyncio
+import bot
+
+
+def test_background_tasks_are_cancelled_and_awaited():
+    finished = []
+
+    async def loop_forever():
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            finished.append("loop")
+
+    async def failing():
+        raise RuntimeError("broken")
+
+    async def run():
+        bot.start_background_task(loop_forever())
+        bot.start_background_task(failing())
+        await asyncio.sleep(0)
+        await bot.stop_background_tasks()
+
+    asyncio.run(run())
+
+    assert finished == ["loop"]
+    assert bot._background_tasks == set()
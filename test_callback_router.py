@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of callback_data encoding and CallbackRouter dispatch
+"""
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+from callback_router import CallbackRouter, callback_data, parse_callback_data
+
+
+class FakeQuery:
+    def __init__(self, data):
+        self.data = data
+        self.answered = False
+
+    async def answer(self):
+        self.answered = True
+
+
+def make_router(calls):
+    async def profile(update, context):
+        calls.append(("profile",))
+
+    async def game(update, context, game_type):
+        calls.append(("game", game_type))
+
+    async def page(update, context, number):
+        calls.append(("page", number))
+
+    router = CallbackRouter()
+    router.add("profile", profile)
+    router.add("game", game, str)
+    router.add("page", page, int)
+    return router
+
+
+def dispatch(router, data):
+    query = FakeQuery(data)
+    asyncio.run(router.dispatch(SimpleNamespace(callback_query=query), None))
+    return query
+
+
+def test_round_trip():
+    data = callback_data("game", "even_odd")
+    assert data == "1|game|even_odd"
+    assert parse_callback_data(data) == ("game", ["even_odd"])
+
+
+def test_too_long_callback_data_is_refused():
+    with pytest.raises(ValueError):
+        callback_data("game", "x" * 64)
+
+
+def test_dispatch_converts_arguments():
+    calls = []
+    router = make_router(calls)
+
+    dispatch(router, callback_data("profile"))
+    dispatch(router, callback_data("game", "bowling"))
+    dispatch(router, callback_data("page", 3))
+
+    assert calls == [("profile",), ("game", "bowling"), ("page", 3)]
+
+
+def test_legacy_buttons_are_understood():
+    calls = []
+    router = make_router(calls)
+
+    dispatch(router, "profile")
+    dispatch(router, "game_higher_lower")
+
+    assert calls == [("profile",), ("game", "higher_lower")]
+
+
+@pytest.mark.parametrize("data", [
+    "1|unknown",            # no such action
+    "1|game",               # missing argument
+    "1|game|a|b",           # extra argument
+    "1|page|three",         # argument fails conversion
+    "2|profile",            # other encoding version
+    "",
+])
+def test_bad_callback_data_is_answered_and_dropped(data):
+    calls = []
+    router = make_router(calls)
+
+    query = dispatch(router, data)
+
+    assert calls == []
+    assert query.answered
+
+
+def test_action_with_separator_is_refused():
+    with pytest.raises(ValueError):
+        CallbackRouter().add("a|b", None)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the circuit breaker and of CryptoBot calls made through it
+"""
+
+import time
+import asyncio
+import pytest
+from aiohttp import web
+import crypto_payments
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def test_opens_after_threshold_and_trial_closes_it():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # One trial call, nothing else until it reports back
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_trial_opens_again():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    breaker._opened_at -= 60
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+async def slow(request):
+    await asyncio.sleep(60)
+    return web.json_response({})
+
+
+async def not_json(request):
+    return web.Response(status=400, text="Bad Request")
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """Open breaker of the endpoint "x" whose trial call is due"""
+    breaker = CircuitBreaker("x", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    monkeypatch.setattr(crypto_payments, "_breakers", {"x": breaker})
+    monkeypatch.setattr(crypto_payments, "CRYPTOBOT_TOKEN", "test")
+    return breaker
+
+
+def call(handler, deadline=None, cancel_after=None):
+    """Run _cryptobot_request against a local server answering with `handler`"""
+    async def run():
+        app = web.Application()
+        app.router.add_route("*", "/x", handler)
+        runner = web.AppRunner(app, shutdown_timeout=0.1)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            request = asyncio.create_task(crypto_payments._cryptobot_request(
+                "GET", f"http://127.0.0.1:{port}/x", deadline=deadline))
+            if cancel_after is not None:
+                await asyncio.sleep(cancel_after)
+                request.cancel()
+            return await request
+        finally:
+            await runner.cleanup()
+    return asyncio.run(run())
+
+
+def test_trial_with_a_body_that_is_not_json_opens_again(breaker):
+    with pytest.raises(ValueError):
+        call(not_json)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_cancelled_trial_opens_again(breaker):
+    with pytest.raises(asyncio.CancelledError):
+        call(slow, cancel_after=0.1)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_expired_deadline_does_not_take_the_trial(breaker):
+    with pytest.raises(asyncio.TimeoutError):
+        call(slow, deadline=time.monotonic() - 1)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.allow()
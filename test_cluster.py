@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the cluster wiring in one process: front to workers over Unix
+sockets, and worker channel messages through the front's shared sender
+"""
+
+import asyncio
+import shutil
+import tempfile
+from datetime import datetime
+from functools import partial
+from types import SimpleNamespace
+import pytest
+from telegram import Chat, Message, Update
+import cluster
+import crypto_payments
+
+WORKERS = 3
+
+
+@pytest.fixture
+def socket_dir(monkeypatch):
+    # Unix socket paths are short, keep them out of the pytest tmp_path
+    path = tempfile.mkdtemp(prefix="cluster-", dir="/tmp")
+    monkeypatch.setattr(cluster, "SOCKET_DIR", path)
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class FakeWorker:
+    """The parts of a worker Application that _serve_front uses"""
+
+    def __init__(self, index):
+        self.index = index
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+        self.tasks = []
+
+    def create_task(self, coroutine):
+        self.tasks.append(asyncio.get_running_loop().create_task(coroutine))
+
+
+def private_update(update_id, user_id):
+    return {"update_id": update_id,
+            "message": {"message_id": 1, "date": 0, "text": "/start",
+                        "chat": {"id": user_id, "type": "private"},
+                        "from": {"id": user_id, "is_bot": False, "first_name": "Player"}}}
+
+
+def test_front_routes_updates_and_payments_to_the_owning_worker(socket_dir, monkeypatch):
+    payments = []
+
+    async def record_payment(update_data, bot=None):
+        payments.append(update_data)
+    monkeypatch.setattr(crypto_payments, "process_payment_update", record_payment)
+
+    async def run():
+        workers = [FakeWorker(index) for index in range(WORKERS)]
+        servers = [await asyncio.start_unix_server(partial(cluster._serve_front, worker),
+                                                   path=cluster._worker_socket(worker.index))
+                   for worker in workers]
+        router = cluster.WorkerRouter(WORKERS)
+        await router.connect()
+        front = SimpleNamespace(bot_data={"router": router})
+        context = SimpleNamespace(application=front)
+
+        for update_id, user_id in enumerate((10, 11, 12, 13), start=1):
+            await cluster.route_update(Update.de_json(private_update(update_id, user_id), None), context)
+        # One payment by hidden message, one for a pooled invoice of worker 2
+        await cluster.route_payment_update(front, {"update_type": "invoice_paid", "payload": {
+            "hidden_message": "user_id:14", "invoice_id": 1}})
+        await cluster.route_payment_update(front, {"update_type": "invoice_paid", "payload": {
+            "hidden_message": "", "payload": "w2:bet_1", "invoice_id": 2}})
+
+        received = {}
+        for worker in workers:
+            expected = sum(1 for user_id in (10, 11, 12, 13) if user_id % WORKERS == worker.index)
+            received[worker.index] = [(await asyncio.wait_for(worker.update_queue.get(), 5)).effective_user.id
+                                      for _ in range(expected)]
+        while sum(len(worker.tasks) for worker in workers) < 2:
+            await asyncio.sleep(0.01)
+        for worker in workers:
+            await asyncio.gather(*worker.tasks)
+        paid_on = {worker.index: len(worker.tasks) for worker in workers}
+        for server in servers:
+            server.close()
+        return received, paid_on
+
+    received, paid_on = asyncio.run(run())
+
+    assert received == {0: [12], 1: [10, 13], 2: [11]}
+    # User 14 belongs to worker 2, and so does the pooled invoice
+    assert paid_on == {0: 0, 1: 0, 2: 2}
+    assert [payment["payload"]["invoice_id"] for payment in payments] == [1, 2]
+
+
+class FrontBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        return Message(message_id=len(self.sent), date=datetime.now(),
+                       chat=Chat(chat_id, Chat.CHANNEL), text=text)
+
+
+def test_workers_share_the_front_channel_sender(socket_dir):
+    front_bot = FrontBot()
+
+    async def run():
+        sender = cluster.ChannelSender(front_bot, per_minute=100)
+        sending = asyncio.get_running_loop().create_task(sender.run())
+        server = await asyncio.start_unix_server(partial(cluster._serve_sender, sender),
+                                                 path=cluster._sender_socket())
+        bots = []
+        for _ in range(2):
+            client = cluster.ChannelSenderClient(cluster._sender_socket())
+            await client.connect()
+            bots.append(cluster.WorkerBot("1:test", client))
+
+        messages = await asyncio.gather(*(bot.send_message(chat_id=-100, text=f"worker {index}")
+                                          for index, bot in enumerate(bots)))
+        sending.cancel()
+        server.close()
+        return messages, len(sender._sent)
+
+    messages, budget_used = asyncio.run(run())
+
+    assert sorted(front_bot.sent) == [(-100, "worker 0"), (-100, "worker 1")]
+    assert [message.text for message in messages] == ["worker 0", "worker 1"]
+    assert budget_used == 2
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of CryptoBot payment intake
+"""
+
+from user_data import get_user_data
+from conftest import add_user
+
+
+def test_redelivered_invoice_is_credited_once(payments, bot):
+    add_user(1, 0)
+    bot.dice = [2]
+
+    assert payments(1, 5, invoice_id=42)["success"]
+    duplicate = payments(1, 5, invoice_id=42)
+
+    assert not duplicate["success"]
+    assert get_user_data(1).balance == 7.5
+    assert len(bot.rolls) == 1
+
+
+def test_pooled_payment_after_restart_finds_owner_through_pending_bet(payments, bot, monkeypatch):
+    import asyncio
+    import crypto_payments
+    from invoice_pool import InvoicePool
+    from pending_bets import PendingBetIndex
+
+    # After a restart the pool has no assignments, the bet was restored from user data
+    restored = PendingBetIndex(ttl=300)
+    restored.add("pool_bet_1", 1)
+    monkeypatch.setattr(crypto_payments, "invoice_pool", InvoicePool())
+    monkeypatch.setattr(crypto_payments, "pending_bets", restored)
+    add_user(1, 0)
+    bot.dice = [2]
+
+    update = {"update_type": "invoice_paid",
+              "payload": {"hidden_message": "", "payload": "pool_bet_1", "comment": "Чет и нечет [чет]",
+                          "amount": "5", "invoice_id": 7}}
+    result = asyncio.run(crypto_payments.process_payment_update(update, bot=bot))
+
+    assert result["success"]
+    assert get_user_data(1).balance == 7.5
+    assert len(restored) == 0
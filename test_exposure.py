@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of house exposure: reserve, cap, refuse and release
+"""
+
+import pytest
+from exposure import ExposureManager
+from outcomes import OUTCOME_CODES
+from constants import EVEN_ODD_MULTIPLIER
+from user_data import get_user_data
+from conftest import add_user
+
+
+def test_reserve_and_release_restore_totals():
+    manager = ExposureManager(max_outcome=100, max_total=100)
+
+    assert manager.reserve("even_odd", "even", 10) == {"success": True, "amount": 10}
+    assert manager.reserve("bowling", "win", 4)["success"]
+    report = manager.report()
+    assert report["open_bets"] == 2
+    assert report["outcomes"]["even_odd/even"] == {"stakes": 10, "liability": 10 * EVEN_ODD_MULTIPLIER}
+    # Face 4 is even and a bowling win, both bets pay on it
+    assert report["worst_case"]["face"] in (4, 6)
+
+    manager.release("even_odd", "even", 10)
+    manager.release_code(OUTCOME_CODES[("bowling", "win")], 4)
+    assert manager.open_bets == 0
+    assert all(abs(total) < 1e-9 for total in manager.by_face)
+    assert all(abs(total) < 1e-9 for total in manager.liability)
+
+
+def test_opposite_outcomes_do_not_add_up_per_face():
+    manager = ExposureManager(max_outcome=15, max_total=15)
+
+    assert manager.reserve("even_odd", "even", 10)["amount"] == 10
+    # Odd pays on other faces, so the per-face limit is not reached
+    assert manager.reserve("even_odd", "odd", 10)["amount"] == 10
+
+
+def test_stake_is_capped_to_headroom():
+    manager = ExposureManager(max_outcome=15, max_total=100, cap=True, min_amount=0.1)
+    manager.reserve("even_odd", "even", 6)
+
+    capped = manager.reserve("even_odd", "even", 10)
+
+    assert capped["success"]
+    assert capped["amount"] == 4
+    assert "уменьшена" in capped["message"]
+    assert manager.capped == 1
+
+
+@pytest.mark.parametrize("cap, max_outcome", [(False, 15), (True, 9.1)])
+def test_stake_is_refused_without_headroom(cap, max_outcome):
+    manager = ExposureManager(max_outcome=max_outcome, max_total=100, cap=cap, min_amount=0.1)
+    manager.reserve("even_odd", "even", 6)
+
+    refused = manager.reserve("even_odd", "even", 10 if not cap else 1)
+
+    assert not refused["success"]
+    assert refused["amount"] == 0
+    assert manager.rejected == 1
+    assert manager.open_bets == 1
+
+
+def test_capped_paid_bet_tells_payer_what_was_returned(payments, house_exposure, bot):
+    # Odd: the even bet is lost
+    bot.dice = [1]
+    house_exposure.max_outcome = 3
+    add_user(1, 0)
+
+    result = payments(1, 5)
+
+    assert result["stake"] == 2
+    # The stake was lost, the rest of the payment stays on the balance
+    assert get_user_data(1).balance == 3
+    assert "2" in bot.messages[0][1] and "3" in bot.messages[0][1]
+    assert "Остаток" in bot.messages[0][1]
+    assert house_exposure.open_bets == 0
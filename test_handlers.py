@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the bet announcement: the personal payment link never goes to the channel
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+import handlers
+from invoice_pool import InvoicePool, PooledInvoice
+from pending_bets import PendingBetIndex
+from constants import RESULTS_CHANNEL_ID
+
+PAY_URL = "https://t.me/CryptoBot?start=pooled"
+
+
+class FakeQuery:
+    def __init__(self, chat_type, user_id=1):
+        self.from_user = SimpleNamespace(id=user_id, first_name="Player")
+        self.message = SimpleNamespace(chat=SimpleNamespace(type=chat_type))
+        self.answers = []
+        self.edits = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append((text, show_alert))
+
+    async def edit_message_text(self, text, **kwargs):
+        self.edits.append((text, kwargs.get("reply_markup")))
+
+
+def urls(markup):
+    return [button.url for row in markup.inline_keyboard for button in row if button.url]
+
+
+@pytest.fixture
+def context(bot, monkeypatch):
+    pool = InvoicePool(low_water=0)
+    pool._available.append(PooledInvoice("pool_bet_1", 1, PAY_URL, time.time() + 3600))
+    monkeypatch.setattr(handlers, "invoice_pool", pool)
+    monkeypatch.setattr(handlers, "pending_bets", PendingBetIndex(ttl=300))
+    return SimpleNamespace(bot=bot, user_data={})
+
+
+def test_channel_gets_instructions_and_player_gets_link(context, bot):
+    query = FakeQuery("private")
+
+    asyncio.run(handlers.play_handler(SimpleNamespace(callback_query=query), context))
+
+    assert bot.messages[0][0] == RESULTS_CHANNEL_ID
+    assert urls(bot.keyboards[0]) == []
+    assert PAY_URL in urls(query.edits[0][1])
+
+
+def test_instruction_clicked_in_channel_is_sent_in_private(context, bot):
+    asyncio.run(handlers.play_handler(SimpleNamespace(callback_query=FakeQuery("private")), context))
+    query = FakeQuery("channel")
+
+    asyncio.run(handlers.instruction_handler(SimpleNamespace(callback_query=query), context))
+
+    # The channel post is left alone, the link goes to the clicker
+    assert query.edits == []
+    assert bot.messages[-1][0] == 1
+    assert urls(bot.keyboards[-1]) == [PAY_URL]
+    assert query.answers and not query.answers[0][1]
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the leaderboard top against a full sort
+"""
+
+import random
+from leaderboard import Leaderboard
+
+
+def expected_top(scores, size):
+    ranking = sorted((-score, user_id) for user_id, score in scores.items())
+    return [(user_id, -score) for score, user_id in ranking[:size]]
+
+
+def test_top_matches_a_full_sort():
+    board = Leaderboard(size=5)
+    generator = random.Random(1)
+
+    for _ in range(5000):
+        user_id = generator.randrange(40)
+        if generator.random() < 0.5:
+            board.set(user_id, generator.randrange(-20, 20))
+        else:
+            board.add(user_id, generator.choice((-3, -1, 1, 3)))
+        assert board.top() == expected_top(board.scores, 5)
+
+
+def test_version_changes_only_with_the_top():
+    board = Leaderboard(size=2)
+    board.set(1, 10)
+    board.set(2, 5)
+    version = board.version
+
+    board.set(3, 1)
+    board.set(3, 2)
+    assert board.version == version
+
+    board.set(3, 20)
+    assert board.version > version
+    assert board.top() == [(3, 20), (1, 10)]
+
+
+def test_user_leaving_the_top_is_replaced_from_the_rest():
+    board = Leaderboard(size=2)
+    for user_id, score in ((1, 10), (2, 9), (3, 8), (4, 7)):
+        board.set(user_id, score)
+
+    board.set(1, 0)
+
+    assert board.top() == [(2, 9), (3, 8)]
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of journaled games: settlement, abort and recovery after a crash
+"""
+
+import asyncio
+import time
+from user_data import get_user_data
+from crypto_payments import update_user_balance
+from conftest import add_user
+
+
+def balance(user_id):
+    return get_user_data(user_id).balance
+
+
+def test_stake_is_journaled_then_taken(game_lifecycle):
+    add_user(1, 10)
+
+    game_id = game_lifecycle.begin_game(1, "even_odd", 4)
+
+    assert balance(1) == 6
+    assert get_user_data(1).open_games == [game_id]
+    assert game_lifecycle.journal.get(game_id)[1:] == (1, "even_odd", 4, None)
+
+
+def test_finish_credits_payout_once(game_lifecycle):
+    add_user(1, 10)
+    game_id = game_lifecycle.begin_game(1, "even_odd", 4)
+
+    game_lifecycle.record_outcome(game_id, 6)
+    game_lifecycle.finish_game(game_id, 1, 6)
+    game_lifecycle.abort_game(game_id)
+
+    assert balance(1) == 12
+    assert get_user_data(1).open_games == []
+    assert list(game_lifecycle.journal.iter_open()) == []
+    assert asyncio.run(game_lifecycle.drain())
+
+
+def test_aborted_game_is_refunded(game_lifecycle):
+    add_user(1, 10)
+    game_id = game_lifecycle.begin_game(1, "higher_lower", 3)
+
+    game_lifecycle.abort_game(game_id)
+
+    assert balance(1) == 10
+    assert get_user_data(1).open_games == []
+
+
+def test_recover_refunds_game_without_outcome(game_lifecycle, bot):
+    add_user(1, 10)
+    game_lifecycle.begin_game(1, "even_odd", 4)
+
+    assert asyncio.run(game_lifecycle.recover(bot)) == 1
+
+    assert balance(1) == 10
+    assert list(game_lifecycle.journal.iter_open()) == []
+    assert bot.messages and "возвращена" in bot.messages[0][1]
+
+
+def test_recover_pays_out_known_outcome(game_lifecycle, bot, limits):
+    add_user(1, 10)
+    game_id = game_lifecycle.begin_game(1, "even_odd", 4)
+    game_lifecycle.record_outcome(game_id, 6)
+
+    asyncio.run(game_lifecycle.recover(bot))
+
+    assert balance(1) == 12
+    assert "зачислен" in bot.messages[0][1]
+    # A played game counts for the limits: stake 4, payout 6
+    assert limits.net_loss(1) == 0
+
+
+def test_recover_does_not_pay_twice(game_lifecycle, bot):
+    add_user(1, 10)
+    game_id = game_lifecycle.begin_game(1, "even_odd", 4)
+    game_lifecycle.record_outcome(game_id, 6)
+    # Crash after the payout was credited, before the journal row was deleted
+    update_user_balance(1, 6, "payout", close_game=game_id)
+
+    asyncio.run(game_lifecycle.recover(bot))
+
+    assert balance(1) == 12
+    assert bot.messages == []
+    assert list(game_lifecycle.journal.iter_open()) == []
+
+
+def test_recover_does_not_refund_stake_never_taken(game_lifecycle, bot):
+    add_user(1, 10)
+    # Crash after the journal row was written, before the debit
+    game_lifecycle.journal.open("lost", 1, "even_odd", 4)
+
+    asyncio.run(game_lifecycle.recover(bot))
+
+    assert balance(1) == 10
+    assert bot.messages == []
+    assert list(game_lifecycle.journal.iter_open()) == []
+
+
+def test_refund_does_not_count_for_limits(game_lifecycle, limits):
+    add_user(1, 10)
+    assert limits.authorize(1, 4)["success"]
+    game_id = game_lifecycle.begin_game(1, "even_odd", 4)
+    assert limits.net_loss(1) == 4
+
+    game_lifecycle.abort_game(game_id)
+
+    assert limits.net_loss(1) == 0
+    assert limits.check(1, 1, now=time.time() + limits.cooldown)["success"]
+
+
+def test_open_games_survive_save_and_load(game_lifecycle):
+    import user_data
+
+    add_user(1, 10)
+    game_id = game_lifecycle.begin_game(1, "even_odd", 4)
+    user_data.save_user_data()
+    user_data.load_user_data()
+
+    assert get_user_data(1).open_games == [game_id]
+    assert balance(1) == 6
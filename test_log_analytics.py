@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the bot.log report: records per logger and errors per handler
+"""
+
+from log_analytics import analyze_log
+
+LOG = '''\
+2024-05-01 10:00:00,000 - handlers:play_handler - ERROR - Error in play handler when sending to channel -1: Forbidden
+2024-05-01 10:00:01,000 - handlers:play_handler - INFO - Successfully sent bet message to channel -1
+2024-05-01 10:00:02,000 - telegram.ext.Application:process_error - ERROR - No error handlers are registered, logging exception.
+Traceback (most recent call last):
+  File "/usr/lib/python3.11/site-packages/telegram/ext/_application.py", line 1124, in process_update
+    await coroutine
+  File "/srv/bot/callback_router.py", line 80, in dispatch
+    await handler(update, context, *arguments)
+  File "/srv/bot/handlers.py", line 400, in instruction_handler
+    await query.edit_message_text(
+  File "/srv/bot/games.py", line 10, in helper
+    raise RuntimeError("boom")
+RuntimeError: boom
+2024-05-01 10:00:03,000 - crypto_payments - ERROR - Error processing game results: boom
+'''
+
+
+def test_errors_are_attributed_to_handlers(tmp_path):
+    path = tmp_path / "bot.log"
+    path.write_text(LOG, encoding="utf-8")
+
+    report = analyze_log(str(path)).to_dict()
+
+    assert report["loggers"]["handlers"] == {"records": 2, "errors": 1, "error_rate": 0.5}
+    # The older format without the function still counts per logger
+    assert report["loggers"]["crypto_payments"]["errors"] == 1
+    assert report["handlers"] == {"handlers.play_handler": {"errors": 1},
+                                  "handlers.instruction_handler": {"errors": 1}}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the pending bet index: matching, expiry and the context.user_data it keeps in step
+"""
+
+import time
+import pending_bets
+from pending_bets import PendingBetIndex
+
+
+class FakeApplication:
+    """The parts of telegram.ext.Application the index uses"""
+
+    def __init__(self, user_data):
+        self.user_data = user_data
+        self.marked = []
+
+    def mark_data_for_update_persistence(self, user_ids=None, chat_ids=None):
+        self.marked.extend(user_ids or ())
+
+
+def test_payload_matches_its_bet_and_removes_it_from_user_data():
+    application = FakeApplication({1: {"bets": {"a": {}, "b": {}}}})
+    index = PendingBetIndex(ttl=300)
+    index.bind(application)
+    index.add("a", 1)
+    index.add("b", 1)
+
+    bet = index.match_payment(1, "b")
+
+    assert bet.bet_id == "b"
+    assert len(index) == 1
+    assert application.user_data[1]["bets"] == {"a": {}}
+    assert application.marked == [1]
+
+
+def test_payment_without_payload_matches_oldest_bet():
+    index = PendingBetIndex(ttl=300)
+    now = time.time()
+    index.add("old", 1, created_at=now - 10)
+    index.add("new", 1, created_at=now)
+
+    assert index.match_payment(1).bet_id == "old"
+    assert index.match_payment(2) is None
+    assert index.metrics["unmatched_payments"] == 1
+
+
+def test_expired_bets_leave_index_and_user_data():
+    application = FakeApplication({1: {"bets": {"a": {}}}, 2: {"bets": {"b": {}}}})
+    index = PendingBetIndex(ttl=60)
+    index.bind(application)
+    now = time.time()
+    index.add("a", 1, created_at=now)
+    index.add("b", 2, created_at=now + 120)
+
+    assert index.expire(now + 61) == 1
+
+    assert len(index) == 1
+    assert application.user_data[1]["bets"] == {}
+    assert application.user_data[2]["bets"] == {"b": {}}
+    assert application.marked == [1]
+    assert index.match_payment(1) is None
+
+
+def test_matched_bet_is_not_expired_again():
+    index = PendingBetIndex(ttl=60)
+    now = time.time()
+    index.add("a", 1, created_at=now)
+    index.match_payment(1, "a")
+
+    assert index.expire(now + 61) == 0
+    assert index.metrics["expired"] == 0
+
+
+def test_restore_drops_expired_and_malformed_bets(monkeypatch):
+    index = PendingBetIndex(ttl=60)
+    monkeypatch.setattr(pending_bets, "pending_bets", index)
+    now = time.time()
+    application = FakeApplication({
+        1: {"bets": {"live": {"timestamp": now}, "stale": {"timestamp": now - 120}}},
+        2: {"bets": {"broken": {"timestamp": "yesterday"}}},
+    })
+
+    pending_bets.restore_from_user_data(application)
+
+    assert len(index) == 1
+    assert list(application.user_data[1]["bets"]) == ["live"]
+    assert application.user_data[2]["bets"] == {}
+    assert sorted(set(application.marked)) == [1, 2]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the sliding-window limiter and the rule an update falls under
+"""
+
+from types import SimpleNamespace
+import pytest
+from rate_limiter import SlidingWindowLimiter, rule_for
+
+
+def message_update(text):
+    return SimpleNamespace(callback_query=None, message=SimpleNamespace(text=text))
+
+
+def callback_update(data):
+    return SimpleNamespace(callback_query=SimpleNamespace(data=data), message=None)
+
+
+def test_limit_within_window():
+    limiter = SlidingWindowLimiter()
+
+    assert [limiter.allow("k", 3, 10, now=100.0) for _ in range(4)] == [True, True, True, False]
+    assert limiter.rejected == 1
+    # Another key has its own budget
+    assert limiter.allow("other", 3, 10, now=100.0)
+
+
+def test_previous_window_weighs_by_overlap():
+    limiter = SlidingWindowLimiter()
+    for _ in range(4):
+        limiter.allow("k", 4, 10, now=105.0)
+
+    # Halfway into the next window, half of the previous 4 events still count
+    assert limiter.allow("k", 4, 10, now=115.0)
+    assert limiter.allow("k", 4, 10, now=115.0)
+    assert not limiter.allow("k", 4, 10, now=115.0)
+    # Two windows later the old events are gone
+    assert all(limiter.allow("k", 4, 10, now=130.0) for _ in range(4))
+
+
+def test_least_recently_used_keys_are_dropped():
+    limiter = SlidingWindowLimiter(max_keys=2)
+    limiter.allow("a", 1, 10, now=100.0)
+    limiter.allow("b", 1, 10, now=100.0)
+    limiter.allow("c", 1, 10, now=100.0)
+
+    assert len(limiter) == 2
+    # "a" was dropped, so it starts over
+    assert limiter.allow("a", 1, 10, now=100.0)
+
+
+@pytest.mark.parametrize("text, rule", [
+    ("/", "command"),
+    ("/ ", "command"),
+    ("/start", "start"),
+    ("/START@SomeBot", "start"),
+    ("/nosuchcommand", "command"),
+    ("hello", "message"),
+])
+def test_rule_for_messages(text, rule):
+    assert rule_for(message_update(text)) == rule
+
+
+def test_rule_for_callbacks():
+    assert rule_for(callback_update("1|test_api")) == "test_api"
+    assert rule_for(callback_update("test_api")) == "test_api"
+    assert rule_for(callback_update("1|profile")) == "callback"
+    assert rule_for(callback_update("garbage")) == "callback"
+
+
+def test_updates_without_text_have_no_rule():
+    assert rule_for(message_update(None)) is None
+    assert rule_for(SimpleNamespace(callback_query=None, message=None)) is None
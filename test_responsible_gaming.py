@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the stake range, cooldown and loss limit, and of their place in the payment path
+"""
+
+import pytest
+import games
+import rounds
+import crypto_payments
+from responsible_gaming import LimitsEngine
+from user_data import get_user_data
+from conftest import add_user
+
+NOW = 1_000_000.0
+
+
+def make_engine():
+    return LimitsEngine(min_amount=0.1, max_amount=10, cooldown=3, loss_limit=20,
+                        window=3600, bucket_count=6)
+
+
+@pytest.mark.parametrize("amount, allowed", [(0.05, False), (0.1, True), (10, True), (10.5, False)])
+def test_stake_range(amount, allowed):
+    assert make_engine().check(1, amount, now=NOW)["success"] is allowed
+
+
+def test_cooldown_between_bets():
+    engine = make_engine()
+    engine.record_bet(1, 1, now=NOW)
+
+    refused = engine.check(1, 1, now=NOW + 1)
+    assert not refused["success"]
+    assert "подождите" in refused["message"]
+    assert engine.check(1, 1, now=NOW + 3)["success"]
+    # Other users are not held back
+    assert engine.check(2, 1, now=NOW + 1)["success"]
+
+
+def test_loss_limit_counts_stakes_minus_payouts():
+    engine = make_engine()
+    engine.record_bet(1, 10, now=NOW)
+    engine.record_bet(1, 10, now=NOW + 10)
+
+    assert engine.net_loss(1, now=NOW + 20) == 20
+    refused = engine.check(1, 1, now=NOW + 20)
+    assert not refused["success"]
+    assert "лимит" in refused["message"]
+
+    engine.record_payout(1, 15, now=NOW + 20)
+    assert engine.net_loss(1, now=NOW + 20) == 5
+    assert engine.check(1, 10, now=NOW + 30)["success"]
+
+
+def test_losses_leave_the_window():
+    engine = make_engine()
+    engine.record_bet(1, 10, now=NOW)
+    engine.record_bet(1, 10, now=NOW + 10)
+
+    assert engine.net_loss(1, now=NOW + 3600 + 600) == 0
+    assert engine.check(1, 10, now=NOW + 3600 + 600)["success"]
+
+
+def test_idle_users_are_dropped():
+    engine = make_engine()
+    engine.record_bet(1, 5, now=NOW)
+    engine.record_bet(2, 5, now=NOW + 3600)
+
+    assert len(engine) == 1
+
+
+def test_refused_paid_bet_is_credited_and_explained(payments, limits, bot):
+    add_user(1, 0)
+    limits.record_bet(1, 100)
+
+    result = payments(1, 5)
+
+    assert not result["success"]
+    assert get_user_data(1).balance == 5
+    assert get_user_data(1).open_games == []
+    assert bot.messages[0][0] == 1
+    assert "Ставка не принята" in bot.messages[0][1]
+
+
+def test_failed_paid_game_is_refunded_and_not_counted(payments, limits, bot, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("Telegram is down")
+    monkeypatch.setattr(games, "send_game_results", broken)
+    add_user(1, 0)
+
+    result = payments(1, 5)
+
+    assert not result["success"]
+    assert get_user_data(1).balance == 5
+    assert get_user_data(1).open_games == []
+    assert limits.net_loss(1) == 0
+    assert "возвращена" in bot.messages[-1][1]
+
+
+@pytest.mark.parametrize("dice_value, balance, net_loss", [(2, 7.5, 0), (3, 0, 5)])
+def test_paid_game_is_played_in_private_chat(payments, limits, bot, dice_value, balance, net_loss):
+    bot.dice = [dice_value]
+    add_user(1, 0)
+
+    result = payments(1, 5)
+
+    assert result["success"]
+    assert result["dice_value"] == dice_value
+    # The die is rolled for the payer, the result goes to the channel and to them
+    assert bot.rolls == [(1, "🎲", dice_value)]
+    assert bot.messages[0][0] == games.RESULTS_CHANNEL_ID
+    assert bot.messages[-1][0] == 1
+    # The stake came out of the deposit
+    assert get_user_data(1).balance == balance
+    assert get_user_data(1).open_games == []
+    assert limits.net_loss(1) == net_loss
+
+
+@pytest.fixture
+def open_round(payments, monkeypatch):
+    """Paid bets join a shared round that does not close during the test"""
+    manager = rounds.RoundManager(channel_id=0, duration=3600)
+    monkeypatch.setattr(rounds, "rounds", manager)
+    monkeypatch.setattr(crypto_payments, "ROUND_MODE", True)
+    return manager
+
+
+def test_cooldown_applies_to_bets_of_an_open_round(payments, open_round, limits):
+    add_user(1, 0)
+
+    assert payments(1, 2)["round"] == 1
+    refused = payments(1, 2)
+
+    assert not refused["success"]
+    assert "подождите" in refused["message"]
+    # The refused payment stays on the balance, the first stake is in the round
+    assert get_user_data(1).balance == 2
+    assert len(open_round.current) == 1
+
+
+def test_loss_limit_counts_stakes_of_an_open_round(payments, open_round, limits):
+    limits.cooldown = 0
+    limits.loss_limit = 6
+    add_user(1, 0)
+
+    assert payments(1, 4)["success"]
+    refused = payments(1, 4)
+    assert payments(1, 2)["success"]
+
+    assert "лимит" in refused["message"]
+    assert limits.net_loss(1) == 6
+    assert len(open_round.current) == 2
+
+
+def test_paid_game_without_bot_is_refunded(data_dir, game_lifecycle, house_exposure):
+    import asyncio
+    import crypto_payments
+
+    add_user(1, 0)
+    update = {"update_type": "invoice_paid",
+              "payload": {"hidden_message": "user_id:1", "comment": "Чет и нечет [чет]",
+                          "amount": "5", "invoice_id": "test"}}
+    result = asyncio.run(crypto_payments.process_payment_update(update))
+
+    assert not result["success"]
+    assert get_user_data(1).balance == 5
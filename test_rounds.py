@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of shared rounds: stakes taken on entry, one roll settling every bet, refunds
+"""
+
+import asyncio
+import pytest
+from rounds import RoundManager
+from games import authorize_stake
+from constants import EVEN_ODD_MULTIPLIER, HIGHER_LOWER_MULTIPLIER
+from user_data import get_user_data
+from conftest import add_user
+
+
+@pytest.fixture
+def round_manager(game_lifecycle, house_exposure, limits):
+    """Round manager without a bot, every bet it takes authorized first"""
+    manager = RoundManager(channel_id=0, duration=3600)
+    manager.exposure = house_exposure
+    # Players here bet several times in a round
+    limits.cooldown = 0
+
+    def add_bet(user_id, game_type, bet_choice, amount):
+        assert authorize_stake(user_id, game_type, bet_choice, amount)["success"]
+        return manager.add_bet(user_id, game_type, bet_choice, amount)
+    manager.bet = add_bet
+    return manager
+
+
+def roll(manager, dice_value):
+    async def fixed():
+        return dice_value
+    manager._roll = fixed
+
+
+def balance(user_id):
+    return get_user_data(user_id).balance
+
+
+def test_stakes_are_taken_when_bets_join(round_manager, game_lifecycle):
+    add_user(1, 10)
+
+    async def run():
+        round_manager.bet(1, "even_odd", "even", 4)
+        round_manager.bet(1, "higher_lower", "higher", 2)
+        await round_manager.close()
+    roll(round_manager, 1)  # both lose
+    asyncio.run(run())
+
+    assert balance(1) == 4
+    assert get_user_data(1).open_games == []
+    assert list(game_lifecycle.journal.iter_open()) == []
+
+
+def test_one_roll_settles_every_bet(round_manager, game_lifecycle, limits):
+    for user_id in (1, 2, 3):
+        add_user(user_id, 10)
+
+    async def run():
+        assert round_manager.bet(1, "even_odd", "even", 2) == 1
+        round_manager.bet(2, "even_odd", "odd", 2)
+        round_manager.bet(3, "higher_lower", "higher", 4)
+        round_manager.bet(1, "higher_lower", "higher", 1)
+        return await round_manager.close()
+    roll(round_manager, 6)
+    result = asyncio.run(run())
+
+    assert balance(1) == 10 - 2 - 1 + 2 * EVEN_ODD_MULTIPLIER + 1 * HIGHER_LOWER_MULTIPLIER
+    assert balance(2) == 8
+    assert balance(3) == 6 + 4 * HIGHER_LOWER_MULTIPLIER
+    assert result["bets"] == 4
+    assert result["winners"] == 2
+    assert result["staked"] == 9
+    for user_id in (1, 2, 3):
+        assert get_user_data(user_id).open_games == []
+    assert list(game_lifecycle.journal.iter_open()) == []
+    assert round_manager.exposure.open_bets == 0
+    assert limits.net_loss(2) == 2
+    assert asyncio.run(game_lifecycle.drain())
+
+
+def test_failed_settlement_refunds_bets(round_manager, game_lifecycle, limits, monkeypatch):
+    add_user(1, 10)
+
+    async def broken(round_):
+        raise RuntimeError("settlement failed")
+
+    async def run():
+        round_manager.bet(1, "even_odd", "even", 4)
+        monkeypatch.setattr(round_manager, "_settle", broken)
+        await round_manager.close()
+    asyncio.run(run())
+
+    assert balance(1) == 10
+    assert get_user_data(1).open_games == []
+    assert round_manager.exposure.open_bets == 0
+    assert limits.net_loss(1) == 0
+
+
+def test_bets_of_a_crashed_round_are_refunded_on_recover(round_manager, game_lifecycle):
+    add_user(1, 10)
+
+    async def run():
+        round_manager.bet(1, "bowling", "win", 3)
+        # The process dies before the round closes
+        round_manager._timer.cancel()
+    asyncio.run(run())
+    assert balance(1) == 7
+
+    assert asyncio.run(game_lifecycle.recover()) == 1
+    assert balance(1) == 10
+    assert get_user_data(1).open_games == []
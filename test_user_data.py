@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the blocked flag of users whose shard is not loaded
+"""
+
+import user_data
+from user_data import (get_user_data, set_user_blocked, unblock_user, save_user_data,
+                       load_user_data, iter_user_id_chunks)
+from conftest import add_user
+
+
+def user_ids():
+    return [user_id for _, _, chunk in iter_user_id_chunks(100) for user_id in chunk]
+
+
+def test_user_writing_again_is_unblocked_without_loading_the_shard(data_dir):
+    add_user(1, 0)
+    set_user_blocked(1, True)
+    save_user_data()
+    load_user_data()
+
+    unblock_user(1)
+
+    assert user_data._shards == {}
+    # Broadcasts already see the user, the record follows once the shard loads
+    assert user_ids() == [1]
+    assert get_user_data(1).blocked is False
+
+
+def test_unblock_of_a_loaded_user(data_dir):
+    add_user(1, 0)
+    set_user_blocked(1, True)
+    assert user_ids() == []
+
+    unblock_user(1)
+
+    assert get_user_data(1).blocked is False
+    assert user_ids() == [1]
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of the stats table aggregates, with and without numpy
+"""
+
+import random
+from types import SimpleNamespace
+import pytest
+import user_stats
+from user_stats import StatsTable
+
+
+def record(user_id, generator):
+    return SimpleNamespace(user_id=user_id, balance=round(generator.random() * 10, 2),
+                           games_played=generator.randrange(5), even_odd_games=0,
+                           higher_lower_games=0, bowling_games=0,
+                           last_activity=generator.random() * 100)
+
+
+@pytest.fixture
+def table():
+    generator = random.Random(1)
+    table = StatsTable()
+    table.upsert_many(record(generator.randrange(10 ** 6), generator) for _ in range(2000))
+    return table
+
+
+@pytest.mark.parametrize("column", ["balance", "games_played"])
+@pytest.mark.parametrize("k", [1, 10, 5000])
+def test_numpy_and_python_agree(table, monkeypatch, column, k):
+    with_numpy = (table.top(column, k), table.count_active_since(50), table.total("games_played"))
+    monkeypatch.setattr(user_stats, "numpy", None)
+    python = (table.top(column, k), table.count_active_since(50), table.total("games_played"))
+
+    assert with_numpy == python
+    # Ties on the games count are broken by user ID, highest first
+    assert table.top(column, k) == sorted(table.top(column, k), key=lambda pair: (pair[1], pair[0]),
+                                          reverse=True)
+
+
+def test_rows_can_be_added_after_a_query(table):
+    table.top("balance")
+    table.count_active_since(0)
+
+    table.upsert(SimpleNamespace(user_id=-1, balance=1e6, games_played=0, even_odd_games=0,
+                                 higher_lower_games=0, bowling_games=0, last_activity=0.0))
+
+    assert table.top("balance", 1) == [(-1, 1e6)]
+
+
+def test_empty_table():
+    table = StatsTable()
+
+    assert table.top("balance") == []
+    assert table.count_active_since(0) == 0
+    assert table.total("balance") == 0
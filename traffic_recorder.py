@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Recording of incoming traffic for replay (see replay.py)
+
+When TRAFFIC_RECORD_FILE is set, every Telegram update and CryptoBot
+payment update is appended to it as one compact NDJSON line:
+
+    {"t": seconds since the recording started, "k": "tg" | "pay", "d": data}
+
+Files ending in .gz are gzip-compressed. User and chat IDs are replaced by
+a keyed hash that is consistent within one recording but cannot be mapped
+back (the key is never written), names become placeholders and free text
+is replaced by filler of the same length. Commands, callback data and
+payment comments are kept, since they decide what the bot does.
+"""
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+from constants import TRAFFIC_RECORD_FILE
+
+logger = logging.getLogger(__name__)
+
+# Record kinds
+TELEGRAM = "tg"
+PAYMENT = "pay"
+
+# Keys whose values are user or chat IDs
+_ID_PARENTS = ("from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat")
+# Keys holding personal data that the bot's logic does not depend on
+_NAME_KEYS = ("first_name", "last_name", "title", "phone_number", "bio")
+# Keys holding free text, kept only when it is a command
+_TEXT_KEYS = ("text", "caption")
+# Flush the file every this many records
+_FLUSH_EVERY = 100
+
+
+class TrafficRecorder:
+    """Anonymizing NDJSON writer of incoming updates"""
+
+    def __init__(self, path=TRAFFIC_RECORD_FILE):
+        self.path = path
+        self._key = os.urandom(16)
+        self._file = None
+        self._started = None
+        self._pending = 0
+        self.records = 0
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def anonymize_id(self, value):
+        """Stable pseudonym of a user or chat ID; keeps the sign (groups and channels are negative)"""
+        if not isinstance(value, int):
+            return value
+        pseudonym = self._pseudonym(str(abs(value)))
+        return -pseudonym if value < 0 else pseudonym
+
+    def _pseudonym(self, value):
+        digest = hashlib.blake2b(value.encode(), key=self._key, digest_size=6).digest()
+        return int.from_bytes(digest, "big") or 1
+
+    def scrub(self, data, parent=None):
+        """Anonymized copy of an update (dicts and lists of JSON values)"""
+        if isinstance(data, list):
+            return [self.scrub(item, parent) for item in data]
+        if not isinstance(data, dict):
+            return data
+        scrubbed = {}
+        for key, value in data.items():
+            if key == "id" and parent in _ID_PARENTS:
+                value = self.anonymize_id(value)
+            elif key in ("user_id", "chat_id"):
+                value = self.anonymize_id(value)
+            elif key == "username" and isinstance(value, str):
+                value = f"user{self._pseudonym(value)}"
+            elif key in _NAME_KEYS and isinstance(value, str):
+                value = "User"
+            elif key in _TEXT_KEYS and isinstance(value, str) and not value.startswith("/"):
+                value = "x" * len(value)
+            elif key == "hidden_message" and isinstance(value, str):
+                value = self._scrub_hidden_message(value)
+            elif key == "entities":
+                pass
+            else:
+                value = self.scrub(value, key)
+            scrubbed[key] = value
+        return scrubbed
+
+    def _scrub_hidden_message(self, hidden_message):
+        parts = []
+        for part in hidden_message.split(","):
+            if part.startswith("user_id:") and part[len("user_id:"):].strip().isdigit():
+                part = f"user_id:{self.anonymize_id(int(part[len('user_id:'):]))}"
+            parts.append(part)
+        return ",".join(parts)
+
+    def _write(self, kind, data):
+        try:
+            now = time.monotonic()
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = gzip.open(self.path, "ab") if self.path.endswith(".gz") else open(self.path, "ab")
+                self._started = now
+                logger.info(f"Recording traffic to {self.path}")
+            record = {"t": round(now - self._started, 3), "k": kind, "d": self.scrub(data)}
+            self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+            self.records += 1
+            self._pending += 1
+            if self._pending >= _FLUSH_EVERY:
+                self.flush()
+        except Exception as e:
+            logger.error(f"Error recording {kind} traffic: {e}")
+
+    async def record_update(self, update, context):
+        """TypeHandler callback run before all other handlers"""
+        self._write(TELEGRAM, update.to_dict())
+
+    def record_payment(self, update_data):
+        """Record a CryptoBot update as passed to process_payment_update"""
+        if not self.enabled:
+            return
+        from crypto_payments import parse_hidden_message
+        from invoice_pool import invoice_pool
+        from pending_bets import pending_bets
+
+        payload = {key: value for key, value in update_data.items() if key in ("update_type", "payload")}
+        invoice = dict(payload.get("payload") or {})
+        # Pooled invoices are matched to their user through the pool, which
+        # a replay starts without; keep the owner in the hidden message
+        user_id, _ = parse_hidden_message(invoice.get("hidden_message", ""))
+        if not user_id and invoice.get("payload"):
+            owner = invoice_pool.owner_of(invoice["payload"]) or pending_bets.owner_of(invoice["payload"])
+            if owner:
+                invoice["hidden_message"] = f"user_id:{owner}"
+        payload["payload"] = invoice
+        self._write(PAYMENT, payload)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+            self._pending = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Recorded {self.records} updates to {self.path}")
+
+
+recorder = TrafficRecorder()
+
+
+def iter_recording(path):
+    """Records of a recording file, in order"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
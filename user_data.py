@@ -6,80 +6,510 @@ User data storage and management
 """
 
 import os
+import sys
 import json
+import time
+import asyncio
+import itertools
 import logging
+import threading
+from concurrent.futures import Future
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Optional
+from user_stats import stats_table
 
 logger = logging.getLogger(__name__)
 
-# Path to user data file
+# Path to the legacy single-file user data, migrated into shards on load
 USER_DATA_FILE = "data/users.json"
 
-# In-memory storage for user data
-users = {}
+# Format used for timestamps in the JSON file
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _parse_timestamp(value):
+    """Convert a stored timestamp (formatted string or epoch number) to epoch seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            # fromisoformat reads DATE_FORMAT too and is far cheaper than strptime
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def format_timestamp(timestamp):
+    """Format epoch seconds the same way the JSON file stores them"""
+    if not timestamp:
+        return "Unknown"
+    return datetime.fromtimestamp(timestamp).strftime(DATE_FORMAT)
+
+
+@dataclass(slots=True)
+class UserRecord:
+    """Per-user record kept in memory for every known user"""
+    user_id: int
+    username: str = "Anonymous"
+    registration_date: float = field(default_factory=time.time)
+    last_activity: float = field(default_factory=time.time)
+    balance: float = 0
+    games_played: int = 0
+    even_odd_games: int = 0
+    higher_lower_games: int = 0
+    bowling_games: int = 0
+    favorite_game: Optional[str] = None
+    wins: int = 0
+    losses: int = 0
+    net_profit: float = 0
+    current_streak: int = 0  # positive for wins in a row, negative for losses
+    best_streak: int = 0
+    # The user blocked the bot; skipped by broadcasts until they come back
+    blocked: bool = False
+    # Journaled games whose stake was debited and which are not settled
+    # yet; saved with the balance so a settlement is applied exactly once
+    open_games: list = field(default_factory=list)
+    # Bumped on every update, used as a cache key for rendered views
+    version: int = 0
+
+    def __post_init__(self):
+        # Most users share a handful of names ("Anonymous" etc.), keep one copy
+        self.username = sys.intern(self.username or "Anonymous")
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a record from the JSON shape stored in users.json"""
+        return cls(
+            user_id=int(data["user_id"]),
+            username=data.get("username") or "Anonymous",
+            registration_date=_parse_timestamp(data.get("registration_date")),
+            last_activity=_parse_timestamp(data.get("last_activity")),
+            balance=data.get("balance", 0),
+            games_played=data.get("games_played", 0),
+            even_odd_games=data.get("even_odd_games", 0),
+            higher_lower_games=data.get("higher_lower_games", 0),
+            bowling_games=data.get("bowling_games", 0),
+            favorite_game=data.get("favorite_game"),
+            wins=data.get("wins", 0),
+            losses=data.get("losses", 0),
+            net_profit=data.get("net_profit", 0),
+            current_streak=data.get("current_streak", 0),
+            best_streak=data.get("best_streak", 0),
+            blocked=data.get("blocked", False),
+            open_games=list(data.get("open_games", ())),
+        )
+
+    def to_dict(self):
+        """Convert the record back to the JSON shape stored in users.json"""
+        data = {
+            "user_id": self.user_id,
+            "username": self.username,
+            "registration_date": format_timestamp(self.registration_date),
+            "games_played": self.games_played,
+            "favorite_game": self.favorite_game,
+            "balance": self.balance,
+            "even_odd_games": self.even_odd_games,
+            "higher_lower_games": self.higher_lower_games,
+            "bowling_games": self.bowling_games,
+            "wins": self.wins,
+            "losses": self.losses,
+            "net_profit": self.net_profit,
+            "current_streak": self.current_streak,
+            "best_streak": self.best_streak,
+            "blocked": self.blocked,
+            "last_activity": format_timestamp(self.last_activity),
+        }
+        if self.open_games:
+            data["open_games"] = list(self.open_games)
+        return data
+
+
+# Game type -> UserRecord counter of games played in that mode
+GAME_COUNTERS = {
+    "even_odd": "even_odd_games",
+    "higher_lower": "higher_lower_games",
+    "bowling": "bowling_games",
+}
+
+# Sharded on-disk layout: USER_DATA_DIR/shard_XXX.json plus a small index
+USER_DATA_DIR = "data/users"
+USER_INDEX_FILE = os.path.join(USER_DATA_DIR, "index.json")
+
+# Number of shard files used for new data directories
+SHARD_COUNT = 64
+
+# Maximum number of shards kept in memory at once
+MAX_LOADED_SHARDS = 16
+
+# Shard count of the current data directory (read from the index)
+_shard_count = SHARD_COUNT
+_user_count = 0
+
+# Loaded shards in LRU order: shard number -> {user_id: UserRecord}
+_shards = OrderedDict()
+_dirty_shards = set()
+
+# Users who wrote to the bot again while their shard was not loaded:
+# shard number -> user IDs whose blocked flag is cleared when it loads
+_pending_unblocks = {}
+
+# Source of UserRecord.version values
+_record_versions = itertools.count(1)
+
+# Result of a load_user_data call running in a background thread
+_loading = None
+
+# Callbacks called with the records of every shard faulted in from disk
+_load_listeners = [stats_table.upsert_many]
+
+
+def add_shard_load_listener(callback):
+    """Register a callback receiving the records of each shard loaded from disk"""
+    _load_listeners.append(callback)
+
+def configure_storage(data_dir):
+    """Point user storage at another directory, e.g. one per cluster worker"""
+    global USER_DATA_DIR, USER_INDEX_FILE, USER_DATA_FILE
+    USER_DATA_DIR = os.path.join(data_dir, "users")
+    USER_INDEX_FILE = os.path.join(USER_DATA_DIR, "index.json")
+    USER_DATA_FILE = os.path.join(data_dir, "users.json")
+
+def _shard_of(user_id):
+    return user_id % _shard_count
+
+def _shard_path(shard):
+    return os.path.join(USER_DATA_DIR, f"shard_{shard:03d}.json")
+
+def _read_shard_file(shard):
+    path = _shard_path(shard)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        raw_users = json.load(file)
+    return {int(user_id): UserRecord.from_dict({"user_id": user_id, **data})
+            for user_id, data in raw_users.items()}
+
+def _write_json(path, data, **options):
+    """
+    Write JSON to a temporary file and rename it over `path`
+
+    Readers (and snapshots, which hard-link shard files) see either the old
+    or the new file, never a partly written one.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        # dumps() uses the C encoder, dump() encodes in Python chunk by chunk
+        file.write(json.dumps(data, **options))
+    os.replace(temp_path, path)
+
+def _write_shard_file(shard, records):
+    # Compact: indentation would also force the pure-Python encoder
+    _write_json(_shard_path(shard),
+                {str(user_id): record.to_dict() for user_id, record in records.items()},
+                ensure_ascii=False, separators=(",", ":"))
+
+def _write_index():
+    _write_json(USER_INDEX_FILE, {"shard_count": _shard_count, "user_count": _user_count})
+
+def _get_shard(shard):
+    """Return a shard's records, faulting it in from disk and evicting cold shards"""
+    records = _shards.get(shard)
+    if records is not None:
+        _shards.move_to_end(shard)
+        return records
+
+    try:
+        records = _read_shard_file(shard)
+    except Exception as e:
+        logger.error(f"Error loading user shard {shard}: {e}")
+        records = {}
+    _shards[shard] = records
+    for user_id in _pending_unblocks.pop(shard, ()):
+        record = records.get(user_id)
+        if record is not None and record.blocked:
+            record.blocked = False
+            _dirty_shards.add(shard)
+    for callback in _load_listeners:
+        callback(records.values())
+
+    while len(_shards) > MAX_LOADED_SHARDS:
+        cold_shard, cold_records = _shards.popitem(last=False)
+        if cold_shard in _dirty_shards:
+            try:
+                _write_shard_file(cold_shard, cold_records)
+                _dirty_shards.discard(cold_shard)
+            except Exception as e:
+                # Keep unsaved data in memory rather than losing it
+                logger.error(f"Error saving evicted user shard {cold_shard}: {e}")
+                _shards[cold_shard] = cold_records
+                break
+    return records
+
+def _migrate_legacy_file():
+    """Split the old single-file users.json into shards"""
+    global _user_count
+    with open(USER_DATA_FILE, 'r', encoding='utf-8') as file:
+        raw_users = json.load(file)
+    shards = {}
+    for user_id, data in raw_users.items():
+        record = UserRecord.from_dict({"user_id": user_id, **data})
+        shards.setdefault(_shard_of(record.user_id), {})[record.user_id] = record
+    for shard, records in shards.items():
+        _write_shard_file(shard, records)
+    _user_count = len(raw_users)
+    _write_index()
+    logger.info(f"Migrated {_user_count} user records from {USER_DATA_FILE} into {len(shards)} shards")
 
 def load_user_data():
-    """Load user data from JSON file"""
-    global users
+    """Read the user index; shards are loaded lazily on first access"""
+    global _shard_count, _user_count
+    _shards.clear()
+    _dirty_shards.clear()
+    _pending_unblocks.clear()
+    stats_table.clear()
+    _shard_count = SHARD_COUNT
+    _user_count = 0
     try:
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r', encoding='utf-8') as file:
-                users = json.load(file)
-                logger.info(f"Loaded {len(users)} user records from file")
+        os.makedirs(USER_DATA_DIR, exist_ok=True)
+        if os.path.exists(USER_INDEX_FILE):
+            with open(USER_INDEX_FILE, 'r', encoding='utf-8') as file:
+                index = json.load(file)
+            _shard_count = index["shard_count"]
+            _user_count = index["user_count"]
+            logger.info(f"Found {_user_count} user records in {_shard_count} shards")
+        elif os.path.exists(USER_DATA_FILE):
+            _migrate_legacy_file()
         else:
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(USER_DATA_FILE), exist_ok=True)
-            users = {}
+            _write_index()
             logger.info("No user data file found, starting with empty data")
     except Exception as e:
         logger.error(f"Error loading user data: {e}")
-        users = {}
+
+def start_loading_user_data():
+    """
+    Run load_user_data in a background thread, at most once
+
+    Lets loading overlap with module imports and the Telegram warm-up.
+    """
+    global _loading
+    if _loading is None:
+        _loading = Future()
+
+        def load():
+            load_user_data()
+            _loading.set_result(None)
+
+        threading.Thread(target=load, name="user-data-load", daemon=True).start()
+    return _loading
+
+async def wait_for_user_data():
+    """Wait until a load started with start_loading_user_data has finished"""
+    await asyncio.wrap_future(start_loading_user_data())
 
 def save_user_data():
-    """Save user data to JSON file"""
+    """Save modified user shards and the index"""
     try:
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(USER_DATA_FILE), exist_ok=True)
-        
-        with open(USER_DATA_FILE, 'w', encoding='utf-8') as file:
-            json.dump(users, file, ensure_ascii=False, indent=2)
-        logger.info(f"Saved {len(users)} user records to file")
+        os.makedirs(USER_DATA_DIR, exist_ok=True)
+        saved = 0
+        for shard in list(_dirty_shards):
+            _write_shard_file(shard, _shards[shard])
+            _dirty_shards.discard(shard)
+            saved += 1
+        _write_index()
+        logger.info(f"Saved {saved} user shards ({_user_count} user records)")
     except Exception as e:
         logger.error(f"Error saving user data: {e}")
 
-def get_user_data(user_id):
+def import_user_records(records):
+    """Store records as they are, without touching last activity (used for re-sharding)"""
+    global _user_count
+    for record in records:
+        shard = _shard_of(record.user_id)
+        shard_records = _get_shard(shard)
+        if record.user_id not in shard_records:
+            _user_count += 1
+        shard_records[record.user_id] = record
+        _dirty_shards.add(shard)
+        stats_table.upsert(record)
+
+def iter_user_records(data_dir):
+    """Yield every UserRecord stored under another data directory, one shard at a time"""
+    users_dir = os.path.join(data_dir, "users")
+    legacy_file = os.path.join(data_dir, "users.json")
+    if os.path.isdir(users_dir):
+        file_names = sorted(name for name in os.listdir(users_dir) if name.startswith("shard_"))
+        paths = [os.path.join(users_dir, name) for name in file_names]
+    elif os.path.exists(legacy_file):
+        paths = [legacy_file]
+    else:
+        paths = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as file:
+            raw_users = json.load(file)
+        for user_id, data in raw_users.items():
+            yield UserRecord.from_dict({"user_id": user_id, **data})
+
+async def preload_user_shards():
+    """Walk every shard once in the background so listeners see all users"""
+    for shard in range(_shard_count):
+        if shard not in _shards:
+            _get_shard(shard)
+        # Yield to live updates between shards
+        await asyncio.sleep(0)
+    logger.info(f"Preloaded {_shard_count} user shards")
+
+def get_user_data(user_id) -> Optional[UserRecord]:
     """Get user data for a specific user"""
-    user_id = str(user_id)  # Convert to string for use as dictionary key
-    return users.get(user_id)
+    user_id = int(user_id)
+    return _get_shard(_shard_of(user_id)).get(user_id)
 
-def update_user_data(user_id, data):
+def update_user_data(user_id, data: UserRecord):
     """Update user data for a specific user"""
-    user_id = str(user_id)  # Convert to string for use as dictionary key
-    users[user_id] = data
+    global _user_count
+    user_id = int(user_id)
+    shard = _shard_of(user_id)
+    records = _get_shard(shard)
+    if user_id not in records:
+        _user_count += 1
+    records[user_id] = data
+    _dirty_shards.add(shard)
     # Update last activity timestamp
-    users[user_id]["last_activity"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    data.last_activity = time.time()
+    # Versions come from one process-wide counter so they stay unique even
+    # when a record is evicted and reloaded with version 0
+    data.version = next(_record_versions)
+    # Keep the columnar stats in sync
+    stats_table.upsert(data)
+
+def record_game(user_id, game_type, bet_amount, payout):
+    """
+    Update the per-user game statistics after a settled game
+
+    Args:
+        user_id: Telegram user ID
+        game_type: Type of game (even_odd, higher_lower, bowling)
+        bet_amount: Bet amount in TON
+        payout: Amount credited back to the user (0 if the bet was lost)
+
+    Returns:
+        UserRecord: The updated record, or None for unknown users
+    """
+    user_data = get_user_data(user_id)
+    if not user_data:
+        return None
+
+    user_data.games_played += 1
+    counter = GAME_COUNTERS.get(game_type)
+    if counter:
+        games_in_mode = getattr(user_data, counter) + 1
+        setattr(user_data, counter, games_in_mode)
+        # Only the mode just played can overtake the current favorite
+        favorite_counter = GAME_COUNTERS.get(user_data.favorite_game)
+        if not favorite_counter or games_in_mode > getattr(user_data, favorite_counter):
+            user_data.favorite_game = game_type
+
+    user_data.net_profit += payout - bet_amount
+    if payout > 0:
+        user_data.wins += 1
+        user_data.current_streak = user_data.current_streak + 1 if user_data.current_streak > 0 else 1
+        user_data.best_streak = max(user_data.best_streak, user_data.current_streak)
+    else:
+        user_data.losses += 1
+        user_data.current_streak = user_data.current_streak - 1 if user_data.current_streak < 0 else -1
+
+    update_user_data(user_id, user_data)
+    return user_data
 
 def get_games_played(user_id):
     """Get the number of games played by user"""
-    user_data = get_user_data(str(user_id))
+    user_data = get_user_data(user_id)
     if user_data:
-        return user_data.get("games_played", 0)
+        return user_data.games_played
     return 0
 
 def get_registration_date(user_id):
     """Get user registration date"""
-    user_data = get_user_data(str(user_id))
+    user_data = get_user_data(user_id)
     if user_data:
-        return user_data.get("registration_date", "Unknown")
+        return format_timestamp(user_data.registration_date)
     return "Unknown"
 
 def get_favorite_game(user_id):
     """Get user's favorite game mode"""
-    user_data = get_user_data(str(user_id))
+    user_data = get_user_data(user_id)
     if user_data:
-        return user_data.get("favorite_game")
+        return user_data.favorite_game
     return None
 
+def _peek_shard(shard):
+    """A shard's records without making it resident, or None if it cannot be read"""
+    records = _shards.get(shard)
+    if records is None:
+        try:
+            records = _read_shard_file(shard)
+        except Exception as e:
+            logger.error(f"Error reading user shard {shard}: {e}")
+    return records
+
+def iter_user_ids():
+    """Yield all user IDs shard by shard without keeping shards loaded"""
+    for shard in range(_shard_count):
+        records = _peek_shard(shard)
+        if records is not None:
+            yield from list(records.keys())
+
+def iter_user_id_chunks(chunk_size, shard=0, offset=0):
+    """
+    Yield (shard, offset, user IDs) for users who have not blocked the bot
+
+    Users are walked shard by shard in insertion order, so a position
+    (shard, offset) stays valid while new users register; `offset` in each
+    chunk is where the next chunk starts, and passing it back resumes there.
+    """
+    for shard in range(shard, _shard_count):
+        records = _peek_shard(shard)
+        if records is None:
+            offset = 0
+            continue
+        records = list(records.values())
+        unblocked = _pending_unblocks.get(shard, ())
+        for start in range(offset, len(records), chunk_size):
+            chunk = records[start:start + chunk_size]
+            yield shard, start + len(chunk), [record.user_id for record in chunk
+                                              if not record.blocked or record.user_id in unblocked]
+        offset = 0
+
+def set_user_blocked(user_id, blocked):
+    """Mark whether a user blocked the bot, without counting it as activity"""
+    user_id = int(user_id)
+    shard = _shard_of(user_id)
+    record = _get_shard(shard).get(user_id)
+    if record is None or record.blocked == blocked:
+        return False
+    record.blocked = blocked
+    _dirty_shards.add(shard)
+    return True
+
+def unblock_user(user_id):
+    """
+    Clear the blocked flag of a user who wrote to the bot again. Runs for
+    every private update, so a shard that is not loaded is not read for it:
+    the flag is cleared when the shard loads.
+    """
+    user_id = int(user_id)
+    shard = _shard_of(user_id)
+    records = _shards.get(shard)
+    if records is None:
+        _pending_unblocks.setdefault(shard, set()).add(user_id)
+        return
+    record = records.get(user_id)
+    if record is not None and record.blocked:
+        record.blocked = False
+        _dirty_shards.add(shard)
+
 def get_all_users():
     """Get a list of all user IDs"""
-    return list(users.keys())
+    return list(iter_user_ids())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Columnar user statistics table for analytics queries
+"""
+
+import time
+import heapq
+import logging
+from array import array
+
+try:
+    import numpy
+except ImportError:  # optional: the aggregates fall back to Python scans
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# Column name -> array typecode. Names match UserRecord attributes.
+COLUMNS = {
+    "balance": "d",
+    "games_played": "q",
+    "even_odd_games": "q",
+    "higher_lower_games": "q",
+    "bowling_games": "q",
+    "last_activity": "d",
+}
+
+
+class StatsTable:
+    """
+    Typed array per column plus a user_id -> row index.
+
+    Rows are only ever appended or overwritten in place, so aggregates run
+    over contiguous machine-typed buffers instead of millions of objects.
+    With numpy installed they run on zero-copy views of those buffers.
+    """
+
+    def __init__(self):
+        self.user_ids = array("q")
+        self.columns = {name: array(code) for name, code in COLUMNS.items()}
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def clear(self):
+        """Drop all rows"""
+        self.user_ids = array("q")
+        self.columns = {name: array(code) for name, code in COLUMNS.items()}
+        self._rows = {}
+
+    def upsert(self, record):
+        """Insert or overwrite the row for a UserRecord"""
+        row = self._rows.get(record.user_id)
+        if row is None:
+            self._rows[record.user_id] = len(self.user_ids)
+            self.user_ids.append(record.user_id)
+            for name, column in self.columns.items():
+                column.append(getattr(record, name))
+        else:
+            for name, column in self.columns.items():
+                column[row] = getattr(record, name)
+
+    def upsert_many(self, records):
+        """Insert or overwrite the rows for several UserRecords"""
+        for record in records:
+            self.upsert(record)
+
+    def rebuild(self, records):
+        """Replace the table contents with the given records"""
+        self.clear()
+        for record in records:
+            self.upsert(record)
+        logger.info(f"Rebuilt stats table with {len(self)} rows")
+
+    def get(self, user_id, column):
+        """Get a single value, or None for unknown users"""
+        row = self._rows.get(user_id)
+        if row is None:
+            return None
+        return self.columns[column][row]
+
+    def _view(self, column):
+        """numpy view of a column's buffer; must not outlive the call (appends need the buffer free)"""
+        values = self.columns[column]
+        return numpy.frombuffer(values, dtype=values.typecode)
+
+    def _view_ids(self):
+        return numpy.frombuffer(self.user_ids, dtype=self.user_ids.typecode)
+
+    def total(self, column):
+        """Sum of a column over all users"""
+        if numpy is not None and len(self):
+            return self._view(column).sum().item()
+        return sum(self.columns[column])
+
+    def count_active_since(self, timestamp):
+        """Number of users whose last activity is at or after timestamp"""
+        if numpy is not None and len(self):
+            return int(numpy.count_nonzero(self._view("last_activity") >= timestamp))
+        return sum(1 for value in self.columns["last_activity"] if value >= timestamp)
+
+    def top(self, column, k=10):
+        """Top-k (user_id, value) pairs by column, highest first"""
+        if numpy is None or k >= len(self):
+            return [(user_id, value) for value, user_id in
+                    heapq.nlargest(k, zip(self.columns[column], self.user_ids))]
+        values = self._view(column)
+        user_ids = self._view_ids()
+        # Everyone at or above the k-th value, ties included, then ordered
+        # like nlargest would: by value, then by user ID
+        threshold = numpy.partition(values, len(values) - k)[len(values) - k]
+        rows = numpy.flatnonzero(values >= threshold)
+        rows = rows[numpy.lexsort((user_ids[rows], values[rows]))][::-1][:k]
+        return [(int(user_ids[row]), values[row].item()) for row in rows]
+
+
+# Shared table kept in sync by user_data
+stats_table = StatsTable()
+
+
+def get_total_balance():
+    """Total balance held by all users"""
+    return stats_table.total("balance")
+
+def get_total_games_played():
+    """Total number of games played by all users"""
+    return stats_table.total("games_played")
+
+def count_active_users(hours=24):
+    """Number of users active within the last `hours` hours"""
+    return stats_table.count_active_since(time.time() - hours * 3600)
+
+def get_top_users(column="balance", k=10):
+    """Top-k users by a stats column"""
+    return stats_table.top(column, k)
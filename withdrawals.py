@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Withdrawal queue with an asynchronous settlement worker
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from constants import (WITHDRAWALS_FILE, WITHDRAWAL_PARALLELISM,
+                       WITHDRAWAL_RETRY_DELAY, HANDLER_DEADLINE)
+from crypto_payments import TRANSACTIONS, execute_transfer, update_user_balance
+from ledger import ledger, TRANSFER
+
+logger = logging.getLogger(__name__)
+
+# Statuses a withdrawal can no longer leave
+FINAL_STATUSES = ("completed", "failed")
+
+
+class WithdrawalQueue:
+    """
+    Persistent queue of withdrawals settled by a pool of worker tasks.
+
+    The balance is debited when a withdrawal is submitted. Workers send the
+    transfers concurrently (at most `parallelism` at a time), retry transient
+    failures with the same spend_id, and refund the balance exactly once if
+    CryptoBot rejects the transfer. Every state change is written to `path`,
+    so queued withdrawals resume after a restart.
+    """
+
+    def __init__(self, path=WITHDRAWALS_FILE, parallelism=WITHDRAWAL_PARALLELISM):
+        self.path = path
+        self.parallelism = parallelism
+        self.jobs = {}  # transaction_id -> withdrawal transaction
+        self._queue = None
+        self._workers = []
+        self._bot = None
+
+    def load(self):
+        """Load withdrawals saved by a previous run"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self.jobs = json.load(file)
+                # Share the same dicts with the transaction log
+                TRANSACTIONS.update(self.jobs)
+                logger.info(f"Loaded {len(self.jobs)} withdrawals from file")
+        except Exception as e:
+            logger.error(f"Error loading withdrawals: {e}")
+
+    def save(self):
+        """Save the queue state atomically, a crash mid-write keeps the previous file"""
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.jobs, file, ensure_ascii=False)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving withdrawals: {e}")
+
+    def pending(self):
+        """IDs of withdrawals that still have to be settled"""
+        return [transaction_id for transaction_id, job in self.jobs.items()
+                if job["status"] not in FINAL_STATUSES]
+
+    def submit(self, user_id, amount, fee, wallet_address, cryptobot_user_id=None):
+        """
+        Debit the balance and queue a withdrawal
+
+        Returns:
+            str: Transaction ID
+        """
+        transaction_id = str(uuid.uuid4())
+        job = {
+            "user_id": user_id,
+            "type": "withdrawal",
+            "amount": amount,
+            "net_amount": amount - fee,
+            "fee": fee,
+            "wallet": wallet_address if not cryptobot_user_id else f"CryptoBot: {cryptobot_user_id}",
+            "cryptobot_user_id": cryptobot_user_id,
+            "spend_id": f"withdrawal_{user_id}_{transaction_id}",
+            "status": "queued",
+            "attempts": 0,
+            "created_at": time.time()
+        }
+
+        # Списываем средства заранее
+        update_user_balance(user_id, -amount, "withdrawal")
+        self.jobs[transaction_id] = job
+        TRANSACTIONS[transaction_id] = job
+        self.save()
+        if self._queue is not None:
+            self._queue.put_nowait(transaction_id)
+        logger.info(f"Queued withdrawal {transaction_id} of {amount} TON for user {user_id}")
+        return transaction_id
+
+    async def start(self, bot):
+        """Resume saved withdrawals and start the settlement workers"""
+        self._bot = bot
+        self._queue = asyncio.Queue()
+        self.load()
+        for transaction_id in self.pending():
+            self._queue.put_nowait(transaction_id)
+        loop = asyncio.get_running_loop()
+        self._workers = [loop.create_task(self._work()) for _ in range(self.parallelism)]
+        logger.info(f"Withdrawal settlement started with {self.parallelism} workers, "
+                    f"{self._queue.qsize()} withdrawals pending")
+
+    async def stop(self):
+        """Stop the workers; unsettled withdrawals stay queued on disk"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.save()
+
+    async def _work(self):
+        while True:
+            transaction_id = await self._queue.get()
+            try:
+                await self._settle(transaction_id)
+            except Exception as e:
+                logger.error(f"Error settling withdrawal {transaction_id}: {e}")
+
+    async def _settle(self, transaction_id):
+        job = self.jobs.get(transaction_id)
+        if job is None or job["status"] in FINAL_STATUSES:
+            return
+
+        job["status"] = "processing"
+        job["attempts"] += 1
+        self.save()
+
+        outcome = await execute_transfer(job, deadline=time.monotonic() + HANDLER_DEADLINE)
+
+        if outcome["success"]:
+            job["status"] = "completed"
+            job["transfer_id"] = outcome.get("transfer_id")
+            if job["transfer_id"] is not None:
+                ledger.record(TRANSFER, job["transfer_id"], job["user_id"], job["net_amount"],
+                              "TON", job["spend_id"])
+            message = f"✅ Вывод {job['net_amount']} TON выполнен."
+        elif outcome.get("retryable"):
+            # The transfer may or may not have gone through; retrying with the
+            # same spend_id is safe either way
+            job["status"] = "queued"
+            job["error"] = outcome.get("error")
+            self.save()
+            asyncio.get_running_loop().call_later(
+                WITHDRAWAL_RETRY_DELAY, self._queue.put_nowait, transaction_id)
+            return
+        else:
+            # Возвращаем средства пользователю
+            update_user_balance(job["user_id"], job["amount"], "refund")
+            job["status"] = "failed"
+            job["error"] = outcome.get("error")
+            message = (f"❌ Ошибка при создании вывода: {job['error']}\n"
+                       f"{job['amount']} TON возвращены на ваш баланс.")
+
+        job["settled_at"] = time.time()
+        self.save()
+        await self._notify(job["user_id"], message)
+
+    async def _notify(self, user_id, text):
+        if self._bot is None:
+            return
+        try:
+            await self._bot.send_message(chat_id=user_id, text=text)
+        except Exception as e:
+            logger.error(f"Error notifying user {user_id} about withdrawal: {e}")
+
+
+withdrawal_queue = WithdrawalQueue()